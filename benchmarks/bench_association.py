@@ -0,0 +1,360 @@
+#!/usr/bin/python3
+import json
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+import fish_school
+sys.path.insert(0, fish_school.SRC)
+from YoloBox import YoloBox
+from ObjectTrackManager import ObjectTrackManager
+from StreamingObjectTrackManager import ObjectTrackManager as StreamingObjectTrackManager
+
+'''
+  Association micro-benchmark
+
+  Times a single process_layer call against exactly N active tracks and M
+  detections, for every engine and every (N, M) of the grid. The engines take
+  turns on every sample, so a change of machine load hits them all alike. Each
+  sample starts from a fresh manager: layer 0 holds N fish which initialize N tracks,
+  layer 1 holds the same fish one frame later, the first M of them, or all N
+  plus M - N newcomers. Only the process_layer(1) call is timed.
+
+  Memory is measured in separate samples under tracemalloc, since tracing
+  slows allocation down: peak bytes allocated during the call.
+
+    engines  : legacy, partitioned, tiered, streaming, streaming-iou
+    results  : p50/p99/mean latency, peak allocation per frame, pair costs
+               computed per frame, per (engine, N, M)
+
+  usage: bench_association.py [--tracks 10,100] [--dets 10,100] [--samples n]
+                              [--engines legacy,streaming] [--baseline base.json]
+                              [--tolerance 0.3] [--absolute] [--plot scaling.png] [output.json]
+         bench_association.py --merge baseline.json run1.json run2.json ...
+
+  Every sample also times a fixed calibration workload, see calibrate, which
+  runs no tracker code. vs_calibration is the median over samples of an
+  engine's time over the calibration time of the same sample, which cancels
+  out the speed and the momentary load of the machine.
+
+  With --baseline, every matching (engine, N, M) is compared against the stored
+  results, and the exit status is 1 when any grew by more than tolerance. The
+  comparison is of vs_calibration, or of the raw p50 with --absolute, for
+  baselines recorded on the same machine. Every engine is checked, legacy and
+  the code they share included. The reference baseline is
+  baselines/association.json, of the default grid: --baseline default.
+
+  A single run's vs_calibration still drifts between processes by up to 25%,
+  so a baseline is the per case median of separate runs, written by --merge.
+  The reference baseline is the median of 12 runs, against which 8 further
+  runs of unchanged code strayed by at most 14% at 50 samples and by 20% at
+  15, hence SAMPLES and TOLERANCE. Rebuild it after an intended speed change.
+'''
+DEFAULT_TRACKS = [10, 30, 100]
+DEFAULT_DETS = [10, 30, 100]
+MEMORY_SAMPLES = 3
+SAMPLES = 50
+TOLERANCE = 0.3
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "association.json")
+# three classes, so partitioning has something to split
+SCHOOL = {"occlusion_rate": 0.0, "false_positives": 0.0, "class_mix": (1.0, 1.0, 1.0)}
+
+
+def batch_engine(**options):
+  '''
+  Batch ObjectTrackManager factory, options set as attributes
+  Returns a function of (layer 0, layer 1) to a manager ready for process_layer(1)
+  '''
+  def setup(layer0, layer1):
+    o = ObjectTrackManager(layers=[layer0, layer1])
+    for k,v in options.items():
+      setattr(o, k, v)
+    o.initialize_tracks()
+    return o
+  return setup
+
+
+def streaming_engine(**options):
+  '''
+  Streaming ObjectTrackManager factory, options set as attributes
+  '''
+  def setup(layer0, layer1):
+    o = StreamingObjectTrackManager()
+    for k,v in options.items():
+      setattr(o, k, v)
+    o.add_new_layer(layer0)
+    o.initialize_tracks()
+    o.add_new_layer(layer1)
+    return o
+  return setup
+
+
+ENGINES = {"legacy": batch_engine(),
+           "partitioned": batch_engine(partition_mode="category"),
+           "tiered": batch_engine(high_confidence=0.75),
+           "streaming": streaming_engine(),
+           "streaming-iou": streaming_engine(association_cost="iou")}
+
+
+def make_problem(N, M, seed):
+  '''
+  Two consecutive frames of a school, N boxes then M boxes
+  Returns (layer 0, layer 1) of YoloBoxes
+  '''
+  frames = fish_school.generate(frames=2, fish=max(N, M), seed=seed, **SCHOOL)
+  rows = [next(frames)[0], next(frames)[0]]
+  layer = lambda i,det: [YoloBox(float(d[0]), YoloBox.conv_yolox_bbox(d[2:].tolist()),
+                                 f"bench.{i:06d}.txt", confidence=float(d[1])) for d in det]
+  return layer(0, rows[0][:N]), layer(1, rows[1][:M])
+
+
+def pair_count(o, N, M):
+  '''
+  Pair costs the engine computed, padding included, engines without a count compute all N x M
+  '''
+  if hasattr(o, "pair_counts") and o.pair_counts["all"] > 0:
+    return o.pair_counts["computed"]
+  return N * M
+
+
+# calibration points, fixed for every run
+CALIBRATION = np.random.default_rng(0).uniform(0, 1000, (2, 60, 2))
+
+
+def calibrate():
+  '''
+  Fixed workload standing in for a frame of association without any tracker
+  code: pair distances and a stable sort in numpy, then a greedy Python loop
+  over the sorted pairs building small objects
+  Returns the assigned pairs
+  '''
+  a, b = CALIBRATION
+  d = np.sqrt(np.square(a[:,np.newaxis,0] - b[np.newaxis,:,0]) + np.square(a[:,np.newaxis,1] - b[np.newaxis,:,1]))
+  used_a, used_b, out = set(), set(), []
+  for k in np.argsort(d, axis=None, kind="stable").tolist():
+    i, j = divmod(k, len(b))
+    if i in used_a or j in used_b:
+      continue
+    used_a.add(i)
+    used_b.add(j)
+    out.append({"a": i, "b": j, "cost": float(d[i, j])})
+  return out
+
+
+def time_calibration():
+  t0 = time.perf_counter()
+  calibrate()
+  return time.perf_counter() - t0
+
+
+def run_cell(engines, N, M, samples):
+  '''
+  Time every engine at N tracks x M detections, the engines taking turns on
+  each sample so they see the same machine load, between two calibration runs
+  Returns a list of dicts of latency, memory and pair statistics, per engine
+  '''
+  times = {e: [] for e in engines}
+  relative = {e: [] for e in engines}
+  pairs = {e: [] for e in engines}
+  for s in range(samples):
+    problem = make_problem(N, M, s)
+    cal = time_calibration()
+    for engine in engines:
+      # layers are mutated by tracking, every engine gets fresh boxes
+      o = ENGINES[engine](*copy_problem(problem))
+      t0 = time.perf_counter()
+      o.process_layer(1)
+      times[engine].append(time.perf_counter() - t0)
+      pairs[engine].append(pair_count(o, N, M))
+    cal = (cal + time_calibration()) / 2
+    for engine in engines:
+      relative[engine].append(times[engine][-1] / cal)
+
+  results = []
+  for engine in engines:
+    peaks = []
+    for s in range(min(samples, MEMORY_SAMPLES)):
+      o = ENGINES[engine](*make_problem(N, M, s))
+      tracemalloc.start()
+      o.process_layer(1)
+      peaks.append(tracemalloc.get_traced_memory()[1])
+      tracemalloc.stop()
+
+    t = np.array(times[engine]) * 1e3
+    results.append({"engine": engine,
+                    "tracks": N,
+                    "detections": M,
+                    "samples": samples,
+                    "p50_ms": float(np.percentile(t, 50)),
+                    "p99_ms": float(np.percentile(t, 99)),
+                    "mean_ms": float(t.mean()),
+                    "vs_calibration": float(np.median(relative[engine])),
+                    "peak_alloc_bytes": int(np.median(peaks)),
+                    "pairs": float(np.mean(pairs[engine]))})
+  return results
+
+
+def copy_problem(problem):
+  '''
+  Fresh, unlinked copies of the boxes of a problem
+  '''
+  return tuple([YoloBox(yb.class_id, list(yb.bbox), yb.img_filename, confidence=yb.confidence) for yb in layer]
+               for layer in problem)
+
+
+def compare(results, baseline, tolerance, absolute = False):
+  '''
+  Compare vs_calibration, or p50 latencies when absolute, against a stored run
+  Returns a list of regressions, cases slower than the baseline by more than tolerance
+  '''
+  metric = "p50_ms" if absolute else "vs_calibration"
+  key = lambda r: (r["engine"], r["tracks"], r["detections"])
+  base = {key(r): r for r in baseline["cases"]}
+  regressions = []
+  for r in results:
+    b = base.get(key(r))
+    if b == None or metric not in r or metric not in b:
+      continue
+    ratio = r[metric] / max(b[metric], 1e-9)
+    r[f"baseline_{metric}"] = b[metric]
+    r["ratio"] = ratio
+    if ratio > 1 + tolerance:
+      regressions.append({"engine": r["engine"], "tracks": r["tracks"], "detections": r["detections"],
+                          "metric": metric, "value": r[metric], "baseline": b[metric], "ratio": ratio})
+  return regressions
+
+
+def merge_runs(runs):
+  '''
+  Per case median of several runs of the same grid, as a baseline
+  Returns a results dict like a single run's
+  '''
+  key = lambda r: (r["engine"], r["tracks"], r["detections"])
+  cases = {}
+  for run in runs:
+    for r in run["cases"]:
+      cases.setdefault(key(r), []).append(r)
+  merged = []
+  for rs in cases.values():
+    m = dict(rs[0])
+    for k in ["samples", "p50_ms", "p99_ms", "mean_ms", "vs_calibration", "peak_alloc_bytes", "pairs"]:
+      if all(k in r for r in rs):
+        m[k] = type(rs[0][k])(np.median([r[k] for r in rs]))
+    m.pop("ratio", None)
+    merged.append(m)
+  return dict(runs[0], cases=merged, regressions=[], runs=len(runs))
+
+
+def scaling_table(results):
+  '''
+  Fixed width text table of the results
+  '''
+  lines = [f"{'engine':<14}{'N':>6}{'M':>6}{'p50 ms':>10}{'p99 ms':>10}{'KiB/frame':>11}{'pairs':>9}"
+           f"{'vs calib':>10}{'vs base':>9}"]
+  for r in results:
+    rel = f"{r['vs_calibration']:.2f}x" if "vs_calibration" in r else "-"
+    ratio = f"{r['ratio']:.2f}x" if "ratio" in r else "-"
+    lines.append(f"{r['engine']:<14}{r['tracks']:>6}{r['detections']:>6}{r['p50_ms']:>10.3f}{r['p99_ms']:>10.3f}"
+                 f"{r['peak_alloc_bytes'] / 1024:>11.1f}{r['pairs']:>9.0f}{rel:>10}{ratio:>9}")
+  return "\n".join(lines)
+
+
+def plot(results, filename):
+  '''
+  p50 latency against N x M per engine, needs matplotlib
+  '''
+  try:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+  except ImportError:
+    print("matplotlib is not installed, skipping plot", file=sys.stderr)
+    return
+  fig, ax = plt.subplots(figsize=(8, 5))
+  for engine in dict.fromkeys(r["engine"] for r in results):
+    rs = sorted([r for r in results if r["engine"] == engine], key=lambda r: r["tracks"] * r["detections"])
+    ax.loglog([r["tracks"] * r["detections"] for r in rs], [r["p50_ms"] for r in rs], marker="o", label=engine)
+  ax.set_xlabel("tracks x detections")
+  ax.set_ylabel("p50 latency per frame (ms)")
+  ax.legend()
+  fig.savefig(filename, dpi=120)
+  plt.close(fig)
+
+
+def main():
+  if len(sys.argv) > 3 and sys.argv[1] == "--merge":
+    runs = []
+    for fn in sys.argv[3:]:
+      f = open(fn, "r")
+      runs.append(json.load(f))
+      f.close()
+    f = open(sys.argv[2], "w")
+    f.write(json.dumps(merge_runs(runs), indent=2))
+    f.close()
+    return
+  options = {"--tracks": DEFAULT_TRACKS, "--dets": DEFAULT_DETS, "--samples": SAMPLES,
+             "--engines": list(ENGINES), "--baseline": None, "--tolerance": TOLERANCE, "--plot": None}
+  convert = {"--tracks": lambda v: [int(x) for x in v.split(",")],
+             "--dets": lambda v: [int(x) for x in v.split(",")],
+             "--engines": lambda v: v.split(","),
+             "--samples": int,
+             "--tolerance": float}
+  absolute, rest, i = False, [], 1
+  while i < len(sys.argv):
+    a = sys.argv[i]
+    if a == "--absolute":
+      absolute = True
+      i += 1
+      continue
+    if a in options and i + 1 < len(sys.argv):
+      options[a] = convert.get(a, str)(sys.argv[i + 1])
+      i += 2
+      continue
+    rest.append(a)
+    i += 1
+  unknown = [e for e in options["--engines"] if e not in ENGINES]
+  if len(unknown) > 0:
+    print(f"unknown engines {unknown}, choose from {list(ENGINES)}")
+    exit(1)
+  if options["--baseline"] == "default":
+    options["--baseline"] = BASELINE
+
+  results = []
+  for N in options["--tracks"]:
+    for M in options["--dets"]:
+      results += run_cell(options["--engines"], N, M, options["--samples"])
+  # engine major, as in the table
+  results.sort(key=lambda r: options["--engines"].index(r["engine"]))
+
+  regressions = []
+  if options["--baseline"] != None:
+    f = open(options["--baseline"], "r")
+    baseline = json.load(f)
+    f.close()
+    regressions = compare(results, baseline, options["--tolerance"], absolute)
+  print(scaling_table(results), file=sys.stderr)
+  if options["--plot"] != None:
+    plot(results, options["--plot"])
+
+  s = json.dumps({"python": sys.version.split()[0],
+                  "numpy": np.__version__,
+                  "tolerance": options["--tolerance"],
+                  "metric": "p50_ms" if absolute else "vs_calibration",
+                  "cases": results,
+                  "regressions": regressions}, indent=2)
+  if len(rest) > 0:
+    f = open(rest[0], "w")
+    f.write(s)
+    f.close()
+  else:
+    print(s)
+  for r in regressions:
+    print(f"REGRESSION {r['engine']} N={r['tracks']} M={r['detections']}: {r['metric']} "
+          f"{r['value']:.3f} vs {r['baseline']:.3f} ({r['ratio']:.2f}x)", file=sys.stderr)
+  if len(regressions) > 0:
+    exit(1)
+
+if __name__ == '__main__':
+  main()
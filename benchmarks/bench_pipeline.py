@@ -0,0 +1,188 @@
+#!/usr/bin/python3
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import fish_school
+sys.path.insert(0, fish_school.SRC)
+import trackbuilder
+from chunk_functions import ChunkFxns, build_tracks_chunked
+
+'''
+  Pipeline benchmark
+
+  Times the load, build, link and export stages of trackbuilder on synthetic
+  fish school detections, for every combination of frame and fish counts.
+  Detections are written as yolox files to a temporary directory first, or
+  generated straight into layers with --memory, which skips the load stage.
+
+  usage: bench_pipeline.py [--frames 100,1000] [--fish 10,100] [--repeats n]
+                           [--motion school] [--memory] [--chunks 2,4,8]
+                           [--overlap 20] [output.json]
+
+  Full scale grid: --frames 100,1000,10000,100000 --fish 10,100,1000
+
+  With --chunks, the build stage is instead timed serially and chunked, see
+  chunk_functions, for every chunk count of the list, on in memory layers.
+  Besides the measured wall time of the process pool, which depends on the
+  cores at hand, every chunk is also timed alone in process: the critical
+  path, the serial parts plus the slowest chunk, is the wall time with at
+  least one free core per chunk, and serial time over it the speedup bound.
+'''
+DEFAULT_FRAMES = [100, 1000]
+DEFAULT_FISH = [10, 100]
+STAGES = ["load", "build", "link", "export"]
+
+
+def run_scenario(frames, fish, repeats = 3, motion = "school", memory = False):
+  '''
+  Time every stage of one scale, repeats times
+  Returns a dict of per-stage timings and sizes
+  '''
+  tmp = tempfile.mkdtemp(prefix="fish_school_")
+  try:
+    if memory:
+      names, layers = fish_school.make_layers(frames=frames, fish=fish, motion=motion)
+    else:
+      files = fish_school.write_yolox(tmp, frames=frames, fish=fish, motion=motion)
+    timings = {s: [] for s in STAGES}
+    for _ in range(repeats):
+      # the tracker reports on stdout, keep it off the results
+      with contextlib.redirect_stdout(sys.stderr):
+        t0 = time.perf_counter()
+        if memory:
+          # build mutates boxes, start from fresh copies
+          files = names
+          layer_list = [[copy_box(yb) for yb in layer] for layer in layers]
+        else:
+          layer_list = trackbuilder.load_layers(files)
+        t1 = time.perf_counter()
+        o = trackbuilder.build_tracks(files, layer_list)
+        t2 = time.perf_counter()
+        trackbuilder.freeze_tracks(o)
+        t3 = time.perf_counter()
+        out = io.StringIO()
+        trackbuilder.export_tracks(o, out)
+        t4 = time.perf_counter()
+      if not memory:
+        timings["load"].append(t1 - t0)
+      timings["build"].append(t2 - t1)
+      timings["link"].append(t3 - t2)
+      timings["export"].append(t4 - t3)
+  finally:
+    shutil.rmtree(tmp, ignore_errors=True)
+
+  boxes = sum(len(layer) for layer in layer_list)
+  result = {"frames": frames,
+            "fish": fish,
+            "motion": motion,
+            "source": "memory" if memory else "yolox",
+            "boxes": boxes,
+            "tracks": len(o.global_track_store),
+            "linked_tracks": len(o.linked_tracks),
+            "export_bytes": len(out.getvalue()),
+            "stages": {}}
+  for s,t in timings.items():
+    if len(t) == 0:
+      continue
+    t = sorted(t)
+    result["stages"][s] = {"min_s": t[0],
+                           "median_s": t[len(t) // 2],
+                           "boxes_per_s": boxes / max(t[0], 1e-12)}
+  result["total_min_s"] = sum(v["min_s"] for v in result["stages"].values())
+  return result
+
+
+def run_chunked(frames, fish, chunk_counts, overlap = 20, repeats = 3, motion = "school"):
+  '''
+  Time a serial build against chunked builds of the same layers, repeats times
+  Returns a dict of timings per chunk count, the minimum over repeats
+  '''
+  names, layers = fish_school.make_layers(frames=frames, fish=fish, motion=motion)
+  fresh = lambda: [[copy_box(yb) for yb in layer] for layer in layers]
+  timed = lambda fn: min(timeit(fn) for _ in range(repeats))
+  serial = timed(lambda: trackbuilder.build_tracks(names, fresh()))
+  result = {"frames": frames, "fish": fish, "motion": motion, "overlap": overlap,
+            "cores": os.cpu_count(), "serial_s": serial, "chunked": []}
+  for chunks in chunk_counts:
+    wall = timed(lambda: build_tracks_chunked(names, fresh(), chunks, overlap))
+    in_process = timed(lambda: build_tracks_chunked(names, fresh(), chunks, overlap, workers=1))
+    spans = ChunkFxns.split_chunks(frames, chunks, overlap)
+    packed = ChunkFxns.pack_layers(layers)
+    each = [timed(lambda: ChunkFxns.track_chunk(start, packed[start:stop])) for start,stop,_ in spans]
+    critical = in_process - sum(each) + max(each)
+    result["chunked"].append({"chunks": chunks,
+                              "wall_s": wall,
+                              "speedup": serial / wall,
+                              "in_process_s": in_process,
+                              "slowest_chunk_s": max(each),
+                              "critical_path_s": critical,
+                              "speedup_bound": serial / critical})
+  return result
+
+
+def timeit(fn):
+  t0 = time.perf_counter()
+  fn()
+  return time.perf_counter() - t0
+
+
+def copy_box(yb):
+  '''
+  Fresh, unlinked copy of a generated YoloBox
+  '''
+  return type(yb)(yb.class_id, list(yb.bbox), yb.img_filename, confidence=yb.confidence)
+
+
+def parse_list(s):
+  return [int(v) for v in s.split(",") if len(v) > 0]
+
+
+def main():
+  options = {"--frames": DEFAULT_FRAMES, "--fish": DEFAULT_FISH, "--repeats": 3, "--motion": "school",
+             "--chunks": None, "--overlap": 20}
+  memory, rest, i = False, [], 1
+  while i < len(sys.argv):
+    a = sys.argv[i]
+    if a == "--memory":
+      memory = True
+    elif a in options and i + 1 < len(sys.argv):
+      v = sys.argv[i + 1]
+      options[a] = parse_list(v) if a in {"--frames", "--fish", "--chunks"} else int(v) if a in {"--repeats", "--overlap"} else v
+      i += 1
+    else:
+      rest.append(a)
+    i += 1
+
+  scenarios = []
+  for frames in options["--frames"]:
+    for fish in options["--fish"]:
+      if options["--chunks"] != None:
+        r = run_chunked(frames, fish, options["--chunks"], options["--overlap"], options["--repeats"], options["--motion"])
+        for c in r["chunked"]:
+          print(f"{frames} frames x {fish} fish, {c['chunks']} chunks: {c['speedup']:.2f}x on "
+                f"{r['cores']} cores, {c['speedup_bound']:.2f}x bound", file=sys.stderr)
+        scenarios.append(r)
+        continue
+      r = run_scenario(frames, fish, options["--repeats"], options["--motion"], memory)
+      print(f"{frames} frames x {fish} fish: {r['total_min_s']:.3f}s", file=sys.stderr)
+      scenarios.append(r)
+  results = {"python": sys.version.split()[0],
+             "generator": dict(fish_school.DEFAULTS, motion=options["--motion"]),
+             "repeats": options["--repeats"],
+             "scenarios": scenarios}
+  s = json.dumps(results, indent=2)
+  if len(rest) > 0:
+    f = open(rest[0], "w")
+    f.write(s)
+    f.close()
+  else:
+    print(s)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+import subprocess
+import sys
+import json
+import time
+from os import path
+
+'''
+  Startup benchmark
+
+  Times a cold interpreter importing each entry point, and records which heavy
+  imaging modules got loaded along the way. The build and streaming paths
+  should only need NumPy.
+
+  usage: bench_startup.py [repeats] [output.json]
+'''
+SRC = path.join(path.dirname(path.abspath(__file__)), "..", "src")
+ENTRY_POINTS = ["trackbuilder", "OTFTrackerApi", "StreamingObjectTrackManager", "ObjectTrackManager"]
+HEAVY_MODULES = ["cv2", "magic", "PIL"]
+
+PROBE = '''
+import sys, time, json
+t0 = time.perf_counter()
+import {module}
+t1 = time.perf_counter()
+print(json.dumps({{"import_s": t1 - t0, "loaded": [m for m in {heavy} if m in sys.modules]}}))
+'''
+
+def time_entry_point(module, repeats = 5):
+  '''
+  Import a module in fresh interpreters
+  Returns a dict of wall and import timings
+  '''
+  walls, imports, loaded = [], [], []
+  for _ in range(repeats):
+    t0 = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                          cwd=SRC, capture_output=True, text=True)
+    walls.append(time.perf_counter() - t0)
+    if out.returncode != 0:
+      return {"module": module, "error": out.stderr.strip().split("\n")[-1]}
+    r = json.loads(out.stdout.strip().split("\n")[-1])
+    imports.append(r["import_s"])
+    loaded = r["loaded"]
+  return {"module": module,
+          "repeats": repeats,
+          "wall_s_min": min(walls),
+          "wall_s_median": sorted(walls)[len(walls) // 2],
+          "import_s_min": min(imports),
+          "import_s_median": sorted(imports)[len(imports) // 2],
+          "heavy_modules_loaded": loaded}
+
+
+def main():
+  repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+  results = {"python": sys.version.split()[0],
+             "entry_points": [time_entry_point(m, repeats) for m in ENTRY_POINTS]}
+  s = json.dumps(results, indent=2)
+  if len(sys.argv) > 2:
+    f = open(sys.argv[2], "w")
+    f.write(s)
+    f.close()
+  else:
+    print(s)
+
+if __name__ == '__main__':
+  main()
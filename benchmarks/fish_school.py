@@ -0,0 +1,171 @@
+#!/usr/bin/python3
+import os
+import sys
+import numpy as np
+from os import path
+
+'''
+  Synthetic fish school detections
+
+  A seeded generator of detector output for benchmarks. Fish swim in a frame of
+  frame_size pixels, bouncing off its edges, under one of three motion patterns:
+
+    linear      : constant velocity
+    random_walk : velocity perturbed every frame
+    school      : velocity pulled toward the school's mean heading and centroid
+
+  Fish are hidden for occlusion_frames at a time with probability occlusion_rate
+  per frame, false positives appear at false_positives boxes per frame, and
+  classes are drawn by class_mix weights. Frames are generated one at a time as
+  (N,6) yolox rows [class, confidence, min_x, min_y, max_x, max_y], so long
+  sequences can be streamed to disk.
+
+  usage: fish_school.py [output_dir] [frames] [fish] [optional_motion]
+'''
+SRC = path.join(path.dirname(path.abspath(__file__)), "..", "src")
+
+DEFAULTS = { "frames"            : 300,
+             "fish"              : 30,
+             "frame_size"        : (1920, 1080),
+             "box_size"          : (40, 20),
+             "motion"            : "school",
+             "speed"             : 6.0,
+             "jitter"            : 0.5,
+             "occlusion_rate"    : 0.005,
+             "occlusion_frames"  : (3, 15),
+             "false_positives"   : 0.5,
+             "class_mix"         : (1.0,),
+             "confidence"        : (0.5, 1.0),
+             "seed"              : 12345,
+           }
+MOTIONS = ["linear", "random_walk", "school"]
+
+
+def config(**kwargs):
+  '''
+  DEFAULTS updated with kwargs, unknown keys are rejected
+  '''
+  unknown = set(kwargs) - set(DEFAULTS)
+  if len(unknown) > 0:
+    raise KeyError(f"unknown fish school options {sorted(unknown)}")
+  cfg = dict(DEFAULTS, **kwargs)
+  if cfg["motion"] not in MOTIONS:
+    raise ValueError(f"motion must be one of {MOTIONS}")
+  return cfg
+
+
+def generate(**kwargs):
+  '''
+  Generate detections frame by frame, see DEFAULTS for options
+  Yields (detections (N,6), fish index (N,), -1 for false positives) per frame
+  '''
+  cfg = config(**kwargs)
+  rng = np.random.default_rng(cfg["seed"])
+  F = cfg["fish"]
+  size = np.array(cfg["frame_size"], dtype=np.float64)
+  half = np.array(cfg["box_size"], dtype=np.float64) / 2
+  weights = np.array(cfg["class_mix"], dtype=np.float64)
+  lo_conf, hi_conf = cfg["confidence"]
+  lo_occ, hi_occ = cfg["occlusion_frames"]
+
+  pos = rng.uniform(half, size - half, (F, 2))
+  heading = rng.uniform(0, 2 * np.pi, F)
+  vel = cfg["speed"] * np.stack([np.cos(heading), np.sin(heading)], axis=1)
+  classes = rng.choice(len(weights), F, p=weights / weights.sum()).astype(np.float64)
+  hidden = np.zeros(F, dtype=np.int64)   # frames left occluded
+
+  for _ in range(cfg["frames"]):
+    if cfg["motion"] == "random_walk":
+      vel += rng.normal(0, cfg["speed"] * 0.2, (F, 2))
+    elif cfg["motion"] == "school" and F > 0:
+      # align with the mean heading, drift toward the centroid
+      vel += 0.05 * (vel.mean(axis=0) - vel) + 0.001 * (pos.mean(axis=0) - pos)
+      vel += rng.normal(0, cfg["speed"] * 0.05, (F, 2))
+    if cfg["motion"] != "linear" and F > 0:
+      # hold the cruising speed
+      s = np.hypot(vel[:,0], vel[:,1])[:,np.newaxis]
+      vel *= cfg["speed"] / np.maximum(s, 1e-9)
+    pos += vel
+    # bounce off the frame edges
+    low, high = pos < half, pos > size - half
+    pos = np.where(low, 2 * half - pos, np.where(high, 2 * (size - half) - pos, pos))
+    vel = np.where(low | high, -vel, vel)
+
+    # occlusions
+    hidden = np.maximum(hidden - 1, 0)
+    start = (hidden == 0) & (rng.random(F) < cfg["occlusion_rate"])
+    hidden[start] = rng.integers(lo_occ, hi_occ + 1, start.sum())
+    seen = np.nonzero(hidden == 0)[0]
+
+    center = pos[seen] + rng.normal(0, cfg["jitter"], (len(seen), 2))
+    conf = rng.uniform(lo_conf, hi_conf, len(seen))
+    rows = [np.column_stack([classes[seen], conf, center - half, center + half])]
+    ids = [seen]
+
+    # false positives, low confidence and anywhere
+    n_fp = rng.poisson(cfg["false_positives"])
+    if n_fp > 0:
+      c = rng.uniform(half, size - half, (n_fp, 2))
+      rows.append(np.column_stack([rng.choice(len(weights), n_fp, p=weights / weights.sum()),
+                                   rng.uniform(0.05, lo_conf, n_fp), c - half, c + half]))
+      ids.append(np.full(n_fp, -1))
+    yield np.concatenate(rows), np.concatenate(ids)
+
+
+def frame_name(stem, i):
+  '''
+  Image filename of frame i, in the stem.NNNNNN.png form file_list_loader sorts by
+  '''
+  return f"{stem}.{i:06d}.png"
+
+
+def write_yolox(outdir, stem = "vid", **kwargs):
+  '''
+  Write generated detections as one yolox .txt file per frame and a files.txt
+  file list of the frames' image names, relative to outdir
+  Returns the absolute image paths, in frame order
+  '''
+  os.makedirs(outdir, exist_ok=True)
+  files = []
+  for i,(det, _) in enumerate(generate(**kwargs)):
+    name = frame_name(stem, i)
+    f = open(path.join(outdir, f"{name[:-3]}txt"), "w")
+    f.write("".join(f"{int(d[0])} {d[1]:.4f} {d[2]:.3f} {d[3]:.3f} {d[4]:.3f} {d[5]:.3f}\n" for d in det))
+    f.close()
+    files.append(name)
+  f = open(path.join(outdir, "files.txt"), "w")
+  f.write("\n".join(files) + "\n")
+  f.close()
+  return [path.join(path.abspath(outdir), fn) for fn in files]
+
+
+def make_layers(stem = "vid", **kwargs):
+  '''
+  Generate detections straight into YoloBox layers, as load_layers would return them
+  Returns (image names, layers)
+  '''
+  if SRC not in sys.path:
+    sys.path.insert(0, SRC)
+  from YoloBox import YoloBox
+  files, layers = [], []
+  for i,(det, _) in enumerate(generate(**kwargs)):
+    name = frame_name(stem, i)
+    txt = f"{name[:-3]}txt"
+    files.append(name)
+    layers.append([YoloBox(float(d[0]), YoloBox.conv_yolox_bbox(d[2:].tolist()), txt, confidence=float(d[1]))
+                   for d in det])
+  return files, layers
+
+
+def main():
+  if len(sys.argv) < 4:
+    print("usage: fish_school.py [output_dir] [frames] [fish] [optional_motion]")
+    exit(0)
+  kwargs = {"frames": int(sys.argv[2]), "fish": int(sys.argv[3])}
+  if len(sys.argv) > 4:
+    kwargs["motion"] = sys.argv[4]
+  files = write_yolox(sys.argv[1], **kwargs)
+  print(f"wrote {len(files)} frames to {sys.argv[1]}")
+
+if __name__ == '__main__':
+  main()
@@ -1,7 +1,8 @@
 
 import numpy as np
 from YoloBox import YoloBox
-from aux_functions import ImgFxns
+from probe_functions import ProbeFxns
+from TrackerStats import STATS
 from os import path
 import json
 
@@ -68,19 +69,27 @@ class AnnotationLoader:
     Returns a (possibly empty) list of yoloboxes
     '''
     # expects *.png or similar
-    image_w, image_h = ImgFxns.get_img_shape(valid_png_file)
     valid_filename = valid_png_file[:-3] + "txt"
 
+    lap = STATS.start()
     annotations = AnnotationLoader.load_annotations_from_text_file(valid_filename)
+    lap = STATS.lap("load", lap)
     if len(annotations) == 0:
       print(f"EMPTY FILE: {valid_filename}")
       return []
     
     # select yolo parser
     if len(annotations[0].split()) == AnnotationLoader.YOLOX_LEN:
-      return AnnotationLoader.parse_yolox_annotations(annotations, valid_filename)
+      layer = AnnotationLoader.parse_yolox_annotations(annotations, valid_filename)
+      STATS.lap("parse", lap)
+      return layer
     elif len(annotations[0].split()) == AnnotationLoader.YOLO_LEN:
-      return AnnotationLoader.parse_yolo_annotations(annotations, valid_filename, image_w, image_h)
+      # normalized coordinates, the image is only probed for its dimensions here
+      image_w, image_h = ProbeFxns.get_img_shape(valid_png_file)
+      lap = STATS.lap("probe", lap)
+      layer = AnnotationLoader.parse_yolo_annotations(annotations, valid_filename, image_w, image_h)
+      STATS.lap("parse", lap)
+      return layer
     else:
       print(f"SKIPPING {valid_filename}: ANNOTATIONS FORMAT NOT RECOGNIZED")
       return []
@@ -109,7 +118,7 @@ class AnnotationLoader:
       b = s[i].split()
       bx = [float(val) for val in b[2:]]
       cbx = YoloBox.conv_yolox_bbox(bx)
-      yoloboxes.append(YoloBox(float(b[0]), cbx, valid_file, float(b[1])))
+      yoloboxes.append(YoloBox(float(b[0]), cbx, valid_file, confidence=float(b[1])))
     
     return yoloboxes
   
@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+import time
+import numpy as np
+
+from StreamingObjectTrackManager import ObjectTrackManager
+from OTFTrackerApi import StreamingAnnotations
+from association_functions import AssociationFxns
+from categories import CATEGORIES
+
+'''
+  Multi-stream tracking in a single process
+
+  streams: {stream_id : ObjectTrackManager}
+      one isolated streaming manager per camera
+
+  Frames from several streams arriving in the same tick are associated
+  together: predictions and detections of streams with similar track and
+  detection counts are padded into one block, distances and pair sorting run
+  as one vectorized call per block, then each stream assigns its own pairs.
+  See AssociationFxns.batched_sorted_pairs. Streams with an overlap
+  association_cost or a frame_budget take their own process_layer instead.
+'''
+
+class MultiStreamObjectTrackManager:
+  def __init__(self, categories = CATEGORIES):
+    self.streams = {}
+    self.pending = {}   # stream_id -> layer_idx waiting for the next tick
+    self.pair_counts = {"pairs": 0, "computed": 0}   # real pairs, costs computed including padding
+    self.categories = categories
+
+
+  def get_stream(self, stream_id):
+    '''
+    Accessor for the manager of a stream, created on first use
+    '''
+    if stream_id not in self.streams:
+      self.streams[stream_id] = ObjectTrackManager(categories=self.categories)
+    return self.streams[stream_id]
+
+
+  def add_new_layer(self, stream_id, yolobox_arr, frame_no = None):
+    '''
+    Queue a layer of registered annotations for a stream, keyed by frame_no when given
+    A stream holds at most one pending layer, earlier ones are processed first
+    '''
+    if stream_id in self.pending:
+      self.process_tick([stream_id])
+    otm = self.get_stream(stream_id)
+    if frame_no != None:
+      otm.add_new_timed_layer(yolobox_arr, frame_no)
+    else:
+      otm.add_new_layer(yolobox_arr)
+    self.pending[stream_id] = len(otm.layers) - 1
+
+
+  def add_new_LOCO_annotations(self, stream_id, LOCO_annos):
+    '''
+    Wrapper calling out to StreamingAnnotations ingest
+    '''
+    self.add_new_layer(stream_id, StreamingAnnotations.register_new_LOCO_annotations(LOCO_annos))
+
+
+  def process_tick(self, stream_ids = None):
+    '''
+    Associate the pending layers of all (or the given) streams in one batch
+    Streams with an overlap association_cost or a frame_budget are processed
+    on their own by their process_layer, only center distances are batched
+    Returns {stream_id : layer_idx} of processed layers
+    '''
+    if stream_ids == None:
+      stream_ids = list(self.pending.keys())
+    stream_ids = [s for s in stream_ids if s in self.pending]
+
+    processed = {}
+    batch, preds, dets = [], [], []
+    for sid in stream_ids:
+      otm = self.streams[sid]
+      layer_idx = self.pending.pop(sid)
+      processed[sid] = layer_idx
+      if otm.association_cost != "distance" or otm.frame_budget != None:
+        otm.process_layer(layer_idx)
+        continue
+      st = otm.stats
+      t_frame = st.start()
+      otm.reap_expired(otm.layer_position(layer_idx))
+      lap = st.lap("reap", t_frame)
+      tracks, pred = otm.predict_heads(otm.layer_frames.get(layer_idx))
+      lap = st.lap("predict", lap)
+      # time spent on this stream's frame outside the shared batch
+      batch.append((otm, layer_idx, tracks, lap - t_frame))
+      preds.append(pred)
+      dets.append(otm.layer_centers(layer_idx))
+
+    t_batch = time.perf_counter()
+    sorted_pairs, computed = AssociationFxns.batched_sorted_pairs(preds, dets)
+    t_batch = time.perf_counter() - t_batch
+    pairs = [len(p) * len(d) for p,d in zip(preds, dets)]
+    self.pair_counts["pairs"] += sum(pairs)
+    self.pair_counts["computed"] += computed
+    for (otm, layer_idx, tracks, own), (d_idx, t_idx, dist), n in zip(batch, sorted_pairs, pairs):
+      st = otm.stats
+      # each frame is charged its share of the batch, pairing and sorting together
+      share = t_batch * n / max(sum(pairs), 1)
+      if st.enabled:
+        st.add_time("pair", share)
+      st.count("pairs_evaluated", len(dist))
+      t_assign = st.start()
+      otm.assign_pairs(layer_idx, tracks, d_idx, t_idx, dist)
+      st.end_frame(t_assign - own - share, len(otm.active_tracks), otm.layer_position(layer_idx))
+    return processed
+
+
+  def ingest_tick(self, frames):
+    '''
+    Register and associate one tick of frames
+      frames: {stream_id : list of LOCO annotations}
+    Returns {stream_id : list of track ids, one per detection}
+    '''
+    for sid, annos in frames.items():
+      self.add_new_LOCO_annotations(sid, annos)
+    processed = self.process_tick(list(frames.keys()))
+    return {sid: [yb.parent_track for yb in self.streams[sid].layers[layer_idx]]
+            for sid, layer_idx in processed.items()}
+
+
+  def get_track(self, stream_id, track_id):
+    '''
+    Accessor for ObjectTrack entities by stream and track_id
+    '''
+    return self.streams[stream_id].get_track(track_id)
+
@@ -80,6 +80,30 @@ class StreamingAnnotations:
     return yoloboxes
 
 
+  def register_array_annotations(arr, valid_frame_name = "frame_"):
+    '''
+    Register detections from a packed array, without any text parsing
+      arr: (K,6) [class_id, confidence, center_x, center_y, width, height]
+    Returns a list of YoloBoxes
+    '''
+    yoloboxes = []
+    for row in np.asarray(arr, dtype=np.float64).reshape(-1, 6).tolist():
+      yoloboxes.append(YoloBox(row[0], row[2:], valid_frame_name, confidence=row[1]))
+    return yoloboxes
+
+
+  def register_array_layer(arr, valid_frame_name = "frame_"):
+    '''
+    Register detections from a packed array without copying it
+      arr: (K,6) [class_id, confidence, center_x, center_y, width, height]
+    Each YoloBox bbox is a row view into arr, so arr must not be reused
+    Returns a list of YoloBoxes
+    '''
+    bboxes = arr[:,2:6]
+    meta = arr[:,:2].tolist()
+    return [YoloBox(m[0], bboxes[i], valid_frame_name, confidence=m[1]) for i,m in enumerate(meta)]
+
+
   def register_annotation(class_id = 0, bbox = [], valid_frame_name = "frame_"):
     '''
     Registers an annotation as a YoloBox
@@ -0,0 +1,272 @@
+#!/usr/bin/python3
+import asyncio
+import concurrent.futures
+import json
+import struct
+import sys
+import time
+import numpy as np
+
+from MultiStreamObjectTrackManager import MultiStreamObjectTrackManager
+from OTFTrackerApi import StreamingAnnotations
+
+'''
+  Local asyncio ingestion server for the on-the-fly tracker
+
+  Every message, in both directions, is a 4 byte big-endian length followed
+  by that many bytes. A request body starts with one kind byte:
+
+    b'J' JSON  {"stream_id": int, "frame": int, "annotations": [LOCO annotations]},
+         "frame" is optional
+    b'B' binary header ">IQI" (stream_id, frame_no, count), then count rows of
+         little-endian float32 [class_id, confidence, cx, cy, w, h]
+
+  The frame number keys the layer in its stream, so lifespans and motion
+  prediction count dropped frames. Binary detections are named frame_<frame_no>.
+
+  Replies mirror the request kind:
+
+    b'J' JSON  {"stream_id": int, "layer": int, "track_ids": [int | null]}
+    b'B' binary header ">IQI" (stream_id, layer, count), then count
+         little-endian int32 track ids, -1 for unassigned detections
+    b'E' utf-8 error message for a request which could not be processed
+
+  Backpressure: a connection has at most `max_inflight` unanswered frames and
+  the tracker queue holds at most `max_queue` frames. When either is full the
+  connection stops reading from its socket, so a slow tracker pushes back on
+  the detector through the kernel socket buffers instead of buffering here.
+
+  usage:
+    OTFTrackerServer.py serve   [unix:/path | host:port]
+    OTFTrackerServer.py loadgen [unix:/path | host:port] [frames] [detections] [streams] [json | binary]
+'''
+HEADER = struct.Struct(">I")
+BIN_HEADER = struct.Struct(">IQI")
+
+class OTFTrackerServer:
+  def __init__(self, manager = None, max_queue = 64, max_inflight = 8):
+    self.manager = manager if manager != None else MultiStreamObjectTrackManager()
+    self.max_queue = max_queue
+    self.max_inflight = max_inflight
+    self.queue = None
+    # a single tracker thread owns the manager, keeping the event loop free for I/O
+    self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    self.frames = 0
+
+
+  def decode_request(body):
+    '''
+    Decode a request body
+    Returns (kind, stream_id, frame number or None, list of YoloBoxes)
+    '''
+    kind = body[:1]
+    if kind == b'J':
+      req = json.loads(body[1:])
+      return kind, req.get("stream_id", 0), req.get("frame"), StreamingAnnotations.register_new_LOCO_annotations(req["annotations"])
+    if kind == b'B':
+      stream_id, frame_no, count = BIN_HEADER.unpack_from(body, 1)
+      arr = np.frombuffer(body, dtype="<f4", count=count * 6, offset=1 + BIN_HEADER.size).reshape(count, 6)
+      return kind, stream_id, frame_no, StreamingAnnotations.register_array_annotations(arr, f"frame_{frame_no}")
+    raise ValueError(f"unknown request kind {kind}")
+
+
+  def encode_reply(kind, stream_id, layer_idx, track_ids):
+    '''
+    Encode a reply body in the request's format
+    '''
+    if kind == b'J':
+      return b'J' + json.dumps({"stream_id": stream_id, "layer": layer_idx, "track_ids": track_ids}).encode()
+    ids = np.array([-1 if t == None else t for t in track_ids], dtype="<i4")
+    return b'B' + BIN_HEADER.pack(stream_id, layer_idx, len(ids)) + ids.tobytes()
+
+
+  def process_batch(self, batch):
+    '''
+    Tracker thread: associate one tick, at most one frame per stream
+    Returns a list of reply bodies
+    '''
+    M = self.manager
+    for kind, stream_id, frame_no, layer, fut in batch:
+      M.add_new_layer(stream_id, layer, frame_no)
+    processed = M.process_tick([b[1] for b in batch])
+    replies = []
+    for kind, stream_id, frame_no, layer, fut in batch:
+      layer_idx = processed[stream_id]
+      replies.append(OTFTrackerServer.encode_reply(kind, stream_id, layer_idx, [yb.parent_track for yb in layer]))
+    return replies
+
+
+  async def tracker_loop(self):
+    '''
+    Drain the tracker queue, batching frames of different streams into one tick
+    '''
+    loop = asyncio.get_running_loop()
+    carry = None
+    while True:
+      item = carry if carry != None else await self.queue.get()
+      carry = None
+      batch, streams = [item], {item[1]}
+      while not self.queue.empty():
+        nxt = self.queue.get_nowait()
+        if nxt[1] in streams:
+          # keep frames of a stream in order, next tick
+          carry = nxt
+          break
+        batch.append(nxt)
+        streams.add(nxt[1])
+      try:
+        replies = await loop.run_in_executor(self.executor, self.process_batch, batch)
+        for b, r in zip(batch, replies):
+          b[4].set_result(r)
+      except Exception as e:
+        for b in batch:
+          if not b[4].done():
+            b[4].set_exception(e)
+      self.frames += len(batch)
+
+
+  async def handle_connection(self, reader, writer):
+    '''
+    Read framed requests and write replies in order, with bounded in-flight frames
+    '''
+    loop = asyncio.get_running_loop()
+    inflight = asyncio.Queue(maxsize=self.max_inflight)
+
+    async def reply_loop():
+      while True:
+        fut = await inflight.get()
+        if fut == None:
+          break
+        try:
+          body = await fut
+        except Exception as e:
+          body = b'E' + str(e).encode()
+        writer.write(HEADER.pack(len(body)) + body)
+        await writer.drain()
+
+    replier = asyncio.create_task(reply_loop())
+    try:
+      while True:
+        n = HEADER.unpack(await reader.readexactly(HEADER.size))[0]
+        body = await reader.readexactly(n)
+        fut = loop.create_future()
+        try:
+          kind, stream_id, frame_no, layer = OTFTrackerServer.decode_request(body)
+        except Exception as e:
+          fut.set_exception(e)
+          await inflight.put(fut)
+          continue
+        await inflight.put(fut)
+        await self.queue.put((kind, stream_id, frame_no, layer, fut))
+    except (asyncio.IncompleteReadError, ConnectionResetError):
+      pass
+    finally:
+      await inflight.put(None)
+      await replier
+      writer.close()
+
+
+  async def serve(self, address):
+    '''
+    Serve on "unix:/path" or "host:port" until cancelled
+    '''
+    self.queue = asyncio.Queue(maxsize=self.max_queue)
+    tracker = asyncio.create_task(self.tracker_loop())
+    if address.startswith("unix:"):
+      server = await asyncio.start_unix_server(self.handle_connection, path=address[5:])
+    else:
+      host, port = address.rsplit(":", 1)
+      server = await asyncio.start_server(self.handle_connection, host, int(port))
+    print(f"serving on {address}")
+    try:
+      async with server:
+        await server.serve_forever()
+    finally:
+      tracker.cancel()
+
+
+async def open_connection(address):
+  if address.startswith("unix:"):
+    return await asyncio.open_unix_connection(address[5:])
+  host, port = address.rsplit(":", 1)
+  return await asyncio.open_connection(host, int(port))
+
+
+async def load_generator(address, frames = 1000, detections = 50, streams = 1, fmt = "binary", window = 8, seed = 12345):
+  '''
+  Local load-generating client: one connection per stream, each pipelining up
+  to `window` frames of synthetic drifting detections
+  Returns a dict of throughput and latency statistics
+  '''
+  rng = np.random.default_rng(seed)
+
+  async def run_stream(stream_id):
+    reader, writer = await open_connection(address)
+    pos = rng.uniform(0, 1000, (detections, 2))
+    sent, latencies = {}, []
+    sem = asyncio.Semaphore(window)
+
+    async def read_replies():
+      for i in range(frames):
+        n = HEADER.unpack(await reader.readexactly(HEADER.size))[0]
+        await reader.readexactly(n)
+        latencies.append(time.perf_counter() - sent.pop(i))
+        sem.release()
+
+    rtask = asyncio.create_task(read_replies())
+    for i in range(frames):
+      pos += rng.normal(0, 3, pos.shape)
+      await sem.acquire()
+      if fmt == "json":
+        annos = [{"image_id": i, "category_id": 0, "bbox": [float(x), float(y), 20.0, 10.0]} for x,y in pos]
+        body = b'J' + json.dumps({"stream_id": stream_id, "frame": i, "annotations": annos}).encode()
+      else:
+        arr = np.zeros((detections, 6), dtype="<f4")
+        arr[:,1] = 1.0
+        arr[:,2:4] = pos
+        arr[:,4:] = (20.0, 10.0)
+        body = b'B' + BIN_HEADER.pack(stream_id, i, detections) + arr.tobytes()
+      sent[i] = time.perf_counter()
+      writer.write(HEADER.pack(len(body)) + body)
+      await writer.drain()
+    await rtask
+    writer.close()
+    return latencies
+
+  t0 = time.perf_counter()
+  lat = np.concatenate([np.array(l) for l in await asyncio.gather(*[run_stream(s) for s in range(streams)])])
+  wall = time.perf_counter() - t0
+  return {"frames": frames * streams,
+          "detections_per_frame": detections,
+          "streams": streams,
+          "format": fmt,
+          "wall_s": wall,
+          "frames_per_s": frames * streams / wall,
+          "latency_p50_ms": float(np.percentile(lat, 50) * 1e3),
+          "latency_p99_ms": float(np.percentile(lat, 99) * 1e3)}
+
+
+def main():
+  if len(sys.argv) < 3:
+    print("usage:")
+    print("\tserve [unix:/path | host:port]")
+    print("\tloadgen [unix:/path | host:port] [frames] [detections] [streams] [json | binary]")
+    exit(0)
+  match sys.argv[1]:
+    case 'serve':
+      try:
+        asyncio.run(OTFTrackerServer().serve(sys.argv[2]))
+      except KeyboardInterrupt:
+        pass
+    case 'loadgen':
+      args = sys.argv[3:]
+      frames = int(args[0]) if len(args) > 0 else 1000
+      dets = int(args[1]) if len(args) > 1 else 50
+      streams = int(args[2]) if len(args) > 2 else 1
+      fmt = args[3] if len(args) > 3 else "binary"
+      print(json.dumps(asyncio.run(load_generator(sys.argv[2], frames, dets, streams, fmt)), indent=2))
+    case other:
+      print("unknown")
+
+if __name__ == '__main__':
+  main()
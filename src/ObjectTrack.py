@@ -1,6 +1,6 @@
 #!/usr/bin/python3
 import numpy as np
-from aux_functions import *
+from math_functions import *
 
 class ObjectTrack:
   def __init__(self, track_id, class_id):
@@ -12,6 +12,7 @@ class ObjectTrack:
     self.track_id = track_id
     self.color = rand_color()
     self.last_frame = -1
+    self.velocity = (0.0, 0.0)   # displacement per frame of the latest step
     self.class_id = class_id
 
   def add_new_step(self, yb, frame_id):
@@ -21,12 +22,43 @@ class ObjectTrack:
     # update velocity  
     if len(self.path) > 0:
       self.update_track_vector(yb.get_center_coord())
+      if frame_id > self.last_frame:
+        cx,cy = yb.get_center_coord()
+        lx,ly = self.path[-1].get_center_coord()
+        gap = frame_id - self.last_frame
+        self.velocity = ((cx - lx) / gap, (cy - ly) / gap)
   
     self.last_frame = frame_id
     yb.parent_track = self.track_id
     self.path.append(yb)
 
   
+  def set_path(self, path, frames):
+    '''
+    Replace the path with boxes at increasing frames in one go, leaving the
+    motion state add_new_step would leave after the latest step
+    '''
+    for yb in path:
+      yb.parent_track = self.track_id
+    self.path = list(path)
+    if len(path) == 0:
+      return
+    self.last_frame = frames[-1]
+    if len(path) > 1:
+      cx,cy = path[-1].get_center_coord()
+      lx,ly = path[-2].get_center_coord()
+      self.r = MathFxns.euclidean_dist((lx,ly),(cx,cy))
+      self.theta = np.arctan2(cx - lx, cy - ly)
+    # velocity is of the latest step to a later frame, a track may take two boxes of a frame
+    for i in range(len(path) - 1, 0, -1):
+      if frames[i] > frames[i - 1]:
+        cx,cy = path[i].get_center_coord()
+        lx,ly = path[i - 1].get_center_coord()
+        gap = frames[i] - frames[i - 1]
+        self.velocity = ((cx - lx) / gap, (cy - ly) / gap)
+        break
+
+
   def update_track_vector(self, pt):
     '''
     Update track velocity vector
@@ -48,13 +80,18 @@ class ObjectTrack:
 
     # add recent velocity to delta_v
   
-  def predict_next_box(self):
+  def predict_next_box(self, frame = None):
     '''
     Predict next bounding box center
+    frame: optional frame position of the prediction, the per frame velocity
+           of the latest step is then extrapolated over the frames elapsed
     '''
     lx,ly = self.path[-1].get_center_coord()
     if len(self.path) == 1:
       return (lx,ly)
+    if frame != None:
+      elapsed = frame - self.last_frame
+      return (lx + self.velocity[0] * elapsed, ly + self.velocity[1] * elapsed)
     return (lx + (self.r * np.cos(self.theta)), ly + (self.r * np.sin(self.theta)))
   
   
@@ -156,5 +193,7 @@ class ObjectTrack:
               "trackmap_index" : -1,
               "vid_id":0, 
               "track_color": self.color})
+      if yb.synthetic:
+        steps[-1]["synthetic"] = True
     
       
\ No newline at end of file
@@ -1,9 +1,13 @@
 import collections
 
-from aux_functions import *
+from math_functions import *
 from YoloBox import YoloBox
 from ObjectTrack import ObjectTrack
 from categories import CATEGORIES
+from transform_functions import BoxTransform
+from association_functions import AssociationFxns
+from geometry_functions import GeometryFxns
+from TrackerStats import STATS
 '''
   Global scope data structure for processing a set of images
   
@@ -13,6 +17,7 @@ from categories import CATEGORIES
 LABELS = True
 IDENTIFIERS = not LABELS
 BOXES = IDENTIFIERS
+DEFAULT_IMG_CENTER = (960, 540)
 class ObjectTrackManager:
   constants = { "avg_tolerance"   : 10, 
               "track_lifespan"  : 3,
@@ -20,288 +25,223 @@ class ObjectTrackManager:
               "radial_exclusion": 400,
             }
   display_constants = {"trail_len" : 0}
+  '''
+  Class-partitioned association, see process_layer_partitioned
+    mode                : None (all pairs), "category" or "supercategory"
+    confusion_map       : optional {class_id : group}, overrides mode for listed classes
+    fallback_confidence : detections below it skip their partition and are
+                          matched against any still unmatched track
+  '''
+  partition_constants = { "mode"                : None,
+                          "confusion_map"       : None,
+                          "fallback_confidence" : 0.3,
+                        }
+  '''
+  Confidence-tiered association, see process_layer_tiered
+    high_confidence : None (single pass) or the threshold of high confidence detections
+  '''
+  tier_constants = { "high_confidence" : None }
   def __init__(self,
-                global_track_store = {},
-                inactive_tracks = [],
+                global_track_store = None,
+                inactive_tracks = None,
                 active_tracks = None,
-                img_filenames = [],
+                img_filenames = None,
                 annotation_list_fname = "",
-                filenames = [],
-                sys_paths = [],
+                filenames = None,
+                sys_paths = None,
                 frame_counter = 0,
-                layers = [],
-                linked_tracks = [],
-                trackmap = [],
-                fdict = {},
+                layers = None,
+                linked_tracks = None,
+                trackmap = None,
+                fdict = None,
                 categories = CATEGORIES,
-                img_centers = [],
+                img_centers = None,
                 imported = False
               ):
-    self.global_track_store = global_track_store
-    self.inactive_tracks = inactive_tracks
+    # containers are created per instance so managers never share state
+    self.global_track_store = global_track_store if global_track_store != None else {}
+    self.inactive_tracks = inactive_tracks if inactive_tracks != None else []
     self.active_tracks = active_tracks
-    self.img_filenames = img_filenames
+    self.img_filenames = img_filenames if img_filenames != None else []
     self.annotation_list_fname = annotation_list_fname
-    self.filenames = filenames
-    self.sys_paths = sys_paths
+    self.filenames = filenames if filenames != None else []
+    self.sys_paths = sys_paths if sys_paths != None else []
     self.frame_counter = frame_counter
-    self.layers = layers
-    self.linked_tracks = linked_tracks
-    self.fdict = fdict
+    self.layers = layers if layers != None else []
+    self.linked_tracks = linked_tracks if linked_tracks != None else []
+    self.fdict = fdict if fdict != None else {}
     self.categories = categories
-    self.img_centers = img_centers
+    self.img_centers = img_centers if img_centers != None else []
     self.imported = imported
+    self.partition_mode = ObjectTrackManager.partition_constants["mode"]
+    self.confusion_map = ObjectTrackManager.partition_constants["confusion_map"]
+    self.fallback_confidence = ObjectTrackManager.partition_constants["fallback_confidence"]
+    self.high_confidence = ObjectTrackManager.tier_constants["high_confidence"]
+    self.association_cost = GeometryFxns.cost_constants["mode"]
+    self.pair_counts = {"candidate": 0, "all": 0, "computed": 0}
+    self.stats = STATS
 
   
-  # def import_loco_fmt(self, s, sys_path):
-  #   # set up trackmap for accessing tracks
-  #   self.imported = True
-  #   trackmap = s['trackmap']
-  #   lt = s['linked_tracks']
-  #   for i,track_id in enumerate(trackmap):
-  #     if track_id not in self.global_track_store or track_id == -1:
-  #       self.global_track_store[track_id] = ObjectTrack(track_id, lt[i]['category_id'])
-  #       self.global_track_store[track_id].class_id = lt[i]['category_id']
-  #     else: #already present
-  #       continue
+  def import_loco_fmt(self, s, sys_path):
+    # set up trackmap for accessing tracks
+    self.imported = True
+    trackmap = s['trackmap']
+    lt = s['linked_tracks']
+    for i,track_id in enumerate(trackmap):
+      if track_id not in self.global_track_store or track_id == -1:
+        self.global_track_store[track_id] = ObjectTrack(track_id, lt[i]['category_id'])
+        self.global_track_store[track_id].class_id = lt[i]['category_id']
+      else: #already present
+        continue
     
-  #   # load image filenames
-  #   images = s['images']
-  #   # construct file dict for accessing file ids
-  #   # construct sys_paths list for convenience
-  #   # initialize layers to populate with YoloBoxes
-  #   for i,imf in enumerate(images):
-  #     self.filenames.append(imf['file_name'])
-  #     self.sys_paths.append(sys_path)
-  #     self.fdict[imf['file_name']] = i
-  #     self.layers.append([])
-  #     self.img_centers.append(tuple((int(imf['width']/2), int(imf['height']/2))))
+    # load image filenames
+    images = s['images']
+    # construct file dict for accessing file ids
+    # construct sys_paths list for convenience
+    # initialize layers to populate with YoloBoxes
+    for i,imf in enumerate(images):
+      self.filenames.append(imf['file_name'])
+      self.sys_paths.append(sys_path)
+      self.fdict[imf['file_name']] = i
+      self.layers.append([])
+      self.img_centers.append(tuple((int(imf['width']/2), int(imf['height']/2))))
     
-  #   # load annotations
-  #   steps = s['annotations']
-  #   for st in steps:
-  #     # skip step if track is invalid
-  #     if trackmap[st['trackmap_index']] == -1:
-  #       continue
-  #     track = self.get_track(trackmap[st['trackmap_index']])
-  #     yb = YoloBox( track.class_id, 
-  #                   st['bbox'], 
-  #                   f'{self.filenames[st["image_id"]][:-3]}txt',
-  #                   self.img_centers[st["image_id"]])
+    # load annotations
+    steps = s['annotations']
+    for st in steps:
+      # skip step if track is invalid
+      if trackmap[st['trackmap_index']] == -1:
+        continue
+      track = self.get_track(trackmap[st['trackmap_index']])
+      yb = YoloBox( track.class_id, 
+                    st['bbox'], 
+                    f'{self.filenames[st["image_id"]][:-3]}txt',
+                    self.img_centers[st["image_id"]],
+                    synthetic = st.get("synthetic", False))
       
-  #     # add YoloBox to the appropriate layer based on the image filename
-  #     self.layers[self.fdict[self.filenames[st['image_id']]]].append(yb)
-  #     # add the yolobox to the correct track
-  #     track.add_new_step(yb,0)
-
-  # def export_loco_fmt(self, angle = 0, reflect_axis = None):
-  #   '''
-  #   Export active tracks and associated metadata to loco format
-  #   '''
-  #   # construct filename lookup dictionary
-  #   fdict = {}
-  #   for i,f in enumerate(self.filenames):
-  #     fdict[f'{f[:-3]}png'] = i
+      # add YoloBox to the appropriate layer based on the image filename
+      self.layers[self.fdict[self.filenames[st['image_id']]]].append(yb)
+      # add the yolobox to the correct track
+      track.add_new_step(yb,0)
+
+  def export_loco_fmt(self, angle = 0, reflect_axis = None, images = None):
+    '''
+    Export active tracks and associated metadata to loco format
+    images: optional precomputed "images" entries, skips generating new images
+    '''
+    # construct filename lookup dictionary
+    fdict = {}
+    for i,f in enumerate(self.filenames):
+      fdict[f'{f[:-3]}png'] = i
     
-  #   # construct "images" : []
-  #   imgs = []
-  #   for k,v in fdict.items():
-  #     half_h = 540
-  #     half_w = 960
-  #     # if imported, adjust angles
-  #     if self.imported:
-  #       #if rotaged about the center, swap height and width
-  #       if angle != 0:
-  #         half_h, half_w = self.img_centers[v]
-  #       else:
-  #         half_w, half_h = self.img_centers[v]
+    # construct "images" : []
+    imgs = []
+    for k,v in fdict.items():
+      half_h = 540
+      half_w = 960
+      # if imported, adjust angles
+      if self.imported:
+        #if rotaged about the center, swap height and width
+        if angle != 0:
+          half_h, half_w = self.img_centers[v]
+        else:
+          half_w, half_h = self.img_centers[v]
         
-  #     h,w = half_h * 2, half_w * 2
-  #     imgs.append({"id":v, "file_name": k, "height": h, "width": w})
+      h,w = half_h * 2, half_w * 2
+      imgs.append({"id":v, "file_name": k, "height": h, "width": w})
     
-  #   # construct "annotations" : []
-  #   steps = self.export_linked_loco_tracks(fdict)
+    # construct "annotations" : []
+    steps = self.export_linked_loco_tracks(fdict)
     
-  #   '''
-  #   Generate new images with which to populate a LOCO of the ROTATED images
-  #   '''
-  #   if angle != 0:
-  #     imgs = ImgFxns.rotate_images(imgs, angle)
+    if images != None:
+      imgs = images
+    elif angle != 0 or reflect_axis != None:
+      # imaging is only needed when generating new images
+      from aux_functions import ImgFxns
     
-  #   '''
-  #   Generate new images with which to populate a LOCO of the REFLECTED images
-  #   '''
-  #   if reflect_axis != None:
-  #     imgs = ImgFxns.reflect_images(imgs, reflect_axis)
+    '''
+    Generate new images with which to populate a LOCO of the ROTATED images
+    '''
+    if angle != 0 and images == None:
+      imgs = ImgFxns.rotate_images(imgs, angle)
+    
+    '''
+    Generate new images with which to populate a LOCO of the REFLECTED images
+    '''
+    if reflect_axis != None and images == None:
+      imgs = ImgFxns.reflect_images(imgs, reflect_axis)
     
-  #   # construct "linked_tracks" : []
-  #   linked_tracks = [{"track_id": i, "category_id" : self.get_track(i).class_id, 
-  #                     "track_len": 0, "steps":[] } 
-  #                     for i in self.linked_tracks]
+    # construct "linked_tracks" : []
+    linked_tracks = [{"track_id": i, "category_id" : self.get_track(i).class_id, 
+                      "track_len": 0, "steps":[] } 
+                      for i in self.linked_tracks]
 
     
-  #   trackmap = {} # {track_id : posn in linked_tracks}
-  #   for i,lt in enumerate(linked_tracks):
-  #     trackmap[linked_tracks[i]['track_id']] = i
+    trackmap = {} # {track_id : posn in linked_tracks}
+    for i,lt in enumerate(linked_tracks):
+      trackmap[linked_tracks[i]['track_id']] = i
     
-  #   # add trackmap_index to all annotations
-  #   for s in steps:
-  #     linked_tracks[trackmap[s['track_id']]]['steps'].append(s['id'])
-  #     s['trackmap_index'] = trackmap[s['track_id']]
+    # add trackmap_index to all annotations
+    for s in steps:
+      linked_tracks[trackmap[s['track_id']]]['steps'].append(s['id'])
+      s['trackmap_index'] = trackmap[s['track_id']]
     
-  #   # add length to linked tracks for fun
-  #   for l in linked_tracks:
-  #     l["track_len"] = len(l['steps'])
+    # add length to linked tracks for fun
+    for l in linked_tracks:
+      l["track_len"] = len(l['steps'])
     
-  #   # assemble final dictionary
-  #   exp = {
-  #           "constants": ObjectTrackManager.constants,
-  #           "categories":self.categories,
-  #           "trackmap":list(trackmap),
-  #           "linked_tracks":linked_tracks,
-  #           "images":imgs, 
-  #           "annotations":steps
-  #         }
-
-  #   return exp
+    # assemble final dictionary
+    exp = {
+            "constants": ObjectTrackManager.constants,
+            "categories":self.categories,
+            "trackmap":list(trackmap),
+            "linked_tracks":linked_tracks,
+            "images":imgs, 
+            "annotations":steps
+          }
+
+    return exp
 
   
-  # def export_linked_loco_tracks(self,fdict):  
-  #   '''
-  #     build "annotations" : [] from linked tracks only
-  #   '''
-  #   steps = []
-  #   for i in self.linked_tracks:
-  #     self.get_track(i).get_loco_track(fdict,steps)
-  #   # print(f'{len(steps)} total steps')
-  #   for i in range(len(steps)):
-  #     steps[i]["id"] = i
-  #   return steps
+  def export_linked_loco_tracks(self,fdict):  
+    '''
+      build "annotations" : [] from linked tracks only
+    '''
+    steps = []
+    for i in self.linked_tracks:
+      self.get_track(i).get_loco_track(fdict,steps)
+    # print(f'{len(steps)} total steps')
+    for i in range(len(steps)):
+      steps[i]["id"] = i
+    return steps
   
-  # def draw_ybbox_data_on_rotated_images(self, rotation_angle = 0):
-  #   '''
-  #   API accessible prototype image rotation. Does not serialize LOCO
-  #   '''
-  #   for layer_idx in range(len(self.layers)):
-  #     img1 = cv2.imread(f"{self.filenames[layer_idx][:-3]}png")
-  #     if rotation_angle != 0:
-  #       img_center = self.img_centers[layer_idx]
-  #       img1 = ImgFxns.rotate_image(img1, img_center, rotation_angle)
-
+  def transform_linked_tracks(self, tfm):
+    '''
+    Apply a BoxTransform to every bounding box of every linked track at once
+    Boxes without an image center are assumed to come from a 1920x1080 image
+    Returns the number of transformed boxes
+    '''
+    ybs = [yb for i in self.linked_tracks for yb in self.get_track(i).path]
+    if len(ybs) == 0:
+      return 0
+    bboxes = np.array([yb.bbox for yb in ybs], dtype=np.float64)
+    centers = np.array([yb.center_xy if yb.center_xy != None else DEFAULT_IMG_CENTER for yb in ybs], dtype=np.float64)
+    bboxes, centers = tfm.apply(bboxes, centers)
 
-  #     self.draw_trail(self.layers, layer_idx, img1)
-  #     self.draw_track(self.layers, layer_idx, img1)
-  #     cv2.imwrite(f"rotated_{layer_idx}.png",img1)
-
-  
-  # def draw_ybbox_data_on_reflected_images(self, reflect_axis = None):
-  #   '''
-  #   API accessible prototype image reflection. Does not serialize LOCO
-  #   '''
-  #   for layer_idx in range(len(self.layers)):
-  #     img1 = cv2.imread(f"{self.filenames[layer_idx][:-3]}png")
-  #     if reflect_axis != None:
-  #       img1 = ImgFxns.reflect_image(img1, reflect_axis)
-
-  #     self.draw_trail(self.layers, layer_idx, img1)
-  #     self.draw_track(self.layers, layer_idx, img1)
-  #     cv2.imwrite(f"reflected_{layer_idx}.png",img1)
-
-  # def draw_ybbox_data_on_images(self):
-  #   '''
-  #   Draws YoloBox information on the corresponding images
-  #   '''
-  #   for layer_idx in range(len(self.layers)):
-  #     img1 = cv2.imread(f"{self.filenames[layer_idx][:-3]}png")
-      
-  #     self.draw_trail(self.layers, layer_idx, img1)
-  #     self.draw_track(self.layers, layer_idx, img1)
-  #     cv2.imwrite(f"{layer_idx}.png",img1)
-  #     # im.save(f"{layer_idx}.jpg")
-
-
-  # def draw_track(self,layer_list, layer_idx, img1,TEXT = False):
-  #   '''
-  #   Draw a disappearing track on an image
-
-  #   "why is it written so inefficiently to iterate over the layers, if there is
-  #   a linked list under the hood?"
-  #   Because we want to write to each picture, layer by layer.
-  #   '''
-  #   start = max(layer_idx- ObjectTrackManager.display_constants["trail_len"],0)
-  #   stop = max(start + 1,layer_idx)
-  #   for trail_idx in range(start,stop):
-  #     layer = layer_list[trail_idx]
-  #     for ybbox in layer:
-  #       color = (255,0,0)
-  #       offt = 4
-  #       if ybbox.parent_track != None:  # ybbox is part of a track
-  #         color = self.get_track(ybbox.parent_track).color
-  #       elif ybbox.next != None: # bbox is orphaned
-  #         print("ERROR, Parent is not linked but track is not over.")
-  #       else: # ybbox is last in the track
-  #         offt = 50
-  #         print("what")
-  #       # color = self.get_track(ybbox.parent_track).color
-  #       ArtFxns.draw_line(img1,ybbox,color)
-    
-  #   # add identifier to the entity
-  #   last_layer = layer_list[max(0, layer_idx - 1)]
-    
-  #   for ybbox in last_layer:
-  #     color = (255,0,255)
-      
-  #     if ybbox.parent_track != None:
-  #       color = self.get_track(ybbox.parent_track).color
-      
-  #     # label the entities with their id
-  #     if IDENTIFIERS:
-  #       ArtFxns.draw_text(img1, ybbox, color)
-      
-  #     # label the entities with category
-  #     label = "unlabeled"
-  #     if len(self.categories) > 0:
-  #       label = self.get_category_string(int(ybbox.class_id))
-  #     if LABELS:
-  #       ArtFxns.draw_label(img1, ybbox, label, color)
-
-  # def draw_trail(self, layer_list, layer_idx, img1):
-  #   '''
-  #   Helper function for drawing an individual trail
-  #   '''
-  #   # draw tracks from all images before
-  #   if layer_idx == 0:
-  #     print("zero")
-  #   start = max(0, layer_idx - 1)
-  #   stop = max(start + 1, layer_idx)
-  #   for trail_idx in range(start, stop):
-  #     layer = layer_list[trail_idx]
-  #     for ybbox in layer:
-  #       if layer_idx == 0:
-  #         print(ybbox.get_corner_coords())
-  #       color = (255,0,255)
-  #       offt = 4
-  #       if ybbox.parent_track != None:  # ybbox is part of a track
-  #         color = self.get_track(ybbox.parent_track).color
-  #       elif ybbox.next != None: # bbox is orphaned
-  #         print("ERROR, Parent is not linked but track is not over.")
-  #       else: # ybbox is last in the track
-  #         offt = 4
-  #         print("last")
-
-  #       if BOXES:
-  #         ArtFxns.draw_rectangle(img1, ybbox, color)
+    # write back in place, exports reference the bbox lists
+    for yb, bb, c in zip(ybs, bboxes.tolist(), centers.tolist()):
+      yb.bbox[:] = bb
+      yb.center_xy = tuple(c)
+    return len(ybs)
 
   def rotate_linked_tracks(self, offset_degrees):
     '''
     API accessible rotation of bounding boxes
     '''
-    for i in self.linked_tracks:
-      self.get_track(i).rotate_track(offset_degrees)
+    self.transform_linked_tracks(BoxTransform().rotate(offset_degrees))
     
   def reflect_linked_tracks(self, reflect_axis):
-    for i in self.linked_tracks:
-      self.get_track(i).reflect_track(reflect_axis)
+    self.transform_linked_tracks(BoxTransform().reflect(reflect_axis))
 
   def get_track(self, track_id):
     ''' 
@@ -310,6 +250,13 @@ class ObjectTrackManager:
     return self.global_track_store[track_id]
   
 
+  def get_frame_index(self):
+    '''
+    Lookup dictionary mapping YoloBox annotation filenames to layer indices
+    '''
+    return {f'{f[:-3]}txt' : i for i,f in enumerate(self.filenames)}
+
+
   def get_category_string(self, class_id):
     '''
     Helper function for accessing category via an integer class_id
@@ -328,6 +275,7 @@ class ObjectTrackManager:
     T.add_new_step(entity, fc)
     self.global_track_store[track_id] = T
     self.active_tracks.append(T)
+    self.stats.count("tracks_created")
   
   
   def initialize_tracks(self):
@@ -353,7 +301,9 @@ class ObjectTrackManager:
   def link_all_tracks(self, min_len = 0):
     '''
     Resolve linked lists to make tracks externally traversible
+    Returns the number of linked tracks
     '''
+    lap = self.stats.start()
     link_counter = 0
     for k,v in self.global_track_store.items():
       if v.get_step_count() < min_len:
@@ -362,7 +312,9 @@ class ObjectTrackManager:
       self.linked_tracks.append(k)
       self.link_single_track(k)
       # v.path[-1].parent_track = link_counter
-    print(f"{link_counter} tracks linked")
+    self.stats.lap("link", lap)
+    self.stats.count("tracks_linked", link_counter)
+    return link_counter
 
   
   def link_single_track(self, track_id):
@@ -377,74 +329,269 @@ class ObjectTrackManager:
     Construct paths through all images
     '''
     for i in range(1,len(self.layers)):
+      t = self.stats.start()
       self.process_layer(i)
+      self.stats.end_frame(t, len(self.active_tracks), i)
   
 
+  def partition_key(self, class_id):
+    '''
+    Association partition of a class under the current partition mode
+    '''
+    if self.confusion_map != None and class_id in self.confusion_map:
+      return self.confusion_map[class_id]
+    if self.partition_mode == "supercategory":
+      c = int(class_id)
+      if c >= 0 and c < len(self.categories):
+        # the generic root category matches its own members
+        sc = self.categories[c]["supercategory"]
+        return self.categories[c]["name"] if sc == "None" else sc
+    return class_id
+
+
+  def pair_costs(self, tracks, pred, dets):
+    '''
+    Cost of every (detection, track) pair by association_cost, overlap costs
+    gated at radial_exclusion
+      pred : predicted centers of tracks
+      dets : YoloBoxes
+    Returns a (D,T) array
+    '''
+    if self.association_cost == "distance":
+      return AssociationFxns.center_distances(pred, [yb.get_center_coord() for yb in dets])
+    boxes = [(*p, *t.path[-1].bbox[2:4]) for t,p in zip(tracks, pred)]
+    return GeometryFxns.association_cost([yb.bbox for yb in dets], boxes, self.association_cost,
+                                         gate=ObjectTrackManager.constants["radial_exclusion"])
+
+
+  def greedy_assign(self, curr_layer, tracks, d_idx, t_idx, dist, fc):
+    '''
+    Assign sorted (layer index, track, distance) pairs the way process_layer does
+    '''
+    radial_exclusion = ObjectTrackManager.constants["radial_exclusion"]
+    pc,tc,lc = 0,len(tracks),len(set(d_idx.tolist()))
+    gated = 0
+    while tc > 0 and lc > 0 and pc < len(dist):
+      yb = curr_layer[d_idx[pc]]
+      if yb.parent_track != None or tracks[t_idx[pc]].last_frame == fc:
+        pc += 1
+        continue
+      if dist[pc] > radial_exclusion:
+        gated += 1
+        tc -= 1
+        pc += 1
+        continue
+      tracks[t_idx[pc]].add_new_step(yb, fc)
+      tc -= 1
+      lc -= 1
+      pc += 1
+    self.stats.count("pairs_gated", gated)
+
+
+  def process_layer_partitioned(self, layer_idx):
+    '''
+    Update preexisting tracks with a single layer of entities, pairing tracks
+    and detections only within the same partition (see partition_key)
+
+    All partitions are associated in one batched call, or one call each
+    with an overlap association_cost. Detections with a
+    confidence below fallback_confidence are then matched against tracks of
+    any partition which are still unmatched. Remaining detections start tracks.
+    '''
+    curr_layer = self.layers[layer_idx]
+    fc = layer_idx
+    lap = self.stats.start()
+    tracks = list(self.active_tracks)
+    low = lambda yb: yb.confidence != None and yb.confidence < self.fallback_confidence
+
+    groups = {}
+    for i,t in enumerate(tracks):
+      groups.setdefault(self.partition_key(t.class_id), ([], []))[0].append(i)
+    for c,yb in enumerate(curr_layer):
+      if not low(yb):
+        groups.setdefault(self.partition_key(yb.class_id), ([], []))[1].append(c)
+
+    keys = list(groups.keys())
+    preds, dets = [], []
+    for k in keys:
+      t_sel, d_sel = groups[k]
+      preds.append(np.array([tracks[i].predict_next_box() for i in t_sel], dtype=np.float64).reshape(-1, 2))
+      dets.append(np.array([curr_layer[c].get_center_coord() for c in d_sel], dtype=np.float64).reshape(-1, 2))
+    lap = self.stats.lap("predict", lap)
+    if self.association_cost == "distance":
+      sorted_pairs, computed = AssociationFxns.batched_sorted_pairs(preds, dets)
+    else:
+      sorted_pairs, computed = [], 0
+      for k,pred in zip(keys, preds):
+        t_sel, d_sel = groups[k]
+        cost = self.pair_costs([tracks[i] for i in t_sel], pred, [curr_layer[c] for c in d_sel])
+        sorted_pairs.append(AssociationFxns.sorted_pairs(cost))
+        computed += cost.size
+    lap = self.stats.lap("pair", lap)
+    candidates = 0
+    for k, (d_idx, t_idx, dist) in zip(keys, sorted_pairs):
+      t_sel, d_sel = groups[k]
+      candidates += len(dist)
+      self.greedy_assign(curr_layer, [tracks[i] for i in t_sel], np.array(d_sel, dtype=np.int64)[d_idx], t_idx, dist, fc)
+
+    # fallback pass, uncertain labels against any unmatched track
+    rest = [c for c,yb in enumerate(curr_layer) if low(yb)]
+    free = [t for t in tracks if t.last_frame != fc]
+    if len(rest) > 0 and len(free) > 0:
+      pred = [t.predict_next_box() for t in free]
+      d_idx, t_idx, dist = AssociationFxns.sorted_pairs(self.pair_costs(free, pred, [curr_layer[c] for c in rest]))
+      candidates += len(dist)
+      computed += len(dist)
+      self.greedy_assign(curr_layer, free, np.array(rest, dtype=np.int64)[d_idx], t_idx, dist, fc)
+    self.count_pairs(candidates, len(tracks) * len(curr_layer), computed)
+    lap = self.stats.lap("assign", lap)
+
+    for yb in curr_layer:
+      if yb.parent_track == None:
+        self.create_new_track(yb,fc)
+    self.stats.lap("create", lap)
+    self.reap_tracks(fc + 1)
+
+
+  def process_layer_tiered(self, layer_idx):
+    '''
+    Update preexisting tracks with a single layer of entities in two passes
+      1 detections at or above high_confidence against all active tracks
+      2 tracks still unmatched against the remaining low confidence detections
+    Only unmatched high confidence detections start tracks, unmatched low
+    confidence detections are left without a track. Detections without a
+    confidence count as high confidence.
+    '''
+    curr_layer = self.layers[layer_idx]
+    fc = layer_idx
+    lap = self.stats.start()
+    tracks = list(self.active_tracks)
+    high, low = [], []
+    for c,yb in enumerate(curr_layer):
+      if yb.confidence == None or yb.confidence >= self.high_confidence:
+        high.append(c)
+      else:
+        low.append(c)
+
+    evaluated = 0
+    for sel, candidates in ((high, tracks), (low, None)):
+      if candidates == None:
+        candidates = [t for t in tracks if t.last_frame != fc]
+      if len(sel) == 0 or len(candidates) == 0:
+        continue
+      pred = [t.predict_next_box() for t in candidates]
+      lap = self.stats.lap("predict", lap)
+      d_idx, t_idx, dist = AssociationFxns.sorted_pairs(self.pair_costs(candidates, pred, [curr_layer[c] for c in sel]))
+      lap = self.stats.lap("pair", lap)
+      evaluated += len(dist)
+      self.greedy_assign(curr_layer, candidates, np.array(sel, dtype=np.int64)[d_idx], t_idx, dist, fc)
+      lap = self.stats.lap("assign", lap)
+    self.count_pairs(evaluated, len(tracks) * len(curr_layer))
+
+    for c in high:
+      if curr_layer[c].parent_track == None:
+        self.create_new_track(curr_layer[c],fc)
+    self.stats.lap("create", lap)
+    self.reap_tracks(fc + 1)
+
+
+  def count_pairs(self, evaluated, total, computed = None):
+    '''
+    Record pairs evaluated out of all track x detection pairs of a frame,
+    the rest were excluded without computing their cost
+    computed: costs actually computed, evaluated pairs plus any padding
+    '''
+    self.pair_counts["candidate"] += evaluated
+    self.pair_counts["all"] += total
+    self.pair_counts["computed"] += evaluated if computed == None else computed
+    self.stats.count("pairs_evaluated", evaluated)
+    self.stats.count("pairs_excluded", total - evaluated)
+
+
+  def reap_tracks(self, fc):
+    '''
+    Move tracks which are no longer alive at frame fc to the inactive list
+    '''
+    lap = self.stats.start()
+    active = len(self.active_tracks)
+    for i in range(len(self.active_tracks)):
+      if self.active_tracks[-1].is_alive(fc, ObjectTrackManager.constants["track_lifespan"]):
+        self.active_tracks.rotate()
+      else:
+        self.inactive_tracks.append(self.active_tracks.pop())
+    self.stats.count("tracks_reaped", active - len(self.active_tracks))
+    self.stats.lap("reap", lap)
+
+
   def process_layer(self,layer_idx):
     '''
     Update preexisting tracks with a single layer of entities
     '''
+    if self.partition_mode != None or self.confusion_map != None:
+      return self.process_layer_partitioned(layer_idx)
+    if self.high_confidence != None:
+      return self.process_layer_tiered(layer_idx)
     curr_layer = self.layers[layer_idx]
     fc = layer_idx
-    pred,pairs = [],[]
+    st = self.stats
+    lap = st.start()
+    radial_exclusion = ObjectTrackManager.constants["radial_exclusion"]
     
     # gather predictions from track heads
-    for t in self.active_tracks:
-      # if t.is_alive(fc, ObjectTrackManager.constants["track_lifespan"])
-      pred.append((t.track_id, t.predict_next_box()))
-      # else:
-
-    # create list of all pairs between track heads and curr layer
-    for c in range(len(curr_layer)):
-      for p in pred:
-        d = MathFxns.euclidean_dist(p[1],curr_layer[c].get_center_coord())
-        pairs.append((p[0], c, d))
+    tracks = list(self.active_tracks)
+    pred = [t.predict_next_box() for t in tracks]
+    lap = st.lap("predict", lap)
+
+    # cost of all pairs between track heads and curr layer, detection-major
+    # like the nested loop over layer and heads it replaces
+    cost = self.pair_costs(tracks, pred, curr_layer)
+    lap = st.lap("pair", lap)
+    st.count("pairs_evaluated", cost.size)
     
-    sortkey = lambda s: s[2]
-    pairs = sorted(pairs,key=sortkey)
-    # print(pairs)
-    pc,tc,lc = 0,len(self.active_tracks),len(curr_layer)
+    d_idx, t_idx, dist = AssociationFxns.sorted_pairs(cost)
+    d_idx, t_idx, dist = d_idx.tolist(), t_idx.tolist(), dist.tolist()
+    pairs = len(dist)
+    lap = st.lap("sort", lap)
+    pc,tc,lc = 0,len(tracks),len(curr_layer)
+    gated = 0
     # update existing tracks with new entities
-    while tc > 0 and lc > 0 and pc < len(pairs):
-      elem = pairs[pc]
-      if curr_layer[elem[1]].parent_track != None:
+    while tc > 0 and lc > 0 and pc < pairs:
+      yb = curr_layer[d_idx[pc]]
+      if yb.parent_track != None:
         pc += 1
         continue
       
       '''
         We add a simple check 
       '''
-      if elem[2] > ObjectTrackManager.constants["radial_exclusion"]:
+      if dist[pc] > radial_exclusion:
+        gated += 1
         tc-=1
         pc+=1
         continue
       # add entity to closest track
-      T = self.global_track_store[elem[0]]
-      T.add_new_step(curr_layer[elem[1]], fc)
+      tracks[t_idx[pc]].add_new_step(yb, fc)
       # update counters
       tc -= 1
       lc -= 1
       pc += 1
+    st.count("pairs_gated", gated)
+    lap = st.lap("assign", lap)
     
     # create new tracks from unused entities
     if lc > 0:
-      while lc > 0 and pc < len(pairs):
-        elem = pairs[pc]
-        if curr_layer[elem[1]].parent_track != None:
+      while lc > 0 and pc < pairs:
+        yb = curr_layer[d_idx[pc]]
+        if yb.parent_track != None:
           pc += 1
           continue
         # create new ObjectTrack
-        self.create_new_track(curr_layer[elem[1]],fc)
+        self.create_new_track(yb,fc)
         # update counters
         lc -= 1
         pc += 1
+    st.lap("create", lap)
     
     if tc > 0:
       # reap tracks which are no longer active
-      fc += 1
-      max_rot = len(self.active_tracks)
-      for i in range(max_rot):
-        if self.active_tracks[-1].is_alive(fc, ObjectTrackManager.constants["track_lifespan"]):
-          self.active_tracks.rotate()
-        else:
-          self.inactive_tracks.append(self.active_tracks.pop())
+      self.reap_tracks(fc + 1)
@@ -0,0 +1,281 @@
+#!/usr/bin/python3
+import numpy as np
+import multiprocessing
+from os import path
+from TrackerStats import STATS
+
+'''
+  Precomputed per-frame draw lists
+
+  A RenderPlan is built once from a frozen ObjectTrackManager. Every frame is
+  reduced to three compact primitive arrays, so the rendering workers only
+  rasterize and never touch layers, tracks or the track store.
+
+    rects  : [frame, x1, y1, x2, y2, r, g, b]
+    lines  : [frame, x1, y1, x2, y2, r, g, b]
+    labels : [frame, x, y, r, g, b, text_idx, font_scale]
+
+  Each array is sorted by frame, and *_offsets[f]:*_offsets[f+1] selects the
+  primitives belonging to frame f. Coordinates are stored in source pixels and
+  scaled at rasterization time.
+'''
+RECT_W = 8
+LINE_W = 8
+LABEL_W = 8
+
+class RenderPlan:
+  # default styles, mirroring ArtFxns
+  style = { "rect_thickness"  : 2,
+            "line_thickness"  : 4,
+            "label_thickness" : 4,
+            "label_offset"    : 10,
+          }
+
+  def __init__(self,
+                filenames = None,
+                frame_sizes = None,
+                rects = None,
+                lines = None,
+                labels = None,
+                label_text = None,
+                image_transform = None
+              ):
+    self.filenames = filenames if filenames != None else []
+    self.frame_sizes = frame_sizes if frame_sizes != None else []
+    self.rects = rects if rects is not None else np.zeros((0, RECT_W), dtype=np.float32)
+    self.lines = lines if lines is not None else np.zeros((0, LINE_W), dtype=np.float32)
+    self.labels = labels if labels is not None else np.zeros((0, LABEL_W), dtype=np.float32)
+    self.label_text = label_text if label_text != None else []
+    self.image_transform = image_transform if image_transform != None else {}
+    self.rect_offsets = RenderPlan.frame_offsets(self.rects, len(self.filenames))
+    self.line_offsets = RenderPlan.frame_offsets(self.lines, len(self.filenames))
+    self.label_offsets = RenderPlan.frame_offsets(self.labels, len(self.filenames))
+
+
+  def frame_offsets(prims, frame_count):
+    '''
+    Helper for computing per-frame slice offsets of a frame-sorted primitive array
+    Returns an array of frame_count + 1 offsets
+    '''
+    return np.searchsorted(prims[:,0], np.arange(frame_count + 1), side="left")
+
+
+  def get_frame(self, frame_idx):
+    '''
+    Accessor for the primitives of a single frame
+    Returns (rects, lines, labels)
+    '''
+    r0,r1 = self.rect_offsets[frame_idx], self.rect_offsets[frame_idx + 1]
+    l0,l1 = self.line_offsets[frame_idx], self.line_offsets[frame_idx + 1]
+    t0,t1 = self.label_offsets[frame_idx], self.label_offsets[frame_idx + 1]
+    return self.rects[r0:r1], self.lines[l0:l1], self.labels[t0:t1]
+
+
+  def build(OTM, trail_len = 0, boxes = False, identifiers = False, labels = True, image_transform = None):
+    '''
+    Walk the layers of a frozen ObjectTrackManager exactly once and emit the
+    primitives drawn on every frame.
+
+    Per frame f:
+      lines  : layers [max(f - trail_len, 0), max(start + 1, f))
+      labels : layer max(0, f - 1)
+      rects  : layers [max(0, f - 1), max(start + 1, f))
+    Returns a RenderPlan
+    '''
+    layer_count = len(OTM.layers)
+    color_cache = {}
+
+    # per-layer primitive blocks, computed once
+    layer_rects, layer_lines, layer_labels = [], [], []
+    label_text, text_idx = [], {}
+    for layer_idx in range(layer_count):
+      rl, ll, tl = [], [], []
+      for ybbox in OTM.layers[layer_idx]:
+        has_parent = ybbox.parent_track != None
+        if has_parent:
+          if ybbox.parent_track not in color_cache:
+            color_cache[ybbox.parent_track] = tuple(OTM.get_track(ybbox.parent_track).color)
+          track_color = color_cache[ybbox.parent_track]
+        cx,cy = ybbox.get_center_coord()
+
+        # line to successor
+        if ybbox.next != None:
+          r,g,b = track_color if has_parent else (255,0,0)
+          nx,ny = ybbox.next.get_center_coord()
+          ll.append((cx, cy, nx, ny, r, g, b))
+
+        r,g,b = track_color if has_parent else (255,0,255)
+        # bounding box
+        if boxes:
+          (x1,y1),(x2,y2) = ybbox.get_corner_coords()
+          rl.append((x1, y1, x2, y2, r, g, b))
+
+        # identifier and category labels
+        if identifiers:
+          s = str(ybbox.parent_track)
+          if s not in text_idx:
+            text_idx[s] = len(label_text)
+            label_text.append(s)
+          tl.append((cx, cy, r, g, b, text_idx[s], 2))
+        if labels:
+          s = "unlabeled"
+          if len(OTM.categories) > 0:
+            s = OTM.get_category_string(int(ybbox.class_id))
+          if s not in text_idx:
+            text_idx[s] = len(label_text)
+            label_text.append(s)
+          offt = RenderPlan.style["label_offset"]
+          tl.append((cx - offt * 2, cy - offt, r, g, b, text_idx[s], 1))
+      layer_rects.append(np.array(rl, dtype=np.float32).reshape(-1, RECT_W - 1))
+      layer_lines.append(np.array(ll, dtype=np.float32).reshape(-1, LINE_W - 1))
+      layer_labels.append(np.array(tl, dtype=np.float32).reshape(-1, LABEL_W - 1))
+
+    # assemble per-frame arrays from layer ranges
+    rects, lines, plabels = [], [], []
+    tag = lambda block, f: np.hstack((np.full((len(block), 1), f, dtype=np.float32), block))
+    for f in range(layer_count):
+      start = max(f - trail_len, 0)
+      for trail_idx in range(start, max(start + 1, f)):
+        lines.append(tag(layer_lines[trail_idx], f))
+      start = max(0, f - 1)
+      for trail_idx in range(start, max(start + 1, f)):
+        rects.append(tag(layer_rects[trail_idx], f))
+      if layer_count > 0:
+        plabels.append(tag(layer_labels[max(0, f - 1)], f))
+
+    stack = lambda blocks, width: np.vstack(blocks) if len(blocks) > 0 else np.zeros((0, width), dtype=np.float32)
+    frame_sizes = [(int(c[0] * 2), int(c[1] * 2)) for c in OTM.img_centers]
+    angle = (image_transform or {}).get("angle", 0)
+    if (int(angle) // 90) % 2 == 1:
+      # a quarter turn swaps the rendered width and height
+      frame_sizes = [(h, w) for w,h in frame_sizes]
+    return RenderPlan(filenames = list(OTM.filenames),
+                      frame_sizes = frame_sizes,
+                      rects = stack(rects, RECT_W),
+                      lines = stack(lines, LINE_W),
+                      labels = stack(plabels, LABEL_W),
+                      label_text = label_text,
+                      image_transform = image_transform)
+
+
+  def save(self, filename):
+    '''
+    Serialize the plan to a compressed npz archive
+    '''
+    np.savez_compressed(filename,
+                        filenames = np.array(self.filenames, dtype=str),
+                        frame_sizes = np.array(self.frame_sizes, dtype=np.int32).reshape(-1, 2),
+                        rects = self.rects,
+                        lines = self.lines,
+                        labels = self.labels,
+                        label_text = np.array(self.label_text, dtype=str),
+                        angle = np.int32(self.image_transform.get("angle", 0)),
+                        reflect_axis = np.int32(self.image_transform.get("reflect_axis", -1)))
+
+
+  def load(filename):
+    '''
+    Load a serialized plan
+    Returns a RenderPlan, or None if the file does not exist
+    '''
+    if not path.exists(filename):
+      print(f"{filename} does not exist!")
+      return None
+    d = np.load(filename, allow_pickle=False)
+    image_transform = {}
+    if int(d["angle"]) != 0:
+      image_transform["angle"] = int(d["angle"])
+    if int(d["reflect_axis"]) != -1:
+      image_transform["reflect_axis"] = int(d["reflect_axis"])
+    return RenderPlan(filenames = [str(f) for f in d["filenames"]],
+                      frame_sizes = [tuple(int(v) for v in s) for s in d["frame_sizes"]],
+                      rects = d["rects"],
+                      lines = d["lines"],
+                      labels = d["labels"],
+                      label_text = [str(s) for s in d["label_text"]],
+                      image_transform = image_transform)
+
+
+  def rasterize(self, img1, frame_idx, scale = 1.0):
+    '''
+    Draw the primitives of a single frame on img1
+    Coordinates are multiplied by scale, img1 is expected to be already scaled
+    '''
+    import cv2
+    rects, lines, labels = self.get_frame(frame_idx)
+    st = RenderPlan.style
+    rt = max(1, int(round(st["rect_thickness"] * scale)))
+    lt = max(1, int(round(st["line_thickness"] * scale)))
+    tt = max(1, int(round(st["label_thickness"] * scale)))
+    for p in rects:
+      cv2.rectangle(img1, (int(p[1] * scale), int(p[2] * scale)), (int(p[3] * scale), int(p[4] * scale)),
+                    (int(p[5]), int(p[6]), int(p[7])), rt)
+    for p in lines:
+      cv2.line(img1, (int(p[1] * scale), int(p[2] * scale)), (int(p[3] * scale), int(p[4] * scale)),
+                    (int(p[5]), int(p[6]), int(p[7])), lt)
+    for p in labels:
+      cv2.putText(img1, self.label_text[int(p[6])], (int(p[1] * scale), int(p[2] * scale)),
+                  cv2.FONT_HERSHEY_SIMPLEX, float(p[7]) * scale, (int(p[3]), int(p[4]), int(p[5])), tt, cv2.LINE_AA)
+    return img1
+
+
+  def render_frame(self, frame_idx, sys_path = ".", scale = 1.0, prefix = ""):
+    '''
+    Decode, transform and rasterize a single frame, then write it to disk
+    Returns the output filename
+    '''
+    import cv2
+    from aux_functions import ImgFxns
+    lap = STATS.start()
+    img1 = cv2.imread(path.join(sys_path, f"{self.filenames[frame_idx][:-3]}png"))
+    if img1 is None:
+      print(f"could not read {self.filenames[frame_idx]}")
+      return None
+
+    angle = self.image_transform.get("angle", 0)
+    if angle != 0:
+      w,h = img1.shape[1],img1.shape[0]
+      img1 = ImgFxns.rotate_image(img1, (int(w / 2), int(h / 2)), angle)
+    if "reflect_axis" in self.image_transform:
+      img1 = ImgFxns.reflect_image(img1, self.image_transform["reflect_axis"])
+    if scale != 1.0:
+      img1 = cv2.resize(img1, (int(img1.shape[1] * scale), int(img1.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+    lap = STATS.lap("decode", lap)
+
+    self.rasterize(img1, frame_idx, scale)
+    lap = STATS.lap("rasterize", lap)
+    fn = f"{prefix}{frame_idx}.png"
+    cv2.imwrite(fn, img1)
+    STATS.lap("write", lap)
+    return fn
+
+
+''' worker process state for parallel rendering '''
+_worker_plan = None
+
+def _init_render_worker(plan):
+  global _worker_plan
+  _worker_plan = plan
+
+def _render_worker(args):
+  frame_idx, sys_path, scale, prefix = args
+  # trace events, timings and counters of the frame travel back with its filename
+  return _worker_plan.render_frame(frame_idx, sys_path, scale, prefix), STATS.take_trace(), STATS.take_stats()
+
+
+def render_plan(plan, sys_path = ".", scale = 1.0, prefix = "", workers = None):
+  '''
+  Rasterize every frame of a plan across a pool of worker processes
+  Returns a list of written filenames
+  '''
+  jobs = [(i, sys_path, scale, prefix) for i in range(len(plan.filenames))]
+  if workers == 1:
+    _init_render_worker(plan)
+    results = [_render_worker(j) for j in jobs]
+  else:
+    with multiprocessing.Pool(workers, initializer=_init_render_worker, initargs=(plan,)) as pool:
+      results = pool.map(_render_worker, jobs, chunksize=8)
+  for _,events,stats in results:
+    STATS.add_trace(events)
+    STATS.add_stats(stats)
+  return [fn for fn,_,_ in results]
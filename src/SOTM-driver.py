@@ -1,8 +1,6 @@
 #!/usr/bin/python3
 import numpy as np
-from PIL import Image, ImageDraw
 import collections
-from aux_functions import *
 # from Dataloader import Dataloader
 from YoloBox import YoloBox
 from StreamingObjectTrackManager import ObjectTrackManager
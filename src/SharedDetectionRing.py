@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+import numpy as np
+import multiprocessing
+import sys
+import time
+from multiprocessing import shared_memory
+
+'''
+  Zero-copy shared-memory detection handoff
+
+  A fixed ring of slots in a multiprocessing.shared_memory block. A co-located
+  detector process writes each frame's detections into the next slot, and the
+  tracker reads them back as NumPy views of the same memory, with no
+  serialization or text parsing in between.
+
+  Layout:
+    header : int64[4]            [slots, max_dets, write_seq, reserved]
+    meta   : int64[slots, 4]     [seq, frame_no, count, reserved]
+    data   : float32[slots, max_dets, 6]
+             [class_id, confidence, center_x, center_y, width, height]
+
+  Sequence numbers start at 1 and frame s lives in slot (s - 1) % slots. A
+  producer marks a slot -s while writing it and s once complete. A consumer
+  expecting s which finds a larger sequence in the slot has been lapped. The
+  frames in between are counted as overruns, and it resumes from the oldest
+  frame still in the ring. Slot contents are only valid until the producer
+  wraps around, so consumers re-check the sequence after reading
+  (DetectionRingConsumer.validate).
+'''
+HEADER_LEN = 4
+META_LEN = 4
+ROW_LEN = 6
+
+class SharedDetectionRing:
+  def __init__(self, name = None, slots = 64, max_dets = 1024, create = False):
+    if create:
+      size = 8 * HEADER_LEN + 8 * META_LEN * slots + 4 * ROW_LEN * slots * max_dets
+      self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+    else:
+      self.shm = shared_memory.SharedMemory(name=name)
+    buf = self.shm.buf
+    self.header = np.ndarray((HEADER_LEN,), dtype=np.int64, buffer=buf)
+    if create:
+      self.header[:] = (slots, max_dets, 0, 0)
+    self.slots, self.max_dets = int(self.header[0]), int(self.header[1])
+    off = 8 * HEADER_LEN
+    self.meta = np.ndarray((self.slots, META_LEN), dtype=np.int64, buffer=buf, offset=off)
+    if create:
+      self.meta[:] = 0
+    off += 8 * META_LEN * self.slots
+    self.data = np.ndarray((self.slots, self.max_dets, ROW_LEN), dtype=np.float32, buffer=buf, offset=off)
+    self.name = self.shm.name
+    self.owner = create
+
+
+  def write(self, frame_no, dets):
+    '''
+    Producer: publish one frame of detections
+      dets: (K,6) [class_id, confidence, center_x, center_y, width, height]
+    Returns the sequence number of the frame
+    '''
+    dets = np.asarray(dets, dtype=np.float32).reshape(-1, ROW_LEN)
+    if len(dets) > self.max_dets:
+      raise ValueError(f"{len(dets)} detections exceed the slot capacity of {self.max_dets}")
+    seq = int(self.header[2]) + 1
+    slot = (seq - 1) % self.slots
+    self.meta[slot,0] = -seq
+    self.data[slot,:len(dets)] = dets
+    self.meta[slot,1] = frame_no
+    self.meta[slot,2] = len(dets)
+    self.meta[slot,0] = seq
+    self.header[2] = seq
+    return seq
+
+
+  def close(self):
+    '''
+    Release the mapping, and the shared block itself if this ring created it
+    '''
+    del self.header, self.meta, self.data
+    self.shm.close()
+    if self.owner:
+      self.shm.unlink()
+
+
+class DetectionRingConsumer:
+  def __init__(self, ring):
+    self.ring = ring
+    self.expected = 1
+    self.overruns = 0
+    self.current = None
+
+
+  def poll(self):
+    '''
+    Fetch the next complete frame, if any
+    Returns (frame_no, (K,6) view into shared memory) or None
+    '''
+    ring = self.ring
+    slot = (self.expected - 1) % ring.slots
+    seq = int(ring.meta[slot,0])
+    if seq > self.expected or -seq > self.expected:
+      # lapped by the producer, skip to the oldest frame still in the ring,
+      # a slot being written has already lost its previous frame
+      oldest = max(int(ring.header[2]), abs(seq)) - ring.slots + 1
+      self.overruns += oldest - self.expected
+      self.expected = oldest
+      return self.poll() if oldest <= int(ring.header[2]) else None
+    if seq != self.expected:
+      return None
+    frame_no, count = int(ring.meta[slot,1]), int(ring.meta[slot,2])
+    self.current = (slot, self.expected)
+    self.expected += 1
+    return frame_no, ring.data[slot,:count]
+
+
+  def validate(self):
+    '''
+    Check the last polled frame was not overwritten while it was being read
+    '''
+    if self.current == None:
+      return False
+    slot, seq = self.current
+    if int(self.ring.meta[slot,0]) != seq:
+      self.overruns += 1
+      return False
+    return True
+
+
+def track_from_ring(consumer, otm, max_frames = None, idle_timeout = 1.0):
+  '''
+  Feed a streaming ObjectTrackManager from a ring until it goes idle
+  Layers are keyed by frame number, so frames lost to overruns are gaps
+  Each frame is detached from its slot with a single array copy, which is then
+  validated, so the manager keeps an array the producer cannot overwrite and
+  association reads detection centers from that copy without parsing it.
+  Returns the number of frames tracked
+  '''
+  frames, last = 0, time.perf_counter()
+  while max_frames == None or frames < max_frames:
+    got = consumer.poll()
+    if got == None:
+      if time.perf_counter() - last > idle_timeout:
+        break
+      time.sleep(0)
+      continue
+    frame_no, view = got
+    dets = view.copy()
+    if not consumer.validate():
+      continue
+    otm.add_new_array_layer(dets, frame_no, frame_no)
+    otm.process_latest_layer()
+    frames += 1
+    last = time.perf_counter()
+  return frames
+
+
+def _demo_producer(name, frames, detections, rate):
+  ring = SharedDetectionRing(name)
+  rng = np.random.default_rng(12345)
+  pos = rng.uniform(0, 1000, (detections, 2))
+  dets = np.zeros((detections, ROW_LEN), dtype=np.float32)
+  dets[:,1] = 1.0
+  dets[:,4:] = (20.0, 10.0)
+  for i in range(frames):
+    pos += rng.normal(0, 3, pos.shape)
+    dets[:,2:4] = pos
+    ring.write(i, dets)
+    if rate > 0:
+      time.sleep(1.0 / rate)
+  ring.close()
+
+
+def main():
+  '''
+  Demo: a detector process writes synthetic frames, this process tracks them
+  usage: SharedDetectionRing.py [frames] [detections] [frames_per_second (0 = unthrottled)]
+  '''
+  from StreamingObjectTrackManager import ObjectTrackManager
+  frames = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+  detections = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+  rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0
+  ring = SharedDetectionRing(slots=64, max_dets=max(1, detections), create=True)
+  producer = multiprocessing.Process(target=_demo_producer, args=(ring.name, frames, detections, rate))
+  t0 = time.perf_counter()
+  producer.start()
+  consumer = DetectionRingConsumer(ring)
+  tracked = track_from_ring(consumer, ObjectTrackManager())
+  wall = time.perf_counter() - t0
+  producer.join()
+  print(f"{tracked} frames tracked, {consumer.overruns} overruns, {tracked / wall:.1f} frames/s")
+  ring.close()
+
+if __name__ == '__main__':
+  main()
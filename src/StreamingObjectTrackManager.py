@@ -1,9 +1,15 @@
 import collections
+import heapq
+import time
 
-from aux_functions import *
+from math_functions import *
 from YoloBox import YoloBox
 from ObjectTrack import ObjectTrack
 from categories import CATEGORIES
+from association_functions import AssociationFxns
+from geometry_functions import GeometryFxns
+from TrackerStats import STATS
+from OTFTrackerApi import StreamingAnnotations as OTFAnno
 '''
   Global scope data structure for processing a set of images
   
@@ -20,37 +26,74 @@ class ObjectTrackManager:
               "radial_exclusion": 400,
             }
   display_constants = {"trail_len" : 0}
+  '''
+  Per-frame time budget, see process_layer_budgeted
+    frame_budget      : seconds per frame, None disables degradation
+    gate_factor       : tighter gate, as a fraction of radial_exclusion
+    max_drop_fraction : detections truncation may drop before refinement is skipped
+    cost_smoothing    : EWMA weight of the latest measured unit costs
+  '''
+  deadline_constants = { "frame_budget"      : None,
+                         "gate_factor"       : 0.5,
+                         "max_drop_fraction" : 0.5,
+                         "cost_smoothing"    : 0.2,
+                       }
+  '''
+  Frame keyed ingestion, see ingest_frame
+    reorder_window : frames held back waiting for an earlier, missing frame
+    frame_period   : seconds per frame, converts timestamps to frame positions
+  '''
+  ingest_constants = { "reorder_window" : 4,
+                       "frame_period"   : 1 / 30,
+                     }
   def __init__(self,
-                global_track_store = {},
-                inactive_tracks = [],
+                global_track_store = None,
+                inactive_tracks = None,
                 active_tracks = None,
-                img_filenames = [],
+                img_filenames = None,
                 annotation_list_fname = "",
-                filenames = [],
-                sys_paths = [],
+                filenames = None,
+                sys_paths = None,
                 frame_counter = 0,
-                layers = [],
-                linked_tracks = [],
-                trackmap = [],
-                fdict = {},
+                layers = None,
+                linked_tracks = None,
+                trackmap = None,
+                fdict = None,
                 categories = CATEGORIES,
-                img_centers = [],
+                img_centers = None,
                 imported = False
               ):
-    self.global_track_store = global_track_store
-    self.inactive_tracks = inactive_tracks
+    # containers are created per instance so managers never share state
+    self.global_track_store = global_track_store if global_track_store != None else {}
+    self.inactive_tracks = inactive_tracks if inactive_tracks != None else []
     self.active_tracks = active_tracks
-    self.img_filenames = img_filenames
+    self.img_filenames = img_filenames if img_filenames != None else []
     self.annotation_list_fname = annotation_list_fname
-    self.filenames = filenames
-    self.sys_paths = sys_paths
+    self.filenames = filenames if filenames != None else []
+    self.sys_paths = sys_paths if sys_paths != None else []
     self.frame_counter = frame_counter
-    self.layers = layers
-    self.linked_tracks = linked_tracks
-    self.fdict = fdict
+    self.layers = layers if layers != None else []
+    self.linked_tracks = linked_tracks if linked_tracks != None else []
+    self.fdict = fdict if fdict != None else {}
     self.categories = categories
-    self.img_centers = img_centers
+    self.img_centers = img_centers if img_centers != None else []
     self.imported = imported
+    self.layer_arrays = {}    # layer_idx -> packed detections, for array layers
+    self.frame_budget = ObjectTrackManager.deadline_constants["frame_budget"]
+    # seconds per detection read, per track head, per pair distance, per pair sorted, per detection assigned, per track created
+    self.unit_costs = {"setup": 1e-6, "predict": 5e-6, "pair": 2e-8, "sort": 1e-7, "assign": 1e-5, "create": 1.5e-5}
+    self.degraded_frames = []
+    self.last_frame_report = None
+    self.layer_frames = {}    # layer_idx -> frame position, for frame keyed layers
+    self.reorder_window = ObjectTrackManager.ingest_constants["reorder_window"]
+    self.frame_period = ObjectTrackManager.ingest_constants["frame_period"]
+    self.reorder_buffer = []  # heap of (frame position, seq, yolobox_arr)
+    self.reorder_seq = 0
+    self.first_timestamp = None
+    self.last_position = None
+    self.ingest_stats = {"late": 0, "dropped": 0, "reordered": 0}
+    self.association_cost = GeometryFxns.cost_constants["mode"]
+    self.stats = STATS
 
 
   def init_new_layer(self):
@@ -65,15 +108,49 @@ class ObjectTrackManager:
     Add a yolobox array of registered annotations to object track manager as a new layer
     '''
     self.layers.append(yolobox_arr)
-    print(self.layers)
   
+  def add_new_array_layer(self, arr, valid_frame_name = "frame_", frame_no = None):
+    '''
+    Add a packed (K,6) detection array as a new layer without parsing it
+    The array is kept, association reads detection centers from it directly
+    '''
+    self.add_new_layer(OTFAnno.register_array_layer(arr, valid_frame_name))
+    self.layer_arrays[len(self.layers) - 1] = arr
+    if frame_no != None:
+      self.layer_frames[len(self.layers) - 1] = frame_no
+
+  def add_new_timed_layer(self, yolobox_arr, frame_no = None, timestamp = None):
+    '''
+    Add a layer keyed by an explicit frame number or timestamp
+    Lifespans and motion prediction then count frames between layers instead
+    of layers, so dropped frames need no empty placeholder layers
+    '''
+    self.add_new_layer(yolobox_arr)
+    self.layer_frames[len(self.layers) - 1] = self.frame_position(frame_no, timestamp)
+
+  def frame_position(self, frame_no = None, timestamp = None):
+    '''
+    Convert a frame number or a timestamp in seconds to a frame position
+    Timestamps count from the first one seen, in units of frame_period
+    '''
+    if timestamp != None:
+      if self.first_timestamp == None:
+        self.first_timestamp = timestamp
+      return (timestamp - self.first_timestamp) / self.frame_period
+    return frame_no
+
+  def layer_position(self, layer_idx):
+    '''
+    Frame position of a layer, its index unless it was added with a frame key
+    '''
+    return self.layer_frames.get(layer_idx, layer_idx)
+
   def get_layer(self, layer_idx = 0):
     '''
     Accessor for a single layer by index
     returns a layer of yoloboxes
     '''
     if len(self.layers) == 0:
-      print()
       return []
     return self.layers[layer_idx]
   
@@ -116,6 +193,7 @@ class ObjectTrackManager:
     T.add_new_step(entity, fc)
     self.global_track_store[track_id] = T
     self.active_tracks.append(T)
+    self.stats.count("tracks_created")
   
   
   def initialize_tracks(self):
@@ -141,7 +219,9 @@ class ObjectTrackManager:
   def link_all_tracks(self, min_len = 0):
     '''
     Resolve linked lists to make tracks externally traversible
+    Returns the number of linked tracks
     '''
+    lap = self.stats.start()
     link_counter = 0
     for k,v in self.global_track_store.items():
       if v.get_step_count() < min_len:
@@ -150,7 +230,9 @@ class ObjectTrackManager:
       self.linked_tracks.append(k)
       self.link_single_track(k)
       # v.path[-1].parent_track = link_counter
-    print(f"{link_counter} tracks linked")
+    self.stats.lap("link", lap)
+    self.stats.count("tracks_linked", link_counter)
+    return link_counter
 
   
   def link_single_track(self, track_id):
@@ -168,64 +250,333 @@ class ObjectTrackManager:
       self.process_layer(i)
   
 
+  def process_latest_layer(self):
+    '''
+    Process the most recently added layer, initializing tracks on the first one
+    Returns the index of the processed layer
+    '''
+    layer_idx = len(self.layers) - 1
+    if self.active_tracks == None:
+      self.active_tracks = collections.deque()
+    self.process_layer(layer_idx)
+    return layer_idx
+
+
+  def get_stats(self, fmt = None):
+    '''
+    On demand snapshot of the timings and counters recorded so far, see TrackerStats
+    fmt: None for a dict, "json" or "prometheus" for text
+    '''
+    if fmt == "json":
+      return self.stats.to_json()
+    if fmt == "prometheus":
+      return self.stats.to_prometheus()
+    return self.stats.snapshot()
+
+
+  def ingest_frame(self, yolobox_arr, frame_no = None, timestamp = None):
+    '''
+    Frame keyed, reordering entry point for lossy capture pipelines
+    Frames are held in a small reorder buffer and processed in frame order: a
+    frame is released once it directly follows the last processed one, or when
+    more than reorder_window frames are held back. Missing frames are skipped,
+    frames older than the last processed one are dropped as late.
+    Returns the list of layer indices processed by this call
+    '''
+    pos = self.frame_position(frame_no, timestamp)
+    if self.last_position != None and pos <= self.last_position:
+      self.ingest_stats["late"] += 1
+      return []
+    if len(self.reorder_buffer) > 0 and pos < max(b[0] for b in self.reorder_buffer):
+      self.ingest_stats["reordered"] += 1
+    heapq.heappush(self.reorder_buffer, (pos, self.reorder_seq, yolobox_arr))
+    self.reorder_seq += 1
+    return self.release_frames()
+
+
+  def release_frames(self, flush = False):
+    '''
+    Process buffered frames which are next in order or overflow the reorder window
+    flush: process every buffered frame, e.g. at the end of a stream
+    Returns the list of layer indices processed
+    '''
+    processed = []
+    while len(self.reorder_buffer) > 0:
+      pos = self.reorder_buffer[0][0]
+      # within half a frame of the next expected position, tolerating timestamp jitter
+      in_order = self.last_position != None and abs(pos - self.last_position - 1) < 0.5
+      if not (flush or in_order or len(self.reorder_buffer) > self.reorder_window):
+        break
+      pos, _, yolobox_arr = heapq.heappop(self.reorder_buffer)
+      if self.last_position != None and pos - self.last_position > 1.5:
+        self.ingest_stats["dropped"] += int(round(pos - self.last_position)) - 1
+      self.last_position = pos
+      self.add_new_layer(yolobox_arr)
+      self.layer_frames[len(self.layers) - 1] = pos
+      processed.append(self.process_latest_layer())
+    return processed
+
+
+  def predict_heads(self, frame = None):
+    '''
+    Gather predictions from track heads
+    frame: optional frame position, motion is scaled by the frames elapsed
+    Returns (list of active tracks, (T,2) array of predicted centers)
+    '''
+    tracks = list(self.active_tracks) if self.active_tracks != None else []
+    pred = np.array([t.predict_next_box(frame) for t in tracks], dtype=np.float64).reshape(-1, 2)
+    return tracks, pred
+
+
+  def predict_head_boxes(self, frame = None):
+    '''
+    Predicted track head boxes, the latest box size at the predicted center
+    Returns (list of active tracks, (T,4) array of yolo boxes)
+    '''
+    tracks, pred = self.predict_heads(frame)
+    wh = np.array([t.path[-1].bbox[2:4] for t in tracks], dtype=np.float64).reshape(-1, 2)
+    return tracks, np.concatenate([pred, wh], axis=1)
+
+
+  def layer_boxes(self, layer_idx):
+    '''
+    Detection boxes of a layer
+    Returns a (D,4) array of yolo boxes
+    '''
+    if layer_idx in self.layer_arrays:
+      return self.layer_arrays[layer_idx][:,2:6]
+    return np.array([yb.bbox for yb in self.layers[layer_idx]], dtype=np.float64).reshape(-1, 4)
+
+
+  def layer_centers(self, layer_idx):
+    '''
+    Detection centers of a layer
+    Returns a (D,2) array
+    '''
+    if layer_idx in self.layer_arrays:
+      return self.layer_arrays[layer_idx][:,2:4]
+    return np.array([yb.get_center_coord() for yb in self.layers[layer_idx]], dtype=np.float64).reshape(-1, 2)
+
+
+  def reap_expired(self, fc):
+    '''
+    Move active tracks which are no longer alive at frame position fc to the
+    inactive list, before the layer at fc is associated. Frames skipped by a
+    frame keyed layer then expire tracks as the empty layers padding them would.
+    '''
+    if self.active_tracks == None:
+      self.active_tracks = collections.deque()
+    max_rot = len(self.active_tracks)
+    for i in range(max_rot):
+      if self.active_tracks[-1].is_alive(fc, ObjectTrackManager.constants["track_lifespan"]):
+        self.active_tracks.rotate()
+      else:
+        self.inactive_tracks.append(self.active_tracks.pop())
+    self.stats.count("tracks_reaped", max_rot - len(self.active_tracks))
+
+
   def process_layer(self,layer_idx):
     '''
     Update preexisting tracks with a single layer of entities
     '''
+    st = self.stats
+    t_frame = st.start()
+    self.reap_expired(self.layer_position(layer_idx))
+    if self.frame_budget != None:
+      report = self.process_layer_budgeted(layer_idx)
+      st.end_frame(t_frame, len(self.active_tracks), self.layer_position(layer_idx))
+      return report
+    lap = st.lap("reap", t_frame)
+    if self.association_cost == "distance":
+      tracks, pred = self.predict_heads(self.layer_frames.get(layer_idx))
+      lap = st.lap("predict", lap)
+      cost = AssociationFxns.center_distances(pred, self.layer_centers(layer_idx))
+    else:
+      tracks, pred = self.predict_head_boxes(self.layer_frames.get(layer_idx))
+      lap = st.lap("predict", lap)
+      cost = GeometryFxns.association_cost(self.layer_boxes(layer_idx), pred, self.association_cost,
+                                           gate=ObjectTrackManager.constants["radial_exclusion"])
+    lap = st.lap("pair", lap)
+    d_idx, t_idx, dist = AssociationFxns.sorted_pairs(cost)
+    st.lap("sort", lap)
+    st.count("pairs_evaluated", len(dist))
+    self.assign_pairs(layer_idx, tracks, d_idx, t_idx, dist)
+    st.end_frame(t_frame, len(self.active_tracks), self.layer_position(layer_idx))
+
+
+  def process_layer_budgeted(self, layer_idx):
+    '''
+    Update preexisting tracks with a single layer of entities within frame_budget
+
+    Frame cost is estimated from the track and detection counts and measured
+    unit costs: per detection read, per track head predicted, per pair distance,
+    per pair sorted, per detection assigned and per track created, detections
+    beyond the track count being expected to start tracks.
+    When the estimate exceeds the budget, the frame degrades in this order:
+      1 gating     : pairs farther apart than gate_factor * radial_exclusion are
+                     dropped before sorting, the share kept is estimated from the
+                     area the detections spread over
+      2 truncation : only the most confident detections are associated, dropping
+                     at most max_drop_fraction of them
+      3 refinement : track heads are not extrapolated, their last center is used,
+                     and truncation continues as far as the budget requires
+    Truncated detections are neither associated nor start tracks, they keep
+    parent_track None. Degraded frames are reported in degraded_frames.
+    Returns the frame report
+    '''
+    t0 = time.perf_counter()
+    dc = ObjectTrackManager.deadline_constants
+    budget = self.frame_budget
     curr_layer = self.layers[layer_idx]
-    fc = layer_idx
-    pred,pairs = [],[]
-    
-    # gather predictions from track heads
-    for t in self.active_tracks:
-      # if t.is_alive(fc, ObjectTrackManager.constants["track_lifespan"])
-      pred.append((t.track_id, t.predict_next_box()))
-      # else:
-
-    # create list of all pairs between track heads and curr layer
-    for c in range(len(curr_layer)):
-      for p in pred:
-        d = MathFxns.euclidean_dist(p[1],curr_layer[c].get_center_coord())
-        pairs.append((p[0], c, d))
-    
-    sortkey = lambda s: s[2]
-    pairs = sorted(pairs,key=sortkey)
-    # print(pairs)
-    pc,tc,lc = 0,len(self.active_tracks),len(curr_layer)
+    tracks = list(self.active_tracks)
+    T, D = len(tracks), len(curr_layer)
+    c = self.unit_costs
+    centers = self.layer_centers(layer_idx)
+    keep = np.arange(D)
+    level, gate, share = 0, None, 1.0
+    # reading the layer is spent before any degradation applies
+    fixed = c["setup"] * D
+    per_det = (c["pair"] + c["sort"]) * T + c["assign"]
+    estimate = fixed + c["predict"] * T + per_det * D + c["create"] * max(D - T, 0)
+
+    if estimate > budget and T > 0:
+      level = 1
+      gate = ObjectTrackManager.constants["radial_exclusion"] * dc["gate_factor"]
+      # share of pairs within the gate, for detections spread evenly over their bounding box
+      w, h = centers.max(axis=0) - centers.min(axis=0) if D > 1 else (0, 0)
+      share = min(1.0, np.pi * gate * gate / max(w * h, 1.0))
+      per_det = (c["pair"] + c["sort"] * share) * T + c["assign"]
+      estimate = fixed + c["predict"] * T + per_det * D + c["create"] * max(D - T, 0)
+
+      if estimate > budget:
+        level = 2
+        conf = np.array([0.0 if yb.confidence == None else yb.confidence for yb in curr_layer])
+        order = np.argsort(-conf, kind="stable")
+        # detections affordable within room, those beyond T also start tracks
+        affordable = lambda room: int(room / per_det if room <= per_det * T else
+                                      T + (room - per_det * T) / (per_det + c["create"]))
+        k = affordable(budget - fixed - c["predict"] * T)
+        if k < D - int(D * dc["max_drop_fraction"]):
+          # truncation alone is not enough, stop refining predictions
+          level = 3
+          k = affordable(budget - fixed)
+        k = min(max(k, 0), D)
+        keep = np.sort(order[:k])
+        estimate = fixed + (c["predict"] * T if level < 3 else 0) + per_det * k + c["create"] * max(k - T, 0)
+
+    t1 = time.perf_counter()
+    if level < 3:
+      tracks, pred = self.predict_heads(self.layer_frames.get(layer_idx))
+    else:
+      pred = np.array([t.path[-1].get_center_coord() for t in tracks], dtype=np.float64).reshape(-1, 2)
+    t2 = time.perf_counter()
+    cost = AssociationFxns.center_distances(pred, centers[keep])
+    t3 = time.perf_counter()
+    d_idx, t_idx, dist = AssociationFxns.sorted_pairs(cost, gate)
+    d_idx = keep[d_idx]
+    t4 = time.perf_counter()
+    created = len(self.global_track_store)
+    self.assign_pairs(layer_idx, tracks, d_idx, t_idx, dist, candidates=keep)
+    created = len(self.global_track_store) - created
+    t5 = time.perf_counter()
+
+    if self.stats.enabled:
+      for stage,seconds in [("predict", t2 - t1), ("pair", t3 - t2), ("sort", t4 - t3)]:
+        self.stats.add_time(stage, seconds)
+      # pairs of truncated detections are never costed, those beyond the gate are
+      self.stats.count("pairs_evaluated", cost.size)
+      self.stats.count("pairs_excluded", T * D - cost.size)
+      self.stats.count("pairs_gated", cost.size - len(dist))
+
+    # update unit costs from measurements
+    a = dc["cost_smoothing"]
+    # assignment time is split between kept detections and created tracks by the other's cost
+    measured = {"setup": (t1 - t0, D),
+                "predict": (t2 - t1, T if level < 3 else 0),
+                "pair": (t3 - t2, cost.size),
+                "sort": (t4 - t3, len(dist)),
+                "assign": (max(t5 - t4 - c["create"] * created, 0), len(keep)),
+                "create": (max(t5 - t4 - c["assign"] * len(keep), 0), created)}
+    for k,(seconds, n) in measured.items():
+      if n > 0:
+        c[k] = (1 - a) * c[k] + a * seconds / n
+
+    report = {"layer": layer_idx,
+              "level": level,
+              "gate": gate,
+              "tracks": T,
+              "detections": D,
+              "kept": len(keep),
+              "pairs": len(dist),
+              "estimate_s": estimate,
+              "elapsed_s": time.perf_counter() - t0}
+    self.last_frame_report = report
+    if level > 0:
+      self.degraded_frames.append(report)
+    return report
+
+
+  def assign_pairs(self, layer_idx, tracks, d_idx, t_idx, dist, candidates = None):
+    '''
+    Greedily assign sorted (detection, track, distance) pairs of a layer,
+    create tracks from unused entities and reap expired tracks
+    candidates: optional indices of the only detections which may be used,
+                every unused candidate starts a new track
+    '''
+    curr_layer = self.layers[layer_idx]
+    fc = self.layer_position(layer_idx)
+    st = self.stats
+    lap = st.start()
+    pairs = len(dist)
+    pc,tc,lc = 0,len(tracks),len(curr_layer) if candidates is None else len(candidates)
+    radial_exclusion = ObjectTrackManager.constants["radial_exclusion"]
+    gated = 0
     # update existing tracks with new entities
-    while tc > 0 and lc > 0 and pc < len(pairs):
-      elem = pairs[pc]
-      if curr_layer[elem[1]].parent_track != None:
+    while tc > 0 and lc > 0 and pc < pairs:
+      yb = curr_layer[d_idx[pc]]
+      if yb.parent_track != None:
         pc += 1
         continue
       
       '''
         We add a simple check 
       '''
-      if elem[2] > ObjectTrackManager.constants["radial_exclusion"]:
+      if dist[pc] > radial_exclusion:
+        gated += 1
         tc-=1
         pc+=1
         continue
       # add entity to closest track
-      T = self.global_track_store[elem[0]]
-      T.add_new_step(curr_layer[elem[1]], fc)
+      tracks[t_idx[pc]].add_new_step(yb, fc)
       # update counters
       tc -= 1
       lc -= 1
       pc += 1
+    st.count("pairs_gated", gated)
+    lap = st.lap("assign", lap)
     
     # create new tracks from unused entities
     if lc > 0:
-      while lc > 0 and pc < len(pairs):
-        elem = pairs[pc]
-        if curr_layer[elem[1]].parent_track != None:
+      while lc > 0 and pc < pairs:
+        yb = curr_layer[d_idx[pc]]
+        if yb.parent_track != None:
           pc += 1
           continue
         # create new ObjectTrack
-        self.create_new_track(curr_layer[elem[1]],fc)
+        self.create_new_track(yb,fc)
         # update counters
         lc -= 1
         pc += 1
+      if candidates is not None:
+        # candidates without any pair left, e.g. gated out
+        for c in candidates:
+          if curr_layer[c].parent_track == None:
+            self.create_new_track(curr_layer[c],fc)
+      elif len(tracks) == 0:
+        # without any track heads there are no pairs, every entity starts a track
+        for yb in curr_layer:
+          self.create_new_track(yb,fc)
+    lap = st.lap("create", lap)
     
     if tc > 0:
       # reap tracks which are no longer active
@@ -236,3 +587,5 @@ class ObjectTrackManager:
           self.active_tracks.rotate()
         else:
           self.inactive_tracks.append(self.active_tracks.pop())
+      st.count("tracks_reaped", max_rot - len(self.active_tracks))
+      st.lap("reap", lap)
@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+import collections
+import concurrent.futures
+import queue
+import threading
+
+from StreamingObjectTrackManager import ObjectTrackManager
+from OTFTrackerApi import StreamingAnnotations
+
+'''
+  Thread-safe ingestion front end for the streaming ObjectTrackManager
+
+  Any number of producer threads submit frames. Submitting only puts a tuple
+  on a bounded queue and returns a Future, so producer latency is a constant
+  time enqueue. A single tracker thread owns the manager: it registers the
+  annotations and hands each frame to the manager's ingest_frame, then
+  publishes the per-detection track ids through the Future and optional
+  callback once the manager has processed the frame.
+
+  Frame order is restored by the manager's reorder buffer, see
+  ObjectTrackManager.ingest_frame: a frame waits until the gap before it is
+  filled or until more than `reorder_window` frames are held back. The tracker
+  thread adds one rule, when the queue has been idle for `idle_flush` seconds
+  every held frame is released. Frames older than the last processed one are
+  rejected. Layers are keyed by frame number, so skipped frames count towards
+  track lifespans and motion prediction without empty layers.
+'''
+_STOP = object()
+
+class StreamingTrackerThread:
+  def __init__(self, manager = None, max_queue = 256, reorder_window = None, idle_flush = 0.05):
+    self.manager = manager if manager != None else ObjectTrackManager()
+    if reorder_window != None:
+      self.manager.reorder_window = reorder_window
+    self.queue = queue.Queue(maxsize=max_queue)
+    self.idle_flush = idle_flush
+    self.waiting = {}         # frame_no -> deque of (layer, future) held by the manager
+    self.thread = threading.Thread(target=self.run, name="tracker", daemon=True)
+
+
+  def start(self):
+    self.thread.start()
+    return self
+
+
+  def stop(self, timeout = None):
+    '''
+    Process everything already submitted, then stop the tracker thread
+    '''
+    self.queue.put(_STOP)
+    self.thread.join(timeout)
+
+
+  def submit(self, frame_no, yolobox_arr, callback = None, block = True):
+    '''
+    Enqueue a layer of registered YoloBoxes for frame_no
+    Raises queue.Full when block is False and the queue is full
+    Returns a Future resolving to a list of track ids, one per detection
+    '''
+    return self.enqueue(frame_no, "yolobox", yolobox_arr, callback, block)
+
+
+  def submit_LOCO(self, frame_no, LOCO_annos, callback = None, block = True):
+    '''
+    Enqueue raw LOCO annotations, registered on the tracker thread
+    Returns a Future resolving to a list of track ids, one per detection
+    '''
+    return self.enqueue(frame_no, "LOCO", LOCO_annos, callback, block)
+
+
+  def call(self, fxn):
+    '''
+    Run fxn(manager) on the tracker thread, e.g. to snapshot tracks safely
+    Returns a Future of its result
+    '''
+    fut = concurrent.futures.Future()
+    self.queue.put((None, "call", fxn, fut))
+    return fut
+
+
+  def enqueue(self, frame_no, kind, payload, callback, block):
+    fut = concurrent.futures.Future()
+    if callback != None:
+      fut.add_done_callback(callback)
+    self.queue.put((frame_no, kind, payload, fut), block=block)
+    return fut
+
+
+  def run(self):
+    '''
+    Tracker thread main loop
+    '''
+    M = self.manager
+    while True:
+      try:
+        item = self.queue.get(timeout=self.idle_flush if len(M.reorder_buffer) > 0 else None)
+      except queue.Empty:
+        # idle, stop waiting for missing frames
+        self.release(M.release_frames, True)
+        continue
+      if item is _STOP:
+        self.release(M.release_frames, True)
+        return
+
+      frame_no, kind, payload, fut = item
+      if kind == "call":
+        self.resolve(fut, payload, M)
+        continue
+      try:
+        layer = payload
+        if kind == "LOCO":
+          layer = StreamingAnnotations.register_new_LOCO_annotations(payload)
+      except Exception as e:
+        self.fail(fut, e)
+        continue
+      late = M.ingest_stats["late"]
+      self.waiting.setdefault(frame_no, collections.deque()).append((layer, fut))
+      self.release(M.ingest_frame, layer, frame_no)
+      if M.ingest_stats["late"] > late:
+        # dropped by the manager, frames it waits on are all newer
+        del self.waiting[frame_no]
+        self.fail(fut, ValueError(f"frame {frame_no} arrived after frame {M.last_position} was processed"))
+
+
+  def release(self, fxn, *args):
+    '''
+    Call a manager ingest function and publish the frames it processed
+    An exception is published to the frame being processed when it was raised
+    '''
+    M = self.manager
+    n = len(M.layers)
+    error = None
+    try:
+      fxn(*args)
+    except Exception as e:
+      error = e
+    for i in range(n, len(M.layers)):
+      frame_no = M.layer_frames[i]
+      layer, fut = self.waiting[frame_no].popleft()
+      if len(self.waiting[frame_no]) == 0:
+        del self.waiting[frame_no]
+      if error != None and i == len(M.layers) - 1:
+        self.fail(fut, error)
+      elif fut.set_running_or_notify_cancel():
+        fut.set_result([yb.parent_track for yb in layer])
+
+
+  def fail(self, fut, e):
+    # a cancelled future takes no result
+    if fut.set_running_or_notify_cancel():
+      fut.set_exception(e)
+
+
+  def resolve(self, fut, fxn, *args):
+    if not fut.set_running_or_notify_cancel():
+      return
+    try:
+      fut.set_result(fxn(*args))
+    except Exception as e:
+      fut.set_exception(e)
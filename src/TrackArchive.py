@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+import collections
+import json
+import lzma
+import struct
+import zlib
+import numpy as np
+
+from YoloBox import YoloBox
+from ObjectTrack import ObjectTrack
+from ObjectTrackManager import ObjectTrackManager
+from categories import CATEGORIES
+
+'''
+  Compact archive of linked tracks
+
+  Per track metadata is stored once, and each track's steps as delta encoded,
+  quantized integer sequences, so consecutive steps which differ by a few
+  pixels become long runs of small numbers for the codec.
+
+    tracks : int64 [track_id, category, start_frame, length]
+    colors : uint8 [r, g, b]
+    frames : int32 frame delta of each step, from the track's start frame
+    bboxes : int32 (4, steps) bbox / quantum, delta encoded per track,
+             the first step of a track relative to 0
+    flags  : uint8 1 for synthetic steps
+
+  File layout: b"OTMA", version byte, codec byte (b"z" zlib, b"x" lzma), then the
+  compressed payload: a length prefixed JSON header (quantum, filenames, image
+  sizes, categories, constants, array lengths) followed by the raw arrays.
+  Boxes round trip within quantum / 2 pixels.
+'''
+MAGIC = b"OTMA"
+VERSION = 1
+CODECS = {b"z": (zlib.compress, zlib.decompress), b"x": (lzma.compress, lzma.decompress)}
+DEFAULT_IMG_SIZE = (1920, 1080)
+
+class TrackArchive:
+  def __init__(self,
+                header = None,
+                tracks = None,
+                colors = None,
+                frames = None,
+                bboxes = None,
+                flags = None
+              ):
+    self.header = header if header != None else {}
+    self.tracks = tracks if tracks is not None else np.zeros((0, 4), dtype=np.int64)
+    self.colors = colors if colors is not None else np.zeros((0, 3), dtype=np.uint8)
+    self.frames = frames if frames is not None else np.zeros(0, dtype=np.int32)
+    self.bboxes = bboxes if bboxes is not None else np.zeros((4, 0), dtype=np.int32)
+    self.flags = flags if flags is not None else np.zeros(0, dtype=np.uint8)
+
+
+  def build(OTM, quantum = 0.05):
+    '''
+    Encode the linked tracks of a frozen ObjectTrackManager
+    Returns a TrackArchive
+    '''
+    fidx = OTM.get_frame_index()
+    tracks, colors, frames, boxes, flags = [], [], [], [], []
+    for k in OTM.linked_tracks:
+      T = OTM.get_track(k)
+      if len(T.path) == 0:
+        continue
+      f = [fidx[yb.img_filename] for yb in T.path]
+      tracks.append((T.track_id, int(T.class_id), f[0], len(T.path)))
+      colors.append(tuple(T.color))
+      frames.extend(f)
+      boxes.extend(yb.bbox for yb in T.path)
+      flags.extend(1 if yb.synthetic else 0 for yb in T.path)
+
+    tracks = np.array(tracks, dtype=np.int64).reshape(-1, 4)
+    starts = np.cumsum(tracks[:,3]) - tracks[:,3]
+    q = np.rint(np.array(boxes, dtype=np.float64).reshape(-1, 4) / quantum).astype(np.int64)
+    frames = np.array(frames, dtype=np.int64)
+    # delta encode within each track, the first step of a track is kept absolute
+    dq = np.diff(q, axis=0, prepend=np.zeros((1, 4), dtype=np.int64))
+    df = np.diff(frames, prepend=0)
+    dq[starts] = q[starts]
+    df[starts] = 0
+
+    sizes = [(int(c[0] * 2), int(c[1] * 2)) for c in OTM.img_centers] if OTM.imported else []
+    header = {"quantum": quantum,
+              "filenames": OTM.filenames,
+              "image_sizes": sizes,
+              "categories": OTM.categories,
+              "constants": ObjectTrackManager.constants}
+    return TrackArchive(header, tracks, np.array(colors, dtype=np.uint8).reshape(-1, 3),
+                        df.astype(np.int32), np.ascontiguousarray(dq.T.astype(np.int32)), np.array(flags, dtype=np.uint8))
+
+
+  def save(self, filename, codec = "lzma"):
+    '''
+    Write the archive, codec "lzma" (smallest) or "zlib" (fastest)
+    '''
+    c = b"x" if codec == "lzma" else b"z"
+    header = dict(self.header, tracks=len(self.tracks), steps=len(self.frames))
+    h = json.dumps(header).encode()
+    payload = b"".join([struct.pack(">I", len(h)), h,
+                        self.tracks.astype("<i8").tobytes(),
+                        self.colors.tobytes(),
+                        self.frames.astype("<i4").tobytes(),
+                        self.bboxes.astype("<i4").tobytes(),
+                        self.flags.tobytes()])
+    f = open(filename, "wb")
+    f.write(MAGIC + bytes([VERSION]) + c + CODECS[c][0](payload))
+    f.close()
+
+
+  def load(filename):
+    '''
+    Read an archive written by save
+    Returns a TrackArchive
+    '''
+    f = open(filename, "rb")
+    raw = f.read()
+    f.close()
+    if raw[:4] != MAGIC or raw[4] != VERSION or raw[5:6] not in CODECS:
+      raise ValueError(f"{filename} is not a version {VERSION} track archive")
+    payload = CODECS[raw[5:6]][1](raw[6:])
+    n = struct.unpack_from(">I", payload)[0]
+    header = json.loads(payload[4:4 + n])
+    T, S = header.pop("tracks"), header.pop("steps")
+    off = 4 + n
+    def take(dtype, count):
+      nonlocal off
+      arr = np.frombuffer(payload, dtype=dtype, count=count, offset=off)
+      off += arr.nbytes
+      return arr
+    tracks = take("<i8", T * 4).reshape(T, 4)
+    colors = take(np.uint8, T * 3).reshape(T, 3)
+    frames = take("<i4", S)
+    bboxes = take("<i4", 4 * S).reshape(4, S)
+    flags = take(np.uint8, S)
+    return TrackArchive(header, tracks, colors, frames, bboxes, flags)
+
+
+  def decode(self):
+    '''
+    Undo the delta encoding
+    Returns (absolute frames (S,), bboxes (S,4) in pixels, track index (S,))
+    '''
+    lengths = self.tracks[:,3]
+    starts = np.cumsum(lengths) - lengths
+    track = np.repeat(np.arange(len(self.tracks)), lengths)
+    # cumulative sums restart at each track, its first step being absolute
+    q = np.cumsum(self.bboxes.T.astype(np.int64), axis=0)
+    base = np.zeros((len(self.tracks), 4), dtype=np.int64)
+    base[1:] = q[starts[1:] - 1]
+    q -= base[track]
+    df = np.cumsum(self.frames.astype(np.int64))
+    fbase = np.zeros(len(self.tracks), dtype=np.int64)
+    fbase[1:] = df[starts[1:] - 1]
+    frames = df - fbase[track] + self.tracks[track,2]
+    return frames, q * self.header["quantum"], track
+
+
+  def to_manager(self):
+    '''
+    Load the archived tracks into a new, frozen ObjectTrackManager, like import_loco_fmt
+    Returns an ObjectTrackManager
+    '''
+    h = self.header
+    OTM = ObjectTrackManager(categories=h.get("categories", CATEGORIES), imported=True)
+    sizes = h.get("image_sizes") or [DEFAULT_IMG_SIZE] * len(h["filenames"])
+    for i,fn in enumerate(h["filenames"]):
+      OTM.filenames.append(fn)
+      OTM.fdict[fn] = i
+      OTM.layers.append([])
+      OTM.img_centers.append((int(sizes[i][0] / 2), int(sizes[i][1] / 2)))
+
+    frames, boxes, track = self.decode()
+    boxes = boxes.tolist()
+    frames = frames.tolist()
+    for n,(track_id, category, start, length) in enumerate(self.tracks.tolist()):
+      T = ObjectTrack(track_id, category)
+      T.color = tuple(int(c) for c in self.colors[n])
+      OTM.global_track_store[track_id] = T
+      OTM.linked_tracks.append(track_id)
+    tracks = [OTM.global_track_store[t] for t in self.tracks[:,0].tolist()]
+    for i,t in enumerate(track.tolist()):
+      f = frames[i]
+      yb = YoloBox(tracks[t].class_id, boxes[i], f'{OTM.filenames[f][:-3]}txt',
+                   OTM.img_centers[f], synthetic=bool(self.flags[i]))
+      OTM.layers[f].append(yb)
+      tracks[t].add_new_step(yb, f)
+    for T in tracks:
+      T.link_path()
+    OTM.inactive_tracks = tracks
+    OTM.active_tracks = collections.deque()
+    return OTM
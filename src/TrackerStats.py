@@ -0,0 +1,302 @@
+#!/usr/bin/python3
+import collections
+import json
+import multiprocessing
+import os
+import threading
+import time
+import numpy as np
+
+'''
+  Per-stage timings and counters of the loader and trackers
+
+  Disabled by default. Call sites take laps from a start time, a disabled
+  TrackerStats answers every call without reading the clock:
+
+    t = STATS.start()
+    ...predict...
+    t = STATS.lap("predict", t)
+    ...pair...
+    t = STATS.lap("pair", t)
+
+  Stages    : load, probe, parse, predict, pair, sort, assign, create, reap,
+              stitch, link, interpolate, export, decode, rasterize, write
+  Counters  : frames, pairs_evaluated, pairs_excluded, pairs_gated, tracks_created,
+              tracks_reaped, tracks_linked
+  Gauges    : active_tracks, after the latest frame
+
+  Of the track x detection pairs of a frame, pairs_evaluated had their cost
+  computed and pairs_excluded never did, left out by partitioning, confidence
+  tiers or a frame budget. pairs_gated counts evaluated pairs rejected for
+  lying farther apart than a gate, radial_exclusion during assignment or the
+  tighter gate of a degraded frame.
+
+  Frame percentiles are over the latest frame_window frames, frame counts and
+  totals over all of them. The trace keeps the latest trace_limit events, plus
+  the names of its lanes.
+
+  STATS is shared by the loader and every manager unless a manager is given
+  its own TrackerStats.
+
+  With tracing on, every lap and frame is also kept as a Chrome trace event
+  (chrome://tracing, ui.perfetto.dev), on the lane of its process and thread.
+  Worker processes hand their events back with take_trace, the parent adds
+  them with add_trace before save_trace. Their timings and counters travel
+  the same way, with take_stats and add_stats, before dump. A forked worker
+  starts from empty timings and counters, so the parent's are never counted twice.
+'''
+STAGES = ["load", "probe", "parse", "predict", "pair", "sort", "assign", "create", "reap",
+          "stitch", "link", "interpolate", "export", "decode", "rasterize", "write"]
+# trace event category of each stage
+CATEGORY = {"load": "loader", "probe": "loader", "parse": "loader",
+            "stitch": "postprocess", "link": "postprocess", "interpolate": "postprocess",
+            "export": "exporter", "decode": "render", "rasterize": "render", "write": "render"}
+COUNTERS = ["frames", "pairs_evaluated", "pairs_excluded", "pairs_gated",
+            "tracks_created", "tracks_reaped", "tracks_linked"]
+GAUGES = ["active_tracks"]
+FRAME_WINDOW = 100000
+TRACE_LIMIT = 1000000
+
+class TrackerStats:
+  def __init__(self, enabled = False, tracing = False, frame_window = FRAME_WINDOW, trace_limit = TRACE_LIMIT):
+    self.enabled = enabled or tracing
+    self.tracing = tracing
+    self.frame_window = frame_window
+    self.trace_limit = trace_limit
+    self.reset()
+
+
+  def reset(self):
+    '''
+    Clear every timing, counter and trace event
+    '''
+    self.reset_counts()
+    self.trace = collections.deque(maxlen=self.trace_limit)          # chrome trace events, when tracing
+    self.lane_names = []      # process and thread name events of the lanes in trace
+    self.lanes = set()        # (pid, tid) lanes already named
+
+
+  def reset_counts(self):
+    '''
+    Clear every timing and counter, keeping the trace
+    '''
+    self.stages = {}          # stage -> [count, total, min, max] in seconds
+    self.counters = dict.fromkeys(COUNTERS, 0)
+    self.gauges = dict.fromkeys(GAUGES, 0)
+    self.frame_times = collections.deque(maxlen=self.frame_window)   # seconds per frame, latest frames
+    self.frame_total = [0, 0.0, 0.0]                                  # [count, total, max] seconds of all frames
+
+
+  def start(self):
+    '''
+    Start time of a lap, 0 when disabled
+    '''
+    return time.perf_counter() if self.enabled else 0
+
+
+  def lap(self, stage, t0):
+    '''
+    Record the time since t0 under stage
+    Returns the current time, the start of the next lap
+    '''
+    if not self.enabled:
+      return 0
+    t = time.perf_counter()
+    self.add_time(stage, t - t0)
+    if self.tracing:
+      self.span(stage, t0, t)
+    return t
+
+
+  def add_time(self, stage, seconds):
+    s = self.stages.get(stage)
+    if s == None:
+      self.stages[stage] = [1, seconds, seconds, seconds]
+      return
+    s[0] += 1
+    s[1] += seconds
+    s[2] = min(s[2], seconds)
+    s[3] = max(s[3], seconds)
+
+
+  def count(self, counter, n = 1):
+    if self.enabled:
+      self.counters[counter] = self.counters.get(counter, 0) + n
+
+
+  def end_frame(self, t0, active_tracks, frame = None):
+    '''
+    Close a frame started at t0
+    '''
+    if not self.enabled:
+      return
+    t = time.perf_counter()
+    self.frame_times.append(t - t0)
+    ft = self.frame_total
+    ft[0] += 1
+    ft[1] += t - t0
+    ft[2] = max(ft[2], t - t0)
+    self.counters["frames"] += 1
+    self.gauges["active_tracks"] = active_tracks
+    if self.tracing:
+      self.span("frame", t0, t, {"frame": frame, "active_tracks": active_tracks})
+      self.trace.append({"name": "active_tracks", "ph": "C", "ts": t * 1e6,
+                         "pid": os.getpid(), "args": {"active_tracks": active_tracks}})
+
+
+  def span(self, name, t0, t1, args = None):
+    '''
+    Add a complete trace event from t0 to t1 on the current process and thread
+    '''
+    pid, tid = os.getpid(), threading.get_native_id()
+    if (pid, tid) not in self.lanes:
+      self.lanes.add((pid, tid))
+      self.lane_names.append({"name": "process_name", "ph": "M", "pid": pid, "tid": tid,
+                              "args": {"name": multiprocessing.current_process().name}})
+      self.lane_names.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                              "args": {"name": threading.current_thread().name}})
+    event = {"name": name, "cat": CATEGORY.get(name, "tracker"), "ph": "X",
+             "ts": t0 * 1e6, "dur": (t1 - t0) * 1e6, "pid": pid, "tid": tid}
+    if args != None:
+      event["args"] = args
+    self.trace.append(event)
+
+
+  def take_trace(self):
+    '''
+    Remove the trace events recorded so far, for a worker to return them
+    Events a forked worker inherited from its parent are dropped, the parent has them
+    Returns a list of events
+    '''
+    pid = os.getpid()
+    events = [e for e in self.lane_names + list(self.trace) if e["pid"] == pid]
+    self.lane_names = []
+    self.trace.clear()
+    return events
+
+
+  def add_trace(self, events):
+    '''
+    Add trace events returned by a worker
+    '''
+    if self.tracing:
+      self.lane_names.extend(e for e in events if e["ph"] == "M")
+      self.trace.extend(e for e in events if e["ph"] != "M")
+
+
+  def take_stats(self):
+    '''
+    Remove the timings and counters recorded so far, for a worker to return them
+    Returns a dict for add_stats, None when disabled
+    '''
+    if not self.enabled:
+      return None
+    data = {"stages": self.stages,
+            "counters": self.counters,
+            "gauges": self.gauges,
+            "frame_times": list(self.frame_times),
+            "frame_total": self.frame_total}
+    self.reset_counts()
+    return data
+
+
+  def add_stats(self, data):
+    '''
+    Merge timings and counters returned by a worker, gauges take the worker's values
+    '''
+    if not self.enabled or data == None:
+      return
+    for k,(n, total, lo, hi) in data["stages"].items():
+      s = self.stages.get(k)
+      if s == None:
+        self.stages[k] = [n, total, lo, hi]
+        continue
+      s[0] += n
+      s[1] += total
+      s[2] = min(s[2], lo)
+      s[3] = max(s[3], hi)
+    for k,v in data["counters"].items():
+      self.counters[k] = self.counters.get(k, 0) + v
+    self.gauges.update(data["gauges"])
+    self.frame_times.extend(data["frame_times"])
+    n, total, hi = data["frame_total"]
+    ft = self.frame_total
+    ft[0] += n
+    ft[1] += total
+    ft[2] = max(ft[2], hi)
+
+
+  def save_trace(self, filename):
+    '''
+    Write the trace events in the Chrome trace event JSON format, time from the first event
+    '''
+    t0 = min([e["ts"] for e in self.trace] or [0])
+    events = self.lane_names + [dict(e, ts=e["ts"] - t0) for e in self.trace]
+    f = open(filename, "w")
+    f.write(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}))
+    f.close()
+
+
+  def snapshot(self):
+    '''
+    Returns the current timings and counters as a dict
+    '''
+    stages = {}
+    for k,(n, total, lo, hi) in self.stages.items():
+      stages[k] = {"count": n, "total_s": total, "mean_s": total / n, "min_s": lo, "max_s": hi}
+    n, total, hi = self.frame_total
+    frames = {"count": n}
+    if len(self.frame_times) > 0:
+      ft = np.array(self.frame_times)
+      frames.update({"total_s": total,
+                     "p50_s": float(np.percentile(ft, 50)),
+                     "p99_s": float(np.percentile(ft, 99)),
+                     "max_s": hi,
+                     "window": len(ft)})
+    return {"stages": stages,
+            "frames": frames,
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges)}
+
+
+  def to_json(self, indent = 2):
+    return json.dumps(self.snapshot(), indent=indent)
+
+
+  def to_prometheus(self, prefix = "trackbuilder"):
+    '''
+    Returns the snapshot in the Prometheus text exposition format
+    '''
+    snap = self.snapshot()
+    lines = [f"# HELP {prefix}_stage_seconds Time spent per stage",
+             f"# TYPE {prefix}_stage_seconds summary"]
+    for k,v in snap["stages"].items():
+      lines.append(f'{prefix}_stage_seconds_sum{{stage="{k}"}} {v["total_s"]:.9f}')
+      lines.append(f'{prefix}_stage_seconds_count{{stage="{k}"}} {v["count"]}')
+    lines += [f"# HELP {prefix}_frame_seconds Time spent per frame",
+              f"# TYPE {prefix}_frame_seconds summary"]
+    if snap["frames"]["count"] > 0:
+      lines.append(f'{prefix}_frame_seconds{{quantile="0.5"}} {snap["frames"]["p50_s"]:.9f}')
+      lines.append(f'{prefix}_frame_seconds{{quantile="0.99"}} {snap["frames"]["p99_s"]:.9f}')
+      lines.append(f'{prefix}_frame_seconds_sum {snap["frames"]["total_s"]:.9f}')
+    lines.append(f'{prefix}_frame_seconds_count {snap["frames"]["count"]}')
+    for k,v in snap["counters"].items():
+      lines += [f"# TYPE {prefix}_{k}_total counter", f"{prefix}_{k}_total {v}"]
+    for k,v in snap["gauges"].items():
+      lines += [f"# TYPE {prefix}_{k} gauge", f"{prefix}_{k} {v}"]
+    return "\n".join(lines) + "\n"
+
+
+  def dump(self, filename):
+    '''
+    Write the snapshot, as Prometheus text for a .prom or .txt filename, JSON otherwise
+    '''
+    s = self.to_prometheus() if filename.endswith((".prom", ".txt")) else self.to_json()
+    f = open(filename, "w")
+    f.write(s)
+    f.close()
+
+
+STATS = TrackerStats()
+# a forked worker returns only what it recorded itself
+os.register_at_fork(after_in_child=STATS.reset_counts)
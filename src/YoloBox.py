@@ -1,5 +1,5 @@
 #!/usr/bin/python3
-from aux_functions import *
+from math_functions import *
 import numpy as np
 
 '''
@@ -11,8 +11,9 @@ class YoloBox:
         bbox  : bounding box [centerx, centery, width, height]. assumes uniform dataset
     img_file  : identifier for mapping bounding box to source image
     confidence: optional confidence value from inference
+    synthetic : interpolated rather than detected
   '''
-  def __init__(self,class_id, bbox, img_filename, center_xy = None, confidence = None, distance = None):
+  def __init__(self,class_id, bbox, img_filename, center_xy = None, confidence = None, distance = None, synthetic = False):
     self.class_id = class_id
     self.bbox = bbox
     self.img_filename = img_filename
@@ -22,6 +23,7 @@ class YoloBox:
     self.prev = None
     self.center_xy = center_xy
     self.distance = distance
+    self.synthetic = synthetic
 
 
   def get_corner_coords(self):
@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+import numpy as np
+
+'''
+  Vectorized association helpers
+
+  Cost matrices are laid out detection-major, (D,T), so that flattening them
+  row by row enumerates pairs in the same order as the original nested loop
+  (for each detection, for each track head). Stable sorting then keeps the
+  original tie-breaking.
+'''
+
+class AssociationFxns:
+  def center_distances(pred, dets):
+    '''
+    Pairwise euclidean distances between track head predictions and detections
+      pred : (T,2) predicted centers
+      dets : (D,2) detection centers
+    Returns a (D,T) matrix
+    '''
+    pred = np.asarray(pred, dtype=np.float64).reshape(-1, 2)
+    dets = np.asarray(dets, dtype=np.float64).reshape(-1, 2)
+    diff = dets[:,np.newaxis,:] - pred[np.newaxis,:,:]
+    return np.sqrt(np.square(diff[...,0]) + np.square(diff[...,1]))
+
+
+  def sorted_pairs(cost, gate = None):
+    '''
+    Flatten a (D,T) cost matrix into pairs sorted by ascending cost
+    gate: optional, pairs costing more are dropped before sorting, the
+          remaining pairs keep the order of the ungated sort
+    Returns (det_idx, track_idx, cost) arrays
+    '''
+    if gate != None:
+      d_idx, t_idx = np.nonzero(cost <= gate)
+      c = cost[d_idx, t_idx]
+      order = np.argsort(c, kind="stable")
+      return d_idx[order], t_idx[order], c[order]
+    D,T = cost.shape
+    order = np.argsort(cost, axis=None, kind="stable")
+    return order // T, order % T, cost.reshape(-1)[order]
+
+
+  def batched_sorted_pairs(preds, dets, slack = 0.25):
+    '''
+    Sort the pairs of several independent (tracks, detections) problems at once
+      preds : list of (T_s,2) predicted centers
+      dets  : list of (D_s,2) detection centers
+    Problems of similar shape are padded to a common (S, D_max, T_max) block
+    with infinite cost, so distances and sorting run as one vectorized call per
+    bucket. A bucket only grows while its block stays within (1 + slack) times
+    its real pairs, so one large problem is solved alone instead of inflating
+    every other one to its size.
+    Returns (list of (det_idx, track_idx, cost) per problem, pairs computed including padding)
+    '''
+    S = len(preds)
+    t_n = [len(p) for p in preds]
+    d_n = [len(d) for d in dets]
+    empty = np.zeros(0, dtype=np.int64)
+    out = [(empty, empty, np.zeros(0)) for _ in range(S)]
+    computed = 0
+    for bucket in AssociationFxns.pad_buckets([(d_n[s], t_n[s]) for s in range(S)], slack):
+      if len(bucket) == 1:
+        s = bucket[0]
+        out[s] = AssociationFxns.sorted_pairs(AssociationFxns.center_distances(preds[s], dets[s]))
+        computed += t_n[s] * d_n[s]
+        continue
+      B = len(bucket)
+      T_max, D_max = max(t_n[s] for s in bucket), max(d_n[s] for s in bucket)
+      P = np.full((B, T_max, 2), np.nan)
+      Q = np.full((B, D_max, 2), np.nan)
+      for b,s in enumerate(bucket):
+        P[b,:t_n[s]] = preds[s]
+        Q[b,:d_n[s]] = dets[s]
+      diff = Q[:,:,np.newaxis,:] - P[:,np.newaxis,:,:]
+      cost = np.sqrt(np.square(diff[...,0]) + np.square(diff[...,1]))
+      cost[np.isnan(cost)] = np.inf
+      computed += cost.size
+
+      order = np.argsort(cost.reshape(B, -1), axis=1, kind="stable")
+      for b,s in enumerate(bucket):
+        # padding sorts last, real pairs come first
+        o = order[b,:t_n[s] * d_n[s]]
+        out[s] = (o // T_max, o % T_max, cost[b].reshape(-1)[o])
+    return out, computed
+
+
+  def pad_buckets(shapes, slack = 0.25):
+    '''
+    Group problems for padding, in increasing size
+      shapes: list of (D_s, T_s)
+    A bucket's padded block, count x D_max x T_max, stays within (1 + slack)
+    times the sum of its D_s x T_s. Problems without pairs are left out.
+    Returns a list of lists of problem indices
+    '''
+    order = sorted([s for s,(D,T) in enumerate(shapes) if D > 0 and T > 0], key=lambda s: shapes[s][0] * shapes[s][1])
+    buckets = []
+    D_max, T_max, real = 0, 0, 0
+    for s in order:
+      D, T = shapes[s]
+      if len(buckets) > 0:
+        d, t = max(D_max, D), max(T_max, T)
+        if (len(buckets[-1]) + 1) * d * t <= (1 + slack) * (real + D * T):
+          buckets[-1].append(s)
+          D_max, T_max, real = d, t, real + D * T
+          continue
+      buckets.append([s])
+      D_max, T_max, real = D, T, D * T
+    return buckets
@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+import multiprocessing
+import json
+import os
+from os import path
+
+'''
+  Single-decode multi-output augmentation
+
+  Every source frame is decoded exactly once per run, and every requested
+  variant is written from that decoded buffer. Exact multiples of 90 degrees
+  use lossless transposes, arbitrary angles fall back to warpAffine.
+
+  A variant is a dict:
+    {"name": "rotated_90", "angle": 90}
+    {"name": "reflected_x", "reflect_axis": 0}
+'''
+
+class AugmentFxns:
+  # lossless transposes, keyed by counterclockwise rotation
+  QUAD_ROTATIONS = { 90   : "ROTATE_90_COUNTERCLOCKWISE",
+                     180  : "ROTATE_180",
+                     270  : "ROTATE_90_CLOCKWISE",
+                   }
+
+  def parse_variants(spec):
+    '''
+    Parse a comma separated variant list, e.g. "90,180,270,x,y"
+      degrees : rotation about the image center
+      x, y    : reflection, using the same axis convention as `reflect`
+    Returns a list of variants
+    '''
+    variants = []
+    for tok in spec.split(","):
+      tok = tok.strip()
+      if len(tok) == 0:
+        continue
+      if tok in {"x","X","y","Y"}:
+        r_ax = 0 if tok in {"x","X"} else 1
+        variants.append({"name": f"reflected_{tok.lower()}", "reflect_axis": r_ax})
+      else:
+        variants.append({"name": f"rotated_{int(tok)}", "angle": int(tok)})
+    return variants
+
+
+  def transform_image(img1, variant):
+    '''
+    Apply a single variant to a decoded image
+    Returns the transformed image
+    '''
+    import cv2
+    from aux_functions import ImgFxns
+    if "reflect_axis" in variant:
+      return ImgFxns.reflect_image(img1, variant["reflect_axis"])
+
+    angle = variant.get("angle", 0)
+    quad = angle % 360
+    if quad == 0:
+      return img1
+    if quad in AugmentFxns.QUAD_ROTATIONS:
+      return cv2.rotate(img1, getattr(cv2, AugmentFxns.QUAD_ROTATIONS[quad]))
+    w,h = img1.shape[1],img1.shape[0]
+    return ImgFxns.rotate_image(img1, (int(w / 2), int(h / 2)), angle)
+
+
+  def augment_frame(src_file, variants, outdir):
+    '''
+    Decode a single frame once and write every variant
+    Returns a list of (file_name, width, height), one per variant
+    '''
+    import cv2
+    img1 = cv2.imread(src_file)
+    if img1 is None:
+      print(f"could not read {src_file}")
+      return None
+    base = path.basename(src_file)
+    out = []
+    for v in variants:
+      img2 = AugmentFxns.transform_image(img1, v)
+      fn = f"{v['name']}_{base}"
+      cv2.imwrite(path.join(outdir, fn), img2)
+      out.append((fn, img2.shape[1], img2.shape[0]))
+    return out
+
+
+  def snapshot_boxes(OTM):
+    '''
+    Record bounding boxes of all linked tracks so transforms can be undone
+    Returns a list of (YoloBox, bbox, center_xy)
+    '''
+    snap = []
+    for i in OTM.linked_tracks:
+      for yb in OTM.get_track(i).path:
+        snap.append((yb, list(yb.bbox), yb.center_xy))
+    return snap
+
+
+  def restore_boxes(snap):
+    '''
+    Undo transforms recorded by snapshot_boxes
+    '''
+    for yb, bbox, center_xy in snap:
+      yb.bbox[:] = bbox
+      yb.center_xy = center_xy
+
+
+  def export_variant(OTM, variant, images):
+    '''
+    Transform linked tracks for a single variant and export them in LOCO format
+    Tracks are restored afterwards. Annotations of frames missing from images
+    (frames which could not be decoded) are dropped, and images are renumbered
+    by position, since import_loco_fmt looks image ids up by position
+    Returns a python dict
+    '''
+    snap = AugmentFxns.snapshot_boxes(OTM)
+    angle = variant.get("angle", 0)
+    reflect_axis = variant.get("reflect_axis", None)
+    if angle != 0:
+      OTM.rotate_linked_tracks(angle)
+    if reflect_axis != None:
+      OTM.reflect_linked_tracks(reflect_axis)
+    position = {img["id"]: n for n,img in enumerate(images)}
+    exp = OTM.export_loco_fmt(angle = angle, reflect_axis = reflect_axis,
+                              images = [dict(img, id=n) for n,img in enumerate(images)])
+    steps = [st for st in exp["annotations"] if st["image_id"] in position]
+    for lt in exp["linked_tracks"]:
+      lt["steps"] = []
+    for i,st in enumerate(steps):
+      st["id"] = i
+      st["image_id"] = position[st["image_id"]]
+      # annotations reference the live bbox lists
+      st["bbox"] = list(st["bbox"])
+      exp["linked_tracks"][st["trackmap_index"]]["steps"].append(i)
+    for lt in exp["linked_tracks"]:
+      lt["track_len"] = len(lt["steps"])
+    exp["annotations"] = steps
+    AugmentFxns.restore_boxes(snap)
+    return exp
+
+
+def _augment_worker(args):
+  return AugmentFxns.augment_frame(*args)
+
+
+def augment_tracks(OTM, variants, sys_path = ".", outdir = ".", workers = None):
+  '''
+  Write every variant of every frame of a frozen ObjectTrackManager, decoding
+  each frame once, and a LOCO file per variant. Frames which cannot be decoded
+  are left out of every variant, annotations included.
+  Returns a list of written LOCO filenames
+  '''
+  os.makedirs(outdir, exist_ok=True)
+  jobs = [(path.join(sys_path, f"{f[:-3]}png"), variants, outdir) for f in OTM.filenames]
+  if workers == 1:
+    results = [_augment_worker(j) for j in jobs]
+  else:
+    with multiprocessing.Pool(workers) as pool:
+      results = pool.map(_augment_worker, jobs, chunksize=4)
+
+  written = []
+  for vi, v in enumerate(variants):
+    images = []
+    for i, res in enumerate(results):
+      if res == None:
+        continue
+      fn, w, h = res[vi]
+      images.append({"id": i, "file_name": fn, "height": h, "width": w})
+    exp = AugmentFxns.export_variant(OTM, v, images)
+    out_fn = path.join(outdir, f"{v['name']}.json")
+    f = open(out_fn, "w")
+    f.write(json.dumps(exp, indent=2))
+    f.close()
+    written.append(out_fn)
+  return written
@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+import numpy as np
+import multiprocessing
+import os
+from os import path
+
+'''
+  Batched per-track crop extraction
+
+  Crops of every box of every linked track are grouped by frame, so each
+  frame is decoded exactly once and all of its boxes are cut out together.
+  A crop job is a row [track_id, step, x1, y1, x2, y2] in source pixels.
+'''
+
+class CropFxns:
+  def plan_crops(OTM):
+    '''
+    Group the boxes of all linked tracks by frame
+    Returns {layer_idx : (K,6) array of crop jobs}
+    '''
+    fmap = OTM.get_frame_index()
+    jobs = {}
+    for i in OTM.linked_tracks:
+      for step, yb in enumerate(OTM.get_track(i).path):
+        (x1,y1),(x2,y2) = yb.get_corner_coords()
+        jobs.setdefault(fmap[yb.img_filename], []).append((i, step, x1, y1, x2, y2))
+    return {k: np.array(v, dtype=np.float64) for k,v in jobs.items()}
+
+
+  def pad_boxes(jobs, padding, img_w, img_h):
+    '''
+    Grow boxes by a padding factor of their size on each side, clipped to the image
+    Returns an (K,4) integer array of [x1, y1, x2, y2]
+    '''
+    x1,y1,x2,y2 = jobs[:,2], jobs[:,3], jobs[:,4], jobs[:,5]
+    pw, ph = (x2 - x1) * padding, (y2 - y1) * padding
+    boxes = np.stack((x1 - pw, y1 - ph, x2 + pw, y2 + ph), axis=1)
+    boxes = np.round(boxes).astype(np.int64)
+    np.clip(boxes[:,0::2], 0, img_w, out=boxes[:,0::2])
+    np.clip(boxes[:,1::2], 0, img_h, out=boxes[:,1::2])
+    return boxes
+
+
+  def crop_frame(src_file, jobs, padding = 0.1, size = None, outdir = None):
+    '''
+    Decode a frame once and cut out every box in it
+    Crops are written to outdir/track_{id}/{step}.png when outdir is given,
+    otherwise returned.
+    Returns (jobs, list of crops or None)
+    '''
+    import cv2
+    img1 = cv2.imread(src_file)
+    if img1 is None:
+      print(f"could not read {src_file}")
+      return jobs, None
+    boxes = CropFxns.pad_boxes(jobs, padding, img1.shape[1], img1.shape[0])
+    crops = []
+    for j, (x1,y1,x2,y2) in zip(jobs, boxes):
+      c = img1[y1:y2, x1:x2]
+      if c.size == 0:
+        c = np.zeros((1, 1, 3), dtype=img1.dtype)
+      if size != None:
+        c = cv2.resize(c, (size, size), interpolation=cv2.INTER_AREA)
+      if outdir != None:
+        cv2.imwrite(path.join(outdir, f"track_{int(j[0])}", f"{int(j[1]):05d}.png"), c)
+      else:
+        crops.append(c)
+    return jobs, (crops if outdir == None else None)
+
+
+def _crop_worker(args):
+  return CropFxns.crop_frame(*args)
+
+
+def extract_crops(OTM, sys_path = ".", output = "crops", padding = 0.1, size = None, workers = None):
+  '''
+  Extract crops of every box of every linked track, one decode per frame,
+  distributing frames across worker processes.
+    output ending in .npz : packed array file (crops are resized to size, default 64)
+    otherwise             : per-track crop sequences in output/track_{id}/
+  Returns the number of crops extracted
+  '''
+  packed = output.endswith(".npz")
+  if packed and size == None:
+    size = 64
+  outdir = None if packed else output
+
+  plan = CropFxns.plan_crops(OTM)
+  if outdir != None:
+    for i in OTM.linked_tracks:
+      os.makedirs(path.join(outdir, f"track_{i}"), exist_ok=True)
+
+  tasks = [(path.join(sys_path, f"{OTM.filenames[k][:-3]}png"), v, padding, size, outdir) for k,v in sorted(plan.items())]
+  if workers == 1:
+    results = map(_crop_worker, tasks)
+  else:
+    pool = multiprocessing.Pool(workers)
+    results = pool.imap(_crop_worker, tasks, chunksize=4)
+
+  count = 0
+  meta, crops, frames = [], [], []
+  for (k, _), (jobs, c) in zip(sorted(plan.items()), results):
+    count += len(jobs)
+    if packed and c != None:
+      meta.append(jobs[:,:2])
+      frames.append(np.full(len(jobs), k, dtype=np.int64))
+      crops.extend(c)
+  if workers != 1:
+    pool.close()
+    pool.join()
+
+  if packed:
+    meta = np.vstack(meta).astype(np.int64) if len(meta) > 0 else np.zeros((0, 2), dtype=np.int64)
+    np.savez(output,
+              crops = np.stack(crops) if len(crops) > 0 else np.zeros((0, size, size, 3), dtype=np.uint8),
+              track_ids = meta[:,0],
+              steps = meta[:,1],
+              frames = np.concatenate(frames) if len(frames) > 0 else np.zeros(0, dtype=np.int64))
+  return count
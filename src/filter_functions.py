@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+import numpy as np
+from geometry_functions import GeometryFxns
+
+'''
+  Pre-tracking detection filters
+
+  Applied per layer between loading and association, so low-confidence
+  detections and duplicate boxes of the same fish never become candidates in
+  process_layer and never allocate short lived tracks.
+  Boxes without a confidence (plain yolo annotations) always pass the
+  confidence threshold and rank as fully confident in NMS.
+'''
+
+class FilterFxns:
+  def confidences(layer):
+    '''
+    Confidence of each YoloBox in a layer, 1 where none is known
+    Returns a (N,) array
+    '''
+    return np.array([1.0 if yb.confidence == None else yb.confidence for yb in layer], dtype=np.float64)
+
+
+  def nms(boxes, scores, classes = None, iou_threshold = 0.5):
+    '''
+    Greedy class-aware non-maximum suppression
+      boxes   : (N,4) yolo boxes
+      scores  : (N,) confidences, higher is kept first, ties keep input order
+      classes : optional (N,) class ids, boxes of different classes never suppress each other
+    The overlap matrix is computed once, each kept box then suppresses its
+    whole row in one vectorized step
+    Returns the sorted indices of kept boxes
+    '''
+    scores = np.asarray(scores, dtype=np.float64)
+    N = len(scores)
+    if N == 0:
+      return np.zeros(0, dtype=np.int64)
+    overlap = GeometryFxns.iou(boxes, boxes) > iou_threshold
+    if classes is not None:
+      classes = np.asarray(classes)
+      overlap &= classes[:,np.newaxis] == classes[np.newaxis,:]
+    suppressed = np.zeros(N, dtype=bool)
+    keep = []
+    for i in np.argsort(-scores, kind="stable"):
+      if suppressed[i]:
+        continue
+      keep.append(i)
+      suppressed |= overlap[i]
+    return np.sort(np.array(keep, dtype=np.int64))
+
+
+  def filter_layer(layer, min_confidence = None, nms_iou = None):
+    '''
+    Apply a confidence threshold, then class-aware NMS, to a layer of YoloBoxes
+    Returns (filtered layer, number below confidence, number suppressed)
+    '''
+    if len(layer) == 0:
+      return layer, 0, 0
+    conf = FilterFxns.confidences(layer)
+    keep = np.arange(len(layer))
+    if min_confidence != None:
+      keep = keep[conf >= min_confidence]
+    below = len(layer) - len(keep)
+    suppressed = 0
+    if nms_iou != None and len(keep) > 1:
+      boxes = np.array([layer[i].bbox for i in keep], dtype=np.float64)
+      classes = np.array([layer[i].class_id for i in keep])
+      kept = FilterFxns.nms(boxes, conf[keep], classes, nms_iou)
+      suppressed = len(keep) - len(kept)
+      keep = keep[kept]
+    return [layer[i] for i in keep], below, suppressed
+
+
+  def filter_layers(layer_list, min_confidence = None, nms_iou = None):
+    '''
+    Filter every layer of a video
+    Returns (filtered layer list, report dict of box counts)
+    '''
+    filtered = []
+    report = {"boxes": 0, "below_confidence": 0, "suppressed": 0, "removed": 0}
+    for layer in layer_list:
+      kept, below, suppressed = FilterFxns.filter_layer(layer, min_confidence, nms_iou)
+      filtered.append(kept)
+      report["boxes"] += len(layer)
+      report["below_confidence"] += below
+      report["suppressed"] += suppressed
+    report["removed"] = report["below_confidence"] + report["suppressed"]
+    return filtered, report
@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+import numpy as np
+
+'''
+  Batched box geometry kernels
+
+  Boxes are rows of float arrays, either yolo [center_x, center_y, width, height]
+  (the YoloBox.bbox layout) or corners [min_x, min_y, max_x, max_y] (the yolox
+  layout). Pairwise kernels take (A,4) and (B,4) arrays and return (A,B)
+  matrices in one NumPy call. Association passes detections first, so the
+  matrices come out detection-major like AssociationFxns.center_distances.
+  With paired set they take two (N,4) arrays and return the (N,) values of
+  row i against row i, for sparse candidate pairs.
+'''
+
+class GeometryFxns:
+  '''
+  Hybrid association cost, see association_cost
+    mode           : "distance", "iou", "giou" or "hybrid"
+    distance_weight: pixels of cost per pixel of center distance
+    overlap_weight : pixels of cost for no overlap at all, 1 - IoU (or GIoU) scaled
+  Costs are in pixels. iou and giou costs never exceed overlap_weight, which is
+  below radial_exclusion, so association_cost takes the gate: disjoint pairs
+  whose centers are farther apart than the gate cost inf and are rejected as
+  they are in distance mode.
+  '''
+  cost_constants = { "mode"           : "distance",
+                     "distance_weight": 1.0,
+                     "overlap_weight" : 100.0,
+                   }
+
+  def as_boxes(boxes):
+    '''
+    View any box sequence as an (N,4) float array
+    '''
+    return np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+
+  def to_corners(boxes):
+    '''
+    Vectorized YoloBox.get_corner_coords
+    [cx, cy, w, h] -> [min_x, min_y, max_x, max_y]
+    '''
+    b = GeometryFxns.as_boxes(boxes)
+    half = b[:,2:] / 2
+    return np.concatenate([b[:,:2] - half, b[:,:2] + half], axis=1)
+
+
+  def to_centers(corners):
+    '''
+    Vectorized YoloBox.conv_yolox_bbox
+    [min_x, min_y, max_x, max_y] -> [cx, cy, w, h]
+    '''
+    c = GeometryFxns.as_boxes(corners)
+    return np.concatenate([(c[:,:2] + c[:,2:]) / 2, np.abs(c[:,2:] - c[:,:2])], axis=1)
+
+
+  def areas(corners):
+    '''
+    Areas of corner boxes, 0 for inverted boxes, over any leading shape
+    '''
+    c = np.asarray(corners, dtype=np.float64)
+    return np.clip(c[...,2] - c[...,0], 0, None) * np.clip(c[...,3] - c[...,1], 0, None)
+
+
+  def align(a, b, paired = False):
+    '''
+    Line two box arrays up for elementwise kernels: row i against row i when
+    paired, otherwise every row of a against every row of b
+    Returns (a, b), broadcasting to (N,4) or (A,B,4)
+    '''
+    if paired:
+      # already aligned arrays keep their shape
+      return np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    a, b = GeometryFxns.as_boxes(a), GeometryFxns.as_boxes(b)
+    return a[:,np.newaxis,:], b[np.newaxis,:,:]
+
+
+  def intersections(a, b, paired = False):
+    '''
+    Pairwise intersection areas of corner boxes
+    Returns an (A,B) matrix, (N,) when paired
+    '''
+    a, b = GeometryFxns.align(a, b, paired)
+    wh = np.clip(np.minimum(a[...,2:], b[...,2:]) - np.maximum(a[...,:2], b[...,:2]), 0, None)
+    return wh[...,0] * wh[...,1]
+
+
+  def iou(a, b, corners = False, paired = False):
+    '''
+    Pairwise intersection over union
+      a, b   : (A,4) and (B,4) boxes, yolo layout unless corners is set
+    Returns an (A,B) matrix, (N,) when paired, 0 where both boxes are empty
+    '''
+    if not corners:
+      a, b = GeometryFxns.to_corners(a), GeometryFxns.to_corners(b)
+    a, b = GeometryFxns.align(a, b, paired)
+    inter = GeometryFxns.intersections(a, b, True)
+    union = GeometryFxns.areas(a) + GeometryFxns.areas(b) - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+  def giou(a, b, corners = False, paired = False):
+    '''
+    Pairwise generalized IoU, in [-1, 1]
+    Unlike IoU it still ranks disjoint boxes, by how much of their enclosing
+    box is empty
+    Returns an (A,B) matrix, (N,) when paired
+    '''
+    if not corners:
+      a, b = GeometryFxns.to_corners(a), GeometryFxns.to_corners(b)
+    a, b = GeometryFxns.align(a, b, paired)
+    inter = GeometryFxns.intersections(a, b, True)
+    union = GeometryFxns.areas(a) + GeometryFxns.areas(b) - inter
+    iou = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+    hull = np.prod(np.maximum(a[...,2:], b[...,2:]) - np.minimum(a[...,:2], b[...,:2]), axis=-1)
+    return iou - np.divide(hull - union, hull, out=np.zeros_like(hull), where=hull > 0)
+
+
+  def center_distances(a, b, paired = False):
+    '''
+    Pairwise euclidean distances between box centers (yolo layout)
+    Returns an (A,B) matrix, (N,) when paired
+    '''
+    a, b = GeometryFxns.align(a, b, paired)
+    diff = a[...,:2] - b[...,:2]
+    return np.sqrt(np.square(diff[...,0]) + np.square(diff[...,1]))
+
+
+  def association_cost(dets, preds, mode = None, distance_weight = None, overlap_weight = None, gate = None, paired = False):
+    '''
+    Association cost between detections and predicted track boxes (yolo layout)
+      distance : center distance, the legacy cost
+      iou      : overlap_weight * (1 - IoU)
+      giou     : overlap_weight * (1 - GIoU) / 2
+      hybrid   : distance_weight * distance + overlap_weight * (1 - IoU)
+    gate: for iou and giou, disjoint pairs with centers farther apart cost inf
+    Unset arguments fall back to cost_constants
+    Returns a (D,T) matrix, (N,) when paired
+    '''
+    cc = GeometryFxns.cost_constants
+    mode = cc["mode"] if mode == None else mode
+    dw = cc["distance_weight"] if distance_weight == None else distance_weight
+    ow = cc["overlap_weight"] if overlap_weight == None else overlap_weight
+    if mode == "distance":
+      return GeometryFxns.center_distances(dets, preds, paired)
+    if mode == "hybrid":
+      return dw * GeometryFxns.center_distances(dets, preds, paired) + ow * (1 - GeometryFxns.iou(dets, preds, paired=paired))
+    if mode == "iou":
+      cost = ow * (1 - GeometryFxns.iou(dets, preds, paired=paired))
+    elif mode == "giou":
+      cost = ow * (1 - GeometryFxns.giou(dets, preds, paired=paired)) / 2
+    else:
+      raise ValueError(f"unknown association cost {mode}")
+    if gate != None:
+      far = GeometryFxns.center_distances(dets, preds, paired) > gate
+      far &= GeometryFxns.intersections(GeometryFxns.to_corners(dets), GeometryFxns.to_corners(preds), paired) <= 0
+      cost[far] = np.inf
+    return cost
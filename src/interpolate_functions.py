@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+import numpy as np
+from YoloBox import YoloBox
+
+'''
+  Gap interpolation and fixed stride resampling of linked tracks
+
+  All linked tracks are packed into concatenated (frame, bbox, track) arrays,
+  sorted by track then frame. Missing frames and resampled frames are then
+  computed for every track at once by linear interpolation between the
+  neighbouring steps. New boxes are flagged synthetic and exported with a
+  "synthetic" marker in LOCO. Resampling only interpolates across the gaps
+  that gap filling would fill, samples inside longer gaps are skipped, and
+  boxes it leaves out of a track are removed from their layers.
+'''
+
+class InterpolateFxns:
+  def pack_tracks(OTM, track_ids):
+    '''
+    Concatenate the paths of tracks
+    Returns (frames (N,), bboxes (N,4), track index (N,), list of N YoloBoxes)
+    '''
+    fidx = OTM.get_frame_index()
+    rows, tracks, objs = [], [], []
+    for n,k in enumerate(track_ids):
+      for yb in OTM.get_track(k).path:
+        rows.append((fidx[yb.img_filename], *yb.bbox))
+        tracks.append(n)
+        objs.append(yb)
+    rows = np.array(rows, dtype=np.float64).reshape(-1, 5)
+    return rows[:,0].astype(np.int64), rows[:,1:], np.array(tracks, dtype=np.int64), objs
+
+
+  def fill_gaps(frames, boxes, tracks, max_gap):
+    '''
+    Interpolate the frames missing between consecutive steps of a track,
+    for gaps of at most max_gap frames
+    Returns (frames, bboxes, tracks, source row) of the new rows, the source
+    row being the step before each gap
+    '''
+    df = frames[1:] - frames[:-1]
+    gap = (tracks[1:] == tracks[:-1]) & (df > 1) & (df <= max_gap + 1)
+    a = np.nonzero(gap)[0]
+    n = df[a] - 1
+    src = np.repeat(a, n)
+    k = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n) + 1
+    t = (k / df[src])[:,np.newaxis]
+    return frames[src] + k, boxes[src] + (boxes[src + 1] - boxes[src]) * t, tracks[src], src
+
+
+  def resample(frames, boxes, tracks, stride, max_gap = None):
+    '''
+    Sample every track from its first frame at a fixed stride
+    max_gap: samples inside a gap of more than max_gap missing frames are
+             skipped, None interpolates across every gap
+    Returns (frames, bboxes, tracks, row, exact) of the samples, row being the
+    step at or before the sample and exact whether the sample is that step
+    '''
+    empty = np.zeros(0, dtype=np.int64)
+    if len(frames) == 0:
+      return empty, np.zeros((0,4)), empty, empty, np.zeros(0, dtype=bool)
+    ids, first = np.unique(tracks, return_index=True)
+    last = np.append(first[1:], len(frames)) - 1
+    counts = (frames[last] - frames[first]) // stride + 1
+    s_track = np.repeat(ids, counts)
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    s_frame = np.repeat(frames[first], counts) + k * stride
+
+    span = int(frames.max()) + 1
+    key = tracks * span + frames
+    row = np.searchsorted(key, s_track * span + s_frame, side="right") - 1
+    exact = frames[row] == s_frame
+    nxt = np.minimum(row + 1, len(frames) - 1)
+    df = frames[nxt] - frames[row]
+    t = np.divide(s_frame - frames[row], df, out=np.zeros(len(row)), where=~exact & (df > 0))[:,np.newaxis]
+    ok = exact | (df <= max_gap + 1) if max_gap != None else np.ones(len(row), dtype=bool)
+    s_box = boxes[row] + (boxes[nxt] - boxes[row]) * t
+    return s_frame[ok], s_box[ok], s_track[ok], row[ok], exact[ok]
+
+
+def interpolate_tracks(OTM, max_gap = None, stride = None):
+  '''
+  Fill gaps of at most max_gap frames in linked tracks, then optionally
+  resample them to a fixed stride, in place and relinked. Resampling skips
+  the gaps left unfilled, all of them without max_gap, and removes the boxes
+  it drops from their layers.
+  Returns a report of box counts
+  '''
+  track_ids = list(OTM.linked_tracks)
+  frames, boxes, tracks, objs = InterpolateFxns.pack_tracks(OTM, track_ids)
+  report = {"tracks": len(track_ids), "boxes": len(objs), "filled": 0, "resampled": 0, "dropped": 0}
+
+  def synthetic(frame, bbox, src):
+    # new box of the track of row src, in the layer of its frame
+    yb = YoloBox(objs[src].class_id, [float(v) for v in bbox],
+                 f'{OTM.filenames[frame][:-3]}txt', objs[src].center_xy, synthetic=True)
+    if frame < len(OTM.layers):
+      OTM.layers[frame].append(yb)
+    return yb
+
+  if max_gap != None:
+    f_new, b_new, t_new, src = InterpolateFxns.fill_gaps(frames, boxes, tracks, max_gap)
+    new = [synthetic(int(f), b, int(s)) for f,b,s in zip(f_new, b_new, src)]
+    report["filled"] = len(new)
+    frames = np.concatenate([frames, f_new])
+    boxes = np.concatenate([boxes, b_new])
+    tracks = np.concatenate([tracks, t_new])
+    objs = objs + new
+    order = np.lexsort((frames, tracks))
+    frames, boxes, tracks = frames[order], boxes[order], tracks[order]
+    objs = [objs[i] for i in order]
+
+  if stride != None and stride > 1:
+    # gaps fill_gaps left are longer than max_gap, without it every gap is left
+    s_frame, s_box, s_track, row, exact = InterpolateFxns.resample(frames, boxes, tracks, stride,
+                                                                   max_gap if max_gap != None else 0)
+    kept = set()
+    sampled = []
+    for f,b,r,e in zip(s_frame, s_box, row, exact):
+      if e:
+        kept.add(int(r))
+        sampled.append(objs[r])
+      else:
+        sampled.append(synthetic(int(f), b, int(r)))
+    # boxes left out of their track leave their layer too
+    dropped = {}
+    for i,yb in enumerate(objs):
+      if i not in kept:
+        yb.parent_track, yb.prev, yb.next = None, None, None
+        dropped.setdefault(int(frames[i]), set()).add(id(yb))
+    for f,ids in dropped.items():
+      if f < len(OTM.layers):
+        OTM.layers[f] = [yb for yb in OTM.layers[f] if id(yb) not in ids]
+    report["resampled"] = len(sampled)
+    report["dropped"] = len(objs) - len(kept)
+    tracks, objs = s_track, sampled
+
+  # rebuild and relink paths
+  bounds = np.searchsorted(tracks, np.arange(len(track_ids) + 1))
+  for n,k in enumerate(track_ids):
+    T = OTM.get_track(k)
+    T.path = objs[bounds[n]:bounds[n + 1]]
+    for yb in T.path:
+      yb.parent_track = T.track_id
+    if len(T.path) > 0:
+      T.path[0].prev, T.path[-1].next = None, None
+    T.link_path()
+  return report
@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+import copy
+import json
+import numpy as np
+
+'''
+  Keyframe simplification of exported LOCO tracks
+
+  Each linked track is reduced to the steps a Ramer-Douglas-Peucker style
+  pass needs to reconstruct every other step within a pixel tolerance. Steps
+  are interpolated linearly by their index along the track, over all four
+  bbox values (center and size). The error of a step is its largest absolute
+  bbox difference, so no coordinate of a reconstructed box is off by more than
+  the tolerance.
+
+  A simplified track keeps its keyframe annotations, each with its "step"
+  index, and records the rest in its linked_tracks entry:
+
+    "keyframes": {"tolerance": float,
+                  "interpolation": "linear",
+                  "steps": total number of steps,
+                  "frames": [[first image_id, count], ...] runs of consecutive frames,
+                  "synthetic": [[first step, count], ...] runs of interpolated steps}
+'''
+
+class KeyframeFxns:
+  def rdp(points, tolerance):
+    '''
+    Keyframes of a (N,K) sequence, interpolated by index
+    Each segment is tested in one vectorized step
+    Returns a (N,) bool mask of kept points, always the first and last
+    '''
+    N = len(points)
+    keep = np.zeros(N, dtype=bool)
+    if N == 0:
+      return keep
+    keep[0] = keep[-1] = True
+    stack = [(0, N - 1)]
+    while len(stack) > 0:
+      a, b = stack.pop()
+      if b - a < 2:
+        continue
+      t = ((np.arange(a + 1, b) - a) / (b - a))[:,np.newaxis]
+      err = np.abs(points[a + 1:b] - (points[a] + (points[b] - points[a]) * t)).max(axis=1)
+      i = int(np.argmax(err))
+      if err[i] > tolerance:
+        m = a + 1 + i
+        keep[m] = True
+        stack.append((a, m))
+        stack.append((m, b))
+    return keep
+
+
+  def frame_runs(frames):
+    '''
+    Run length encode integers into [[first, count], ...] runs of consecutive values
+    '''
+    runs = []
+    for f in frames:
+      if len(runs) > 0 and f == runs[-1][0] + runs[-1][1]:
+        runs[-1][1] += 1
+      else:
+        runs.append([int(f), 1])
+    return runs
+
+
+  def simplify_loco(loco, tolerance, sizes = False):
+    '''
+    Reduce the annotations of a LOCO export to keyframes
+    sizes: also serialize both exports to report their json sizes, which
+           costs more than the simplification itself
+    Returns (simplified LOCO, report of annotation counts, and json sizes when asked)
+    '''
+    out = copy.copy(loco)
+    by_track = {}
+    for st in loco["annotations"]:
+      by_track.setdefault(st["trackmap_index"], []).append(st)
+
+    annotations = []
+    linked_tracks = [dict(lt) for lt in loco["linked_tracks"]]
+    for idx,lt in enumerate(linked_tracks):
+      steps = by_track.get(idx, [])
+      boxes = np.array([st["bbox"] for st in steps], dtype=np.float64).reshape(-1, 4)
+      keep = KeyframeFxns.rdp(boxes, tolerance)
+      lt["keyframes"] = {"tolerance": tolerance,
+                         "interpolation": "linear",
+                         "steps": len(steps),
+                         "frames": KeyframeFxns.frame_runs([st["image_id"] for st in steps]),
+                         "synthetic": KeyframeFxns.frame_runs([i for i,st in enumerate(steps) if st.get("synthetic")])}
+      lt["steps"] = []
+      for i in np.nonzero(keep)[0]:
+        st = dict(steps[i])
+        st["step"] = int(i)
+        st["id"] = len(annotations)
+        lt["steps"].append(st["id"])
+        annotations.append(st)
+
+    out["linked_tracks"] = linked_tracks
+    out["annotations"] = annotations
+    report = {"annotations": len(loco["annotations"]),
+              "keyframes": len(annotations)}
+    if sizes:
+      before, after = len(json.dumps(loco, indent=2)), len(json.dumps(out, indent=2))
+      report.update({"bytes": before,
+                     "simplified_bytes": after,
+                     "reduction": before / max(after, 1)})
+    return out, report
+
+
+  def expand_loco(loco):
+    '''
+    Reconstruct every step of a keyframe LOCO export
+    Returns a LOCO with one annotation per step, as before simplification
+    '''
+    out = copy.copy(loco)
+    by_track = {}
+    for st in loco["annotations"]:
+      by_track.setdefault(st["trackmap_index"], []).append(st)
+
+    annotations = []
+    linked_tracks = [dict(lt) for lt in loco["linked_tracks"]]
+    for idx,lt in enumerate(linked_tracks):
+      keys = by_track.get(idx, [])
+      kf = lt.pop("keyframes", None)
+      if kf == None:
+        # not simplified, keep as is
+        lt["steps"] = []
+        for st in keys:
+          st = dict(st)
+          st["id"] = len(annotations)
+          lt["steps"].append(st["id"])
+          annotations.append(st)
+        continue
+      frames = np.concatenate([np.arange(f, f + n) for f,n in kf["frames"]] or [np.zeros(0, dtype=np.int64)])
+      synthetic = set(i for f,n in kf.get("synthetic", []) for i in range(f, f + n))
+      k_idx = np.array([st["step"] for st in keys], dtype=np.int64)
+      k_box = np.array([st["bbox"] for st in keys], dtype=np.float64).reshape(-1, 4)
+      steps = np.arange(kf["steps"])
+      boxes = np.stack([np.interp(steps, k_idx, k_box[:,c]) for c in range(4)], axis=1) if len(keys) > 0 else np.zeros((0,4))
+      # template of the step's neighbouring keyframe
+      tmpl = np.searchsorted(k_idx, steps, side="right") - 1
+      lt["steps"] = []
+      for i in steps:
+        st = dict(keys[tmpl[i]])
+        st.pop("step", None)
+        st.pop("synthetic", None)
+        if i in synthetic:
+          st["synthetic"] = True
+        st["image_id"] = int(frames[i])
+        st["bbox"] = boxes[i].tolist()
+        st["area"] = st["bbox"][2] * st["bbox"][3]
+        st["id"] = len(annotations)
+        lt["steps"].append(st["id"])
+        annotations.append(st)
+
+    out["linked_tracks"] = linked_tracks
+    out["annotations"] = annotations
+    return out
@@ -0,0 +1,17 @@
+#!/usr/bin/python3
+import re
+
+class ProbeFxns:
+  '''
+  Image metadata helpers which do not decode the image
+  libmagic is only loaded on first use
+  '''
+  def get_img_shape(valid_img_filename):
+    '''
+    Read image dimensions from the file header
+    Returns (width, height)
+    '''
+    import magic
+    magic_data = magic.from_file(str(valid_img_filename))
+    width, height = re.search(r'(\d+) x (\d+)', magic_data).groups()
+    return int(width), int(height)
@@ -0,0 +1,201 @@
+#!/usr/bin/python3
+import numpy as np
+
+from geometry_functions import GeometryFxns
+
+'''
+  Offline track stitching
+
+  A fish hidden for longer than track_lifespan ends up as several fragments.
+  Stitching runs after tracks are closed and before they are linked: every
+  fragment tail is matched to at most one fragment head which starts within
+  max_gap frames, near the position extrapolated from the tail's last step,
+  with the same class. Matched fragments are merged into the earlier track.
+
+  Candidates are found without comparing all pairs: heads are sorted by
+  (grid cell, start frame), so each tail queries only the few cells its
+  extrapolated path can reach, each query a binary search over a time window.
+  Candidates are ranked by the association cost of the tracker (see
+  GeometryFxns.association_cost) between the head box and the tail box moved
+  to the extrapolated position, relative to the distance allowed.
+'''
+
+class StitchFxns:
+  '''
+    max_gap         : largest number of frames between a tail and a head
+    radius          : distance allowed between extrapolated tail and head at a gap of 0
+    speed_tolerance : pixels the allowed distance grows per frame of gap
+    max_speed       : tail velocity cap in pixels per frame, bounds the search area
+    same_class      : only stitch fragments of the same class
+  '''
+  constants = { "max_gap"         : 30,
+                "radius"          : 50,
+                "speed_tolerance" : 2,
+                "max_speed"       : 40,
+                "same_class"      : True,
+              }
+
+  def track_endpoints(OTM):
+    '''
+    Start and end frame, head and tail box, tail velocity and class of every
+    track, frames taken from the image filenames when loaded, otherwise from
+    layer membership
+    Returns (track_ids, dict of arrays)
+    '''
+    if len(OTM.filenames) > 0:
+      fidx = OTM.get_frame_index()
+      frame = lambda yb: fidx.get(yb.img_filename, 0)
+    else:
+      frame_of = {id(yb): i for i,layer in enumerate(OTM.layers) for yb in layer}
+      frame = lambda yb: frame_of.get(id(yb), 0)
+    ids = [k for k,v in OTM.global_track_store.items() if len(v.path) > 0]
+    rows = []
+    for k in ids:
+      T = OTM.global_track_store[k]
+      first, last = T.path[0], T.path[-1]
+      prev = T.path[-2] if len(T.path) > 1 else last
+      rows.append((frame(first), frame(last), frame(prev),
+                   *first.get_center_coord(), *last.get_center_coord(), *prev.get_center_coord(), T.class_id,
+                   *first.bbox[2:4], *last.bbox[2:4]))
+    rows = np.array(rows, dtype=np.float64).reshape(-1, 14)
+    ep = {"start": rows[:,0].astype(np.int64),
+          "end": rows[:,1].astype(np.int64),
+          "head": rows[:,3:5],
+          "tail": rows[:,5:7],
+          "class": rows[:,9],
+          "head_size": rows[:,10:12],
+          "tail_size": rows[:,12:14]}
+    # velocity of the last step, per frame
+    df = rows[:,1] - rows[:,2]
+    step = rows[:,5:7] - rows[:,7:9]
+    ep["velocity"] = np.divide(step, df[:,np.newaxis], out=np.zeros_like(step), where=df[:,np.newaxis] > 0)
+    # bound extrapolation, and the search area with it
+    speed = np.hypot(ep["velocity"][:,0], ep["velocity"][:,1])
+    cap = StitchFxns.constants["max_speed"]
+    over = speed > cap
+    ep["velocity"][over] *= (cap / speed[over])[:,np.newaxis]
+    return ids, ep
+
+
+  def candidate_pairs(ep, max_gap, radius, speed_tolerance, same_class = True, mode = "distance"):
+    '''
+    Find (tail, head) fragment pairs compatible in time, position and class
+    Returns (tail_idx, head_idx, cost) arrays, cost combines the association
+    cost against the extrapolated tail box, normalized by the distance
+    allowed, and the normalized gap
+    '''
+    N = len(ep["start"])
+    empty = np.zeros(0, dtype=np.int64)
+    if N < 2:
+      return empty, empty, np.zeros(0)
+    reach = radius + speed_tolerance * max_gap
+    cell = float(reach)
+    origin = np.minimum(ep["head"].min(axis=0), ep["tail"].min(axis=0))
+    head_cell = np.floor((ep["head"] - origin) / cell).astype(np.int64)
+    ny = int(max(head_cell[:,1].max(), 0)) + 2
+    span = int(ep["end"].max()) + max_gap + 2
+
+    # sorted index of heads by (cell, start frame)
+    head_key = (head_cell[:,0] * ny + head_cell[:,1]) * span + ep["start"]
+    order = np.argsort(head_key, kind="stable")
+    keys = head_key[order]
+
+    # cells reachable by each tail's extrapolated path
+    far = ep["tail"] + ep["velocity"] * max_gap
+    lo_xy = np.floor((np.minimum(ep["tail"], far) - reach - origin) / cell).astype(np.int64)
+    hi_xy = np.floor((np.maximum(ep["tail"], far) + reach - origin) / cell).astype(np.int64)
+    lo_xy = np.clip(lo_xy, 0, None)
+    hi_xy[:,1] = np.minimum(hi_xy[:,1], ny - 1)
+    nx_t = np.clip(hi_xy[:,0] - lo_xy[:,0] + 1, 0, None)
+    ny_t = np.clip(hi_xy[:,1] - lo_xy[:,1] + 1, 0, None)
+    counts = nx_t * ny_t
+
+    # one query per (tail, cell)
+    q_tail = np.repeat(np.arange(N), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    qx = lo_xy[q_tail,0] + local // ny_t[q_tail]
+    qy = lo_xy[q_tail,1] + local % ny_t[q_tail]
+    base = (qx * ny + qy) * span
+    lo = np.searchsorted(keys, base + ep["end"][q_tail] + 1, side="left")
+    hi = np.searchsorted(keys, base + ep["end"][q_tail] + max_gap, side="right")
+
+    # expand the index ranges into candidate pairs
+    n = hi - lo
+    tail = np.repeat(q_tail, n)
+    pos = np.repeat(lo, n) + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    head = order[pos]
+
+    gap = ep["start"][head] - ep["end"][tail]
+    heads = np.concatenate([ep["head"][head], ep["head_size"][head]], axis=1)
+    pred = np.concatenate([ep["tail"][tail] + ep["velocity"][tail] * gap[:,np.newaxis], ep["tail_size"][tail]], axis=1)
+    d = GeometryFxns.center_distances(heads, pred, paired=True)
+    allowed = radius + speed_tolerance * gap
+    ok = d <= allowed
+    if same_class:
+      ok &= ep["class"][tail] == ep["class"][head]
+    tail, head = tail[ok], head[ok]
+    c = d[ok] if mode == "distance" else GeometryFxns.association_cost(heads[ok], pred[ok], mode, paired=True)
+    cost = c / allowed[ok] + gap[ok] / max_gap
+    return tail, head, cost
+
+
+  def match(tail, head, cost):
+    '''
+    Greedy one to one matching by ascending cost
+    Returns {tail_idx : head_idx}
+    '''
+    used_tail, used_head, matches = set(), set(), {}
+    for i in np.argsort(cost, kind="stable"):
+      t, h = int(tail[i]), int(head[i])
+      if t in used_tail or h in used_head:
+        continue
+      used_tail.add(t)
+      used_head.add(h)
+      matches[t] = h
+    return matches
+
+
+def stitch_tracks(OTM, max_gap = None, radius = None, speed_tolerance = None, same_class = None, mode = None):
+  '''
+  Merge fragmented tracks of a closed ObjectTrackManager in place, before linking
+  Unset arguments fall back to StitchFxns.constants, mode to the manager's association_cost
+  Returns a report of fragment, candidate and merge counts
+  '''
+  sc = StitchFxns.constants
+  max_gap = sc["max_gap"] if max_gap == None else max_gap
+  radius = sc["radius"] if radius == None else radius
+  speed_tolerance = sc["speed_tolerance"] if speed_tolerance == None else speed_tolerance
+  same_class = sc["same_class"] if same_class == None else same_class
+  mode = OTM.association_cost if mode == None else mode
+
+  ids, ep = StitchFxns.track_endpoints(OTM)
+  tail, head, cost = StitchFxns.candidate_pairs(ep, max_gap, radius, speed_tolerance, same_class, mode)
+  matches = StitchFxns.match(tail, head, cost)
+
+  # follow chains from fragments which nothing stitches onto
+  heads = set(matches.values())
+  removed = set()
+  for t in matches:
+    if t in heads:
+      continue
+    T = OTM.global_track_store[ids[t]]
+    nxt = matches.get(t)
+    while nxt != None:
+      B = OTM.global_track_store[ids[nxt]]
+      for yb in B.path:
+        yb.parent_track = T.track_id
+      T.path.extend(B.path)
+      T.last_frame, T.r, T.theta = B.last_frame, B.r, B.theta
+      removed.add(ids[nxt])
+      nxt = matches.get(nxt)
+
+  for k in removed:
+    del OTM.global_track_store[k]
+  OTM.inactive_tracks = [t for t in OTM.inactive_tracks if t.track_id not in removed]
+  if OTM.active_tracks != None:
+    for t in [t for t in OTM.active_tracks if t.track_id in removed]:
+      OTM.active_tracks.remove(t)
+  return {"fragments": len(ids),
+          "candidates": len(cost),
+          "merged": len(removed),
+          "tracks": len(OTM.global_track_store)}
@@ -1,20 +1,43 @@
 #!/usr/bin/python3
 import numpy as np
-from PIL import Image, ImageDraw
 import collections
-from aux_functions import *
 # from Dataloader import Dataloader
 from YoloBox import YoloBox
 from ObjectTrackManager import ObjectTrackManager
 from ObjectTrack import ObjectTrack
 from AnnotationLoader import AnnotationLoader as al
+from RenderPlan import RenderPlan, render_plan
+from augment_functions import AugmentFxns, augment_tracks
+from crop_functions import extract_crops
+from chunk_functions import build_tracks_chunked, compare_with_serial
+from filter_functions import FilterFxns
+from stitch_functions import stitch_tracks
+from interpolate_functions import interpolate_tracks
+from keyframe_functions import KeyframeFxns
+from TrackArchive import TrackArchive
+from TrackerStats import STATS
+# imaging modules (cv2, libmagic) are imported on demand by the commands that need them
 import sys
 import os
 import json
+import time
+import multiprocessing
 
 CUTOFF = 5
 # loader
 LOAD_CUTOFF = 1
+# optional pre-tracking filter, set from --min-conf and --nms
+LOAD_FILTER = {"min_confidence": None, "nms_iou": None}
+# optional stitching of fragmented tracks before linking, set from --stitch
+STITCH = {"max_gap": None}
+# optional gap filling and resampling after linking, set from --interpolate and --stride
+INTERPOLATE = {"max_gap": None, "stride": None}
+# optional keyframe export, set from --keyframes
+KEYFRAMES = {"tolerance": None}
+# optional stage timings and counters, dumped to filename, set from --stats
+STATS_DUMP = {"filename": None}
+# optional chrome trace event timeline, written to filename, set from --trace
+TRACE = {"filename": None}
 
 #builder
 def file_list_loader(valid_filename):
@@ -59,26 +82,64 @@ def json_loader(filename, sys_path):
   return an_json, sys_path
 
 
-def load_layers(files):
+def load_layers(files, report = None):
   '''
   BUILDER
   For each file, load all bounding boxes into a layer
+  Applies the LOAD_FILTER confidence threshold and NMS when set,
+  filling report with the removed box counts
   
   Returns an array of layers, 
   '''
   layer_list = []
   for i in range(len(files)):
     layer_list.append(al.load_yolofmt_layer(files[i]))
+  if LOAD_FILTER["min_confidence"] != None or LOAD_FILTER["nms_iou"] != None:
+    layer_list, counts = FilterFxns.filter_layers(layer_list, **LOAD_FILTER)
+    print(f"pre-filter removed {counts['removed']} of {counts['boxes']} boxes "
+          f"({counts['below_confidence']} below confidence, {counts['suppressed']} suppressed)", file=sys.stderr)
+    if report != None:
+      report.update(counts)
   return layer_list
 
 
+def pop_build_options(argv):
+  '''
+  CLI helper, removes --min-conf [threshold] and --nms [iou] into LOAD_FILTER,
+  --stitch [max_gap] into STITCH, --interpolate [max_gap] and --stride [frames]
+  into INTERPOLATE, --keyframes [tolerance] into KEYFRAMES, --stats [file]
+  into STATS_DUMP and --trace [file] into TRACE
+  '''
+  options = {"--min-conf": (LOAD_FILTER, "min_confidence", float),
+             "--nms": (LOAD_FILTER, "nms_iou", float),
+             "--stitch": (STITCH, "max_gap", int),
+             "--interpolate": (INTERPOLATE, "max_gap", int),
+             "--stride": (INTERPOLATE, "stride", int),
+             "--keyframes": (KEYFRAMES, "tolerance", float),
+             "--stats": (STATS_DUMP, "filename", str),
+             "--trace": (TRACE, "filename", str)}
+  rest, i = [], 0
+  while i < len(argv):
+    if argv[i] in options and i + 1 < len(argv):
+      target, key, conv = options[argv[i]]
+      target[key] = conv(argv[i + 1])
+      i += 2
+      continue
+    rest.append(argv[i])
+    i += 1
+  return rest
+
+
 def import_tracks(an_json, sys_path="."):
   '''
   LOADER
   Wrapper function for loading a json file into a newly created ObjectTrackManager
   
+  Keyframe exports are expanded to every step first
   Returns an ObjectTrackManager
   '''
+  if any("keyframes" in lt for lt in an_json["linked_tracks"]):
+    an_json = KeyframeFxns.expand_loco(an_json)
   otm = ObjectTrackManager()
   otm.import_loco_fmt(an_json,sys_path)
   return otm
@@ -107,7 +168,21 @@ def freeze_tracks(otm):
   Does not return anything
   '''
   otm.close_all_tracks()
-  otm.link_all_tracks(CUTOFF)
+  if STITCH["max_gap"] != None:
+    lap = STATS.start()
+    report = stitch_tracks(otm, max_gap=STITCH["max_gap"])
+    STATS.lap("stitch", lap)
+    print(f"stitched {report['merged']} of {report['fragments']} fragments "
+          f"from {report['candidates']} candidate pairs", file=sys.stderr)
+  print(f"{otm.link_all_tracks(CUTOFF)} tracks linked", file=sys.stderr)
+  if INTERPOLATE["max_gap"] != None or INTERPOLATE["stride"] != None:
+    lap = STATS.start()
+    report = interpolate_tracks(otm, **INTERPOLATE)
+    STATS.lap("interpolate", lap)
+    print(f"interpolated {report['filled']} boxes", file=sys.stderr)
+    if INTERPOLATE["stride"] != None:
+      print(f"resampled {report['tracks']} tracks to {report['resampled']} boxes, "
+            f"dropped {report['dropped']}", file=sys.stderr)
   # return otm
 
 def export_tracks(otm,filehandle=None, angle = 0,reflect_axis=None):
@@ -119,13 +194,23 @@ def export_tracks(otm,filehandle=None, angle = 0,reflect_axis=None):
   Writes output to a file handle or stdout
   Does not return anything
   '''
+  lap = STATS.start()
   coco_s = otm.export_loco_fmt(angle=angle,reflect_axis=reflect_axis)
+  report = None
+  if KEYFRAMES["tolerance"] != None:
+    coco_s, report = KeyframeFxns.simplify_loco(coco_s, KEYFRAMES["tolerance"])
+  s = json.dumps(coco_s,indent=2)
+  if report != None:
+    # the simplified size is the one being written, the full export is never serialized
+    print(f"keyframes: {report['keyframes']} of {report['annotations']} annotations "
+          f"({report['annotations'] / max(report['keyframes'], 1):.1f}x fewer), {len(s)} bytes", file=sys.stderr)
   if filehandle == None:
     f = open("out.json","w")
-    f.write(json.dumps(coco_s,indent=2))
+    f.write(s)
     f.close()
   else:
-    filehandle.write(json.dumps(coco_s,indent=2))
+    filehandle.write(s)
+  STATS.lap("export", lap)
 
 
 #track builder
@@ -152,6 +237,125 @@ def build_annotations(infile,outfile=None):
     print(f"danger of overwriting {infile}\naborting...")
   
 
+def build_chunked_annotations(infile, chunks = None, overlap = 20, outfile = None):
+  '''
+  BUILDER
+  Builds tracks for a single long video in overlapping chunks across processes
+  Stitches the chunks and exports like build
+  '''
+  files = file_list_loader(infile)
+  layer_list = load_layers(files)
+  o = build_tracks_chunked(files, layer_list, chunks, overlap)
+  freeze_tracks(o)
+  # Export
+  if outfile == None:
+    export_tracks(o,sys.stdout)
+  elif outfile != infile:
+    f = open(outfile,"w")
+    export_tracks(o,f)
+    f.close()
+  else:
+    print(f"danger of overwriting {infile}\naborting...")
+
+
+def validate_chunked_annotations(infile, chunks = None, overlap = 20):
+  '''
+  BUILDER
+  Compares chunked tracking of a video against a serial run
+  Prints link agreement metrics
+  '''
+  files = file_list_loader(infile)
+  layer_list = load_layers(files)
+  print(json.dumps(compare_with_serial(layer_list, chunks, overlap), indent=2))
+
+
+def build_video(infile, outfile):
+  '''
+  BUILDER
+  Builds tracks for a single file list into outfile, in isolation
+  Returns a per-video report with stage timings, or the failure
+  '''
+  report = {"input": infile, "output": outfile, "ok": False}
+  t0 = time.perf_counter()
+  try:
+    files = file_list_loader(infile)
+    filtered = {}
+    layer_list = load_layers(files, filtered)
+    t1 = time.perf_counter()
+    o = build_tracks(files, layer_list)
+    t2 = time.perf_counter()
+    freeze_tracks(o)
+    t3 = time.perf_counter()
+    f = open(outfile,"w")
+    export_tracks(o,f)
+    f.close()
+    t4 = time.perf_counter()
+    report.update({"ok": True,
+                   "frames": len(layer_list),
+                   "tracks": len(o.global_track_store),
+                   "linked_tracks": len(o.linked_tracks),
+                   "filtered": filtered,
+                   "timings": {"load": t1 - t0, "build": t2 - t1, "freeze": t3 - t2, "export": t4 - t3}})
+    if STATS.enabled:
+      # per worker process, see --stats, merged into the parent's by build_many_annotations
+      report["stats"] = STATS.snapshot()
+      report["stats_data"] = STATS.take_stats()
+    if STATS.tracing:
+      report["trace"] = STATS.take_trace()
+  except (Exception, SystemExit) as e:
+    # file_list_loader exits on bad input, record it like any other failure
+    # KeyboardInterrupt still stops the whole run
+    report["error"] = f"{type(e).__name__}: {e}"
+  report["total"] = time.perf_counter() - t0
+  return report
+
+
+def _build_video_worker(args):
+  return build_video(*args)
+
+
+def build_many_annotations(manifest, outdir, workers = None):
+  '''
+  BUILDER
+  Builds tracks for every file list in a manifest across a process pool
+    manifest: one file list per line
+  Writes outdir/<file list name>.json per video and outdir/build_many_report.json
+  '''
+  videos = al.load_annotation_file_list(manifest)
+  if videos == None:
+    return
+  videos = [v for v in videos if len(v.strip()) > 0]
+  os.makedirs(outdir, exist_ok=True)
+
+  jobs, seen = [], set()
+  for i,v in enumerate(videos):
+    stem = os.path.splitext(os.path.basename(v))[0]
+    if stem in seen:
+      stem = f"{stem}_{i}"
+    seen.add(stem)
+    jobs.append((v, os.path.join(outdir, f"{stem}.json")))
+
+  t0 = time.perf_counter()
+  # fresh worker per video, so nothing can leak between videos
+  with multiprocessing.Pool(workers, maxtasksperchild=1) as pool:
+    reports = pool.map(_build_video_worker, jobs, chunksize=1)
+  for r in reports:
+    STATS.add_trace(r.pop("trace", []))
+    STATS.add_stats(r.pop("stats_data", None))
+  failures = [r for r in reports if not r["ok"]]
+  summary = {"manifest": manifest,
+             "videos": len(reports),
+             "failed": len(failures),
+             "wall_time": time.perf_counter() - t0,
+             "reports": reports}
+  f = open(os.path.join(outdir, "build_many_report.json"),"w")
+  f.write(json.dumps(summary,indent=2))
+  f.close()
+  print(f"{len(reports) - len(failures)}/{len(reports)} videos built")
+  for r in failures:
+    print(f"FAILED {r['input']}: {r['error']}")
+
+
 def reload_annotations(infile, outfile=None):
   '''
   LOADER
@@ -174,6 +378,38 @@ def reload_annotations(infile, outfile=None):
     print(f"danger of overwriting {infile}\naborting...")
 
 
+def archive_annotations(infile, outfile, codec = "lzma"):
+  '''
+  ARCHIVE
+  Loads annotations from a json file
+  Writes the linked tracks as a compact TrackArchive
+  '''
+  s = al.load_annotations_from_json_file(infile)
+  o = import_tracks(s)
+  freeze_tracks(o)
+  TrackArchive.build(o).save(outfile, codec)
+  before, after = len(json.dumps(s,indent=2)), os.path.getsize(outfile)
+  print(f"archived {len(o.linked_tracks)} tracks, {before} -> {after} bytes "
+        f"({before / max(after, 1):.1f}x smaller)", file=sys.stderr)
+
+
+def unarchive_annotations(infile, outfile=None):
+  '''
+  ARCHIVE
+  Loads a TrackArchive
+  Serializes its tracks in LOCO format, like reload
+  '''
+  o = TrackArchive.load(infile).to_manager()
+  if outfile == None:
+    export_tracks(o,sys.stdout)
+  elif outfile != infile:
+    f = open(outfile,"w")
+    export_tracks(o,f)
+    f.close()
+  else:
+    print(f"danger of overwriting {infile}\naborting...")
+
+
 def draw_annotations(infile, sys_path):
   '''
   DRAW
@@ -185,7 +421,40 @@ def draw_annotations(infile, sys_path):
   o = import_tracks(s,sys_path)
   freeze_tracks(o)
   # "export"
-  o.draw_ybbox_data_on_images()
+  from ObjectTrackManagerHelpers import TrackArtFxns
+  TrackArtFxns.draw_ybbox_data_on_images(o, sys_path)
+
+
+def plan_annotations(infile, outfile, degree = 0):
+  '''
+  PLAN
+  Loads annotations from json file
+  Precomputes the per-frame draw lists once
+  Writes a serialized RenderPlan which can be rendered without reloading tracks
+  '''
+  s = al.load_annotations_from_json_file(infile)
+  o = import_tracks(s)
+  freeze_tracks(o)
+  image_transform = {}
+  if degree != 0:
+    o.rotate_linked_tracks(degree)
+    image_transform["angle"] = degree
+  from ObjectTrackManagerHelpers import TrackArtFxns
+  plan = TrackArtFxns.build_render_plan(o, image_transform)
+  plan.save(outfile)
+
+
+def render_annotations(planfile, sys_path, scale = 1.0):
+  '''
+  RENDER
+  Loads a serialized RenderPlan
+  Rasterizes every frame at the requested scale
+  Does not return
+  '''
+  plan = RenderPlan.load(planfile)
+  if plan == None:
+    return
+  render_plan(plan, sys_path, scale)
 
 def rotate_annotations(infile, sys_path, degree, outfile = None):
   '''
@@ -223,7 +492,8 @@ def draw_rotated_annotations(infile, sys_path, degree):
   freeze_tracks(o)
   
   o.rotate_linked_tracks(degree)
-  o.draw_ybbox_data_on_rotated_images(degree)
+  from ObjectTrackManagerHelpers import TrackArtFxns
+  TrackArtFxns.draw_ybbox_data_on_rotated_images(o, degree, sys_path)
 
 def reflect_annotations(infile, sys_path, reflect_axis, outfile=None):
   '''
@@ -263,7 +533,36 @@ def draw_reflected_annotations(infile, sys_path, reflect_axis = None):
   freeze_tracks(o)
 
   o.reflect_linked_tracks(r_ax)
-  o.draw_ybbox_data_on_reflected_images(r_ax)
+  from ObjectTrackManagerHelpers import TrackArtFxns
+  TrackArtFxns.draw_ybbox_data_on_reflected_images(o, r_ax, sys_path)
+
+def augment_annotations(infile, sys_path, variant_spec, outdir = "."):
+  '''
+  AUGMENT
+  Loads annotations from json file
+  Decodes every image once and writes all requested rotations/reflections
+  Writes a LOCO file per variant referencing those new images
+  '''
+  s = al.load_annotations_from_json_file(infile)
+  o = import_tracks(s,sys_path)
+  freeze_tracks(o)
+
+  variants = AugmentFxns.parse_variants(variant_spec)
+  for fn in augment_tracks(o, variants, sys_path, outdir):
+    print(f"wrote {fn}")
+
+def crop_annotations(infile, sys_path, output, padding = 0.1, size = None):
+  '''
+  CROPS
+  Loads annotations from json file
+  Decodes every image once and cuts out every box of every linked track
+  Writes per-track crop sequences, or a packed .npz array file
+  '''
+  s = al.load_annotations_from_json_file(infile)
+  o = import_tracks(s,sys_path)
+  freeze_tracks(o)
+  n = extract_crops(o, sys_path, output, padding, size)
+  print(f"{n} crops extracted")
 
 def main():
   '''
@@ -276,7 +575,20 @@ def main():
   refl_help = "reflect [input_file] [path_to_images] [axis = (x,y)]"
   draw_rot_help = "draw-rot [input_loco_file] [path_to_images] [degrees (x = {90, 180, 270})]"
   draw_refl_help = "draw-refl [input_file] [path_to_images] [axis = (x,y)]"
-  h = [build_help,reload_help,draw_help, rot_help, draw_rot_help, refl_help, draw_refl_help]
+  plan_help = "plan [input_loco_file] [output_plan.npz] [optional_degrees]"
+  render_help = "render [input_plan.npz] [path_to_images] [optional_scale]"
+  aug_help = "augment [input_loco_file] [path_to_images] [variants e.g. 90,180,270,x,y] [optional_output_dir]"
+  build_many_help = "build-many [manifest_file] [output_dir] [optional_workers]"
+  chunked_help = "build-chunked [input_file] [chunks] [overlap] [optional_output]"
+  validate_chunked_help = "validate-chunked [input_file] [chunks] [overlap]"
+  crops_help = "crops [input_loco_file] [path_to_images] [output_dir | output.npz] [optional_padding] [optional_size]"
+  archive_help = "archive [input_loco_file] [output.otma] [optional_codec = (lzma,zlib)]"
+  unarchive_help = "unarchive [input.otma] [optional_output]"
+  filter_help = "build, build-many, build-chunked, validate-chunked accept [--min-conf threshold] [--nms iou] [--stitch max_gap] [--interpolate max_gap] [--stride frames] [--keyframes tolerance] [--stats stats.json | stats.prom] [--trace trace.json]"
+  h = [build_help,build_many_help,chunked_help,validate_chunked_help,reload_help,draw_help, rot_help, draw_rot_help, refl_help, draw_refl_help, plan_help, render_help, aug_help, crops_help, archive_help, unarchive_help, filter_help]
+  sys.argv = pop_build_options(sys.argv)
+  STATS.tracing = TRACE["filename"] != None
+  STATS.enabled = STATS_DUMP["filename"] != None or STATS.tracing
   # print(sys.argv)
   if len(sys.argv) < 3:
     print(f"usage:")
@@ -300,6 +612,28 @@ def main():
       else:
         build_annotations(infile=sys.argv[2])
       
+    case 'build-many': # build tracks for many videos in parallel
+      if len(sys.argv) < 4:
+        print("must specify build-many [manifest_file] [output_dir]")
+      elif len(sys.argv) == 5:
+        build_many_annotations(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+      else:
+        build_many_annotations(sys.argv[2], sys.argv[3])
+
+    case 'build-chunked': # build a single long video in parallel chunks
+      if len(sys.argv) < 5:
+        print("must specify build-chunked [input_file] [chunks] [overlap]")
+      elif len(sys.argv) == 6:
+        build_chunked_annotations(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]), sys.argv[5])
+      else:
+        build_chunked_annotations(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+
+    case 'validate-chunked':
+      if len(sys.argv) < 5:
+        print("must specify validate-chunked [input_file] [chunks] [overlap]")
+      else:
+        validate_chunked_annotations(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+
     case 'draw':
       if len(sys.argv) != 4:
         print("must specify draw [input_file] [path_to_images]")
@@ -330,9 +664,60 @@ def main():
         print("must specify draw-refl [input_file] [path_to_images] [axis = (x,y)]")
       else:
         draw_reflected_annotations(sys.argv[2], sys.argv[3], sys.argv[4])
+
+    case 'plan':
+      if len(sys.argv) < 4:
+        print("must specify plan [input_loco_file] [output_plan.npz]")
+      elif len(sys.argv) == 5:
+        plan_annotations(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+      else:
+        plan_annotations(sys.argv[2], sys.argv[3])
+
+    case 'render':
+      if len(sys.argv) < 4:
+        print("must specify render [input_plan.npz] [path_to_images]")
+      elif len(sys.argv) == 5:
+        render_annotations(sys.argv[2], sys.argv[3], float(sys.argv[4]))
+      else:
+        render_annotations(sys.argv[2], sys.argv[3])
+
+    case 'augment':
+      if len(sys.argv) < 5:
+        print("must specify augment [input_loco_file] [path_to_images] [variants]")
+      elif len(sys.argv) == 6:
+        augment_annotations(sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5])
+      else:
+        augment_annotations(sys.argv[2], sys.argv[3], sys.argv[4])
+
+    case 'crops':
+      if len(sys.argv) < 5:
+        print("must specify crops [input_loco_file] [path_to_images] [output_dir | output.npz]")
+      else:
+        padding = float(sys.argv[5]) if len(sys.argv) > 5 else 0.1
+        size = int(sys.argv[6]) if len(sys.argv) > 6 else None
+        crop_annotations(sys.argv[2], sys.argv[3], sys.argv[4], padding, size)
       
+    case 'archive':
+      if len(sys.argv) < 4:
+        print("must specify archive [input_loco_file] [output.otma]")
+      elif len(sys.argv) == 5:
+        archive_annotations(sys.argv[2], sys.argv[3], sys.argv[4])
+      else:
+        archive_annotations(sys.argv[2], sys.argv[3])
+
+    case 'unarchive':
+      if len(sys.argv) == 4:
+        unarchive_annotations(sys.argv[2], sys.argv[3])
+      else:
+        unarchive_annotations(sys.argv[2])
+
     case other:
       print("unknown")
 
+  if STATS_DUMP["filename"] != None:
+    STATS.dump(STATS_DUMP["filename"])
+  if STATS.tracing:
+    STATS.save_trace(TRACE["filename"])
+
 if __name__ == '__main__':
   main()
\ No newline at end of file
@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+import numpy as np
+
+'''
+  Vectorized geometric transforms for packed bounding boxes
+
+  Boxes are packed as an (N,4) array of yolo bboxes [centerx, centery, width, height]
+  alongside an (N,2) array of per-box image centers [cx, cy], i.e. half the
+  source image dimensions. A BoxTransform is a chain of operations which is
+  composed into a single 3x3 affine matrix per distinct image size, then applied
+  to every box in one call.
+
+  Conventions match YoloBox and ImgFxns:
+    rotate(90)   counterclockwise,  (x, y) -> (y, W - x)
+    rotate(-90)  clockwise,         (x, y) -> (H - y, x)
+    reflect(1)   across the y axis, (x, y) -> (W - x, y)
+    reflect(0)   across the x axis, (x, y) -> (x, H - y)
+'''
+
+class BoxTransform:
+  def __init__(self):
+    self.ops = []
+
+  def rotate(self, degrees):
+    '''
+    Rotate by a multiple of 90 degrees about the image center
+    '''
+    if degrees % 90 != 0:
+      print(f"rotation by {degrees} degrees is not a multiple of 90, skipping")
+      return self
+    quad = (degrees // 90) % 4
+    if quad != 0:
+      self.ops.append(("rotate", quad))
+    return self
+
+  def reflect(self, axis):
+    '''
+    Reflect across an axis, see module docstring
+    '''
+    if axis in {0, 1}:
+      self.ops.append(("reflect", axis))
+    return self
+
+  def scale(self, sx, sy = None):
+    '''
+    Scale image and boxes by (sx, sy)
+    '''
+    self.ops.append(("scale", (float(sx), float(sx if sy == None else sy))))
+    return self
+
+  def crop(self, x0, y0, w, h):
+    '''
+    Crop to the window with top left corner (x0, y0) and size (w, h)
+    Boxes are translated, not clipped
+    '''
+    self.ops.append(("crop", (float(x0), float(y0), float(w), float(h))))
+    return self
+
+
+  def matrix(self, size):
+    '''
+    Compose all operations for a single source image size (W, H)
+    Returns (3x3 affine matrix, transformed (W, H))
+    '''
+    M = np.eye(3)
+    W,H = size
+    for op, arg in self.ops:
+      if op == "rotate":
+        for _ in range(arg):
+          T = np.array([[0., 1., 0.], [-1., 0., W], [0., 0., 1.]])
+          W,H = H,W
+          M = T @ M
+      elif op == "reflect":
+        if arg == 1:
+          T = np.array([[-1., 0., W], [0., 1., 0.], [0., 0., 1.]])
+        else:
+          T = np.array([[1., 0., 0.], [0., -1., H], [0., 0., 1.]])
+        M = T @ M
+      elif op == "scale":
+        sx,sy = arg
+        M = np.diag([sx, sy, 1.]) @ M
+        W,H = W * sx, H * sy
+      elif op == "crop":
+        x0,y0,cw,ch = arg
+        T = np.array([[1., 0., -x0], [0., 1., -y0], [0., 0., 1.]])
+        M = T @ M
+        W,H = cw,ch
+    return M, (W, H)
+
+
+  def apply(self, bboxes, centers):
+    '''
+    Transform packed boxes
+      bboxes  : (N,4) [centerx, centery, width, height]
+      centers : (N,2) per-box image centers
+    Returns (transformed bboxes, transformed centers)
+    '''
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+    if len(self.ops) == 0 or len(bboxes) == 0:
+      return bboxes.copy(), centers.copy()
+
+    # one composed matrix per distinct image size, usually a single one
+    if (centers == centers[0]).all():
+      M, new_size = self.matrix(tuple(centers[0] * 2))
+      M = M[np.newaxis]
+      new_sizes = np.broadcast_to(np.array(new_size, dtype=np.float64), centers.shape)
+    else:
+      keys, inv = np.unique(np.ascontiguousarray(centers).view(np.complex128).reshape(-1), return_inverse=True)
+      sizes = np.stack((keys.real, keys.imag), axis=1) * 2
+      mats = np.empty((len(sizes), 3, 3))
+      new_sizes = np.empty((len(sizes), 2))
+      for k in range(len(sizes)):
+        mats[k], new_sizes[k] = self.matrix(tuple(sizes[k]))
+      M = mats[inv.reshape(-1)]
+      new_sizes = new_sizes[inv.reshape(-1)]
+
+    out = np.empty_like(bboxes)
+    # box centers are affine, box dimensions only see the linear part
+    out[:,0] = M[:,0,0] * bboxes[:,0] + M[:,0,1] * bboxes[:,1] + M[:,0,2]
+    out[:,1] = M[:,1,0] * bboxes[:,0] + M[:,1,1] * bboxes[:,1] + M[:,1,2]
+    out[:,2] = np.abs(M[:,0,0]) * bboxes[:,2] + np.abs(M[:,0,1]) * bboxes[:,3]
+    out[:,3] = np.abs(M[:,1,0]) * bboxes[:,2] + np.abs(M[:,1,1]) * bboxes[:,3]
+    return out, new_sizes / 2
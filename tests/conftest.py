@@ -0,0 +1,5 @@
+import sys
+from os import path
+
+# the modules live flat in src/ and import each other by name
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "src"))
@@ -0,0 +1,28 @@
+import numpy as np
+
+from association_functions import AssociationFxns
+
+
+def problems(shapes, seed = 0):
+  rng = np.random.default_rng(seed)
+  return ([np.round(rng.uniform(0, 50, (T, 2))) for D,T in shapes],
+          [np.round(rng.uniform(0, 50, (D, 2))) for D,T in shapes])
+
+
+def test_batched_matches_per_problem_sort():
+  shapes = [(5, 4), (6, 4), (0, 3), (3, 0), (40, 30), (5, 5), (1, 1)]
+  preds, dets = problems(shapes)
+  batched, computed = AssociationFxns.batched_sorted_pairs(preds, dets)
+  for p,d,(d_idx, t_idx, dist) in zip(preds, dets, batched):
+    expected = AssociationFxns.sorted_pairs(AssociationFxns.center_distances(p, d))
+    assert np.array_equal(d_idx, expected[0]) and np.array_equal(t_idx, expected[1])
+    assert np.array_equal(dist, expected[2])
+  assert computed <= 1.25 * sum(D * T for D,T in shapes)
+
+
+def test_skewed_partitions_are_not_padded_to_the_largest():
+  # a 90/10 class split of 100 tracks x 100 detections
+  preds, dets = problems([(90, 90), (10, 10)])
+  _, computed = AssociationFxns.batched_sorted_pairs(preds, dets)
+  assert computed == 90 * 90 + 10 * 10
+  assert AssociationFxns.pad_buckets([(90, 90), (10, 10), (11, 10), (10, 11)]) == [[1, 2, 3], [0]]
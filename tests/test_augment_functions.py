@@ -0,0 +1,58 @@
+import json
+import sys
+from os import path
+
+import numpy as np
+import pytest
+
+from ObjectTrackManager import ObjectTrackManager
+from augment_functions import AugmentFxns, augment_tracks
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "benchmarks"))
+import fish_school
+
+
+def loco_tracks(frames):
+  files, layers = fish_school.make_layers(frames=frames, fish=4, seed=5)
+  o = ObjectTrackManager(filenames=files, layers=layers)
+  o.initialize_tracks()
+  o.process_all_layers()
+  o.close_all_tracks()
+  o.link_all_tracks()
+  return o.export_loco_fmt()
+
+
+def test_undecodable_frames_are_left_out_of_every_variant(tmp_path):
+  cv2 = pytest.importorskip("cv2")
+  s = loco_tracks(4)
+  # frame 1 is missing, frame 2 is not an image
+  for img in s["images"]:
+    cv2.imwrite(str(tmp_path / img["file_name"]), np.zeros((img["height"] // 8, img["width"] // 8, 3), dtype=np.uint8))
+  (tmp_path / s["images"][1]["file_name"]).unlink()
+  (tmp_path / s["images"][2]["file_name"]).write_bytes(b"not a png")
+  kept = [s["images"][0]["file_name"], s["images"][3]["file_name"]]
+  expected = sorted(st["bbox"][2] * st["bbox"][3] for st in s["annotations"] if st["image_id"] in (0, 3))
+
+  o = ObjectTrackManager()
+  o.import_loco_fmt(s, str(tmp_path))
+  o.link_all_tracks()
+  variants = AugmentFxns.parse_variants("90,x")
+  written = augment_tracks(o, variants, str(tmp_path), str(tmp_path / "out"), workers=1)
+  for v,fn in zip(variants, written):
+    f = open(fn, "r")
+    exp = json.load(f)
+    f.close()
+    assert [img["file_name"] for img in exp["images"]] == [f"{v['name']}_{k}" for k in kept]
+    assert [img["id"] for img in exp["images"]] == [0, 1]
+    assert sorted(st["area"] for st in exp["annotations"]) == pytest.approx(expected)
+    assert [st["id"] for st in exp["annotations"]] == list(range(len(expected)))
+    assert sorted(i for lt in exp["linked_tracks"] for i in lt["steps"]) == list(range(len(expected)))
+    assert all(lt["track_len"] == len(lt["steps"]) for lt in exp["linked_tracks"])
+
+    # every annotation is imported onto the frame its box came from
+    r = ObjectTrackManager()
+    r.import_loco_fmt(exp, str(tmp_path / "out"))
+    for k,name in enumerate(kept):
+      areas = sorted(yb.bbox[2] * yb.bbox[3] for yb in r.layers[k])
+      source = [img["file_name"] for img in s["images"]].index(name)
+      assert areas == pytest.approx(sorted(st["bbox"][2] * st["bbox"][3] for st in s["annotations"] if st["image_id"] == source))
@@ -0,0 +1,40 @@
+import json
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks"))
+import bench_association
+
+
+def case(engine, relative, p50 = 1.0, N = 10, M = 10):
+  return {"engine": engine, "tracks": N, "detections": M, "p50_ms": p50, "vs_calibration": relative}
+
+
+def test_regressions_are_relative_to_calibration():
+  baseline = {"cases": [case("legacy", 0.5), case("streaming", 0.4)]}
+  # a machine twice as slow is no regression
+  results = [case("legacy", 0.5, p50=2.0), case("streaming", 0.4, p50=2.0)]
+  assert bench_association.compare(results, baseline, 0.3) == []
+  assert len(bench_association.compare(results, baseline, 0.3, absolute=True)) == 2
+  # legacy slowing down is checked like any engine
+  results = [case("legacy", 0.75), case("streaming", 0.4)]
+  regressions = bench_association.compare(results, baseline, 0.3)
+  assert [r["engine"] for r in regressions] == ["legacy"]
+  assert regressions[0]["ratio"] == pytest.approx(1.5)
+
+
+def test_merged_baseline_is_the_median_run():
+  runs = [{"cases": [case("legacy", v)], "regressions": []} for v in [0.4, 0.9, 0.5]]
+  merged = bench_association.merge_runs(runs)
+  assert merged["runs"] == 3
+  assert merged["cases"][0]["vs_calibration"] == 0.5
+
+
+def test_reference_baseline_covers_the_default_grid():
+  f = open(bench_association.BASELINE, "r")
+  baseline = json.load(f)
+  f.close()
+  cells = {(r["engine"], r["tracks"], r["detections"]) for r in baseline["cases"] if "vs_calibration" in r}
+  assert cells == {(e, N, M) for e in bench_association.ENGINES
+                   for N in bench_association.DEFAULT_TRACKS for M in bench_association.DEFAULT_DETS}
@@ -0,0 +1,50 @@
+import numpy as np
+
+from YoloBox import YoloBox
+from association_functions import AssociationFxns
+from StreamingObjectTrackManager import ObjectTrackManager
+
+
+def test_gated_sort_matches_filtered_sort():
+  rng = np.random.default_rng(0)
+  cost = np.round(rng.uniform(0, 100, (40, 30)))    # plenty of ties
+  d, t, c = AssociationFxns.sorted_pairs(cost)
+  within = c <= 35
+  gd, gt, gc = AssociationFxns.sorted_pairs(cost, 35)
+  assert np.array_equal(gd, d[within]) and np.array_equal(gt, t[within]) and np.array_equal(gc, c[within])
+
+
+def swimmers(frames, fish, seed = 0):
+  rng = np.random.default_rng(seed)
+  start = rng.uniform(0, 1900, (fish, 2))
+  velocity = rng.uniform(-4, 4, (fish, 2))
+  return [[YoloBox(0, [float(x), float(y), 40.0, 20.0], f"f{f}", confidence=0.9) for x,y in start + velocity * f]
+          for f in range(frames)]
+
+
+def test_level_one_saves_sorting():
+  layers = swimmers(4, 200)
+  o = ObjectTrackManager()
+  o.add_new_layer(layers[0])
+  o.initialize_tracks()
+  # unit costs which a budget only fits once most pairs are gated
+  o.unit_costs = {"setup": 0.0, "predict": 0.0, "pair": 0.0, "sort": 1e-6, "assign": 0.0, "create": 0.0}
+  o.frame_budget = 200 * 200 * 1e-6 / 2
+  for layer in layers[1:]:
+    o.add_new_layer(layer)
+    o.process_latest_layer()
+    report = o.last_frame_report
+    assert report["level"] == 1
+    assert report["pairs"] < 200 * 200 / 4
+    o.unit_costs = {"setup": 0.0, "predict": 0.0, "pair": 0.0, "sort": 1e-6, "assign": 0.0, "create": 0.0}
+
+  # every true pair is well inside the gate, so gating changes no association
+  layers = swimmers(4, 200)
+  full = ObjectTrackManager()
+  full.add_new_layer(layers[0])
+  full.initialize_tracks()
+  for layer in layers[1:]:
+    full.add_new_layer(layer)
+    full.process_latest_layer()
+  paths = lambda m: {k: [yb.bbox for yb in t.path] for k,t in m.global_track_store.items()}
+  assert paths(o) == paths(full)
@@ -0,0 +1,61 @@
+import sys
+from os import path
+
+import pytest
+
+from YoloBox import YoloBox
+from ObjectTrack import ObjectTrack
+from chunk_functions import ChunkFxns, compare_with_serial
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "benchmarks"))
+import fish_school
+
+
+def agreement(layers, chunks, overlap):
+  return compare_with_serial(layers, chunks, overlap, workers=1)
+
+
+def test_single_chunk_matches_serial():
+  _, layers = fish_school.make_layers(frames=60, fish=10, seed=1)
+  r = agreement(layers, 1, 0)
+  assert r["recall"] == 1.0 and r["precision"] == 1.0
+  assert r["chunked_tracks"] == r["serial_tracks"]
+
+
+@pytest.mark.parametrize("chunks,overlap,floor", [(2, 40, 0.79), (4, 20, 0.73), (4, 80, 0.76), (8, 20, 0.72)])
+def test_chunked_agreement_within_documented_tolerance(chunks, overlap, floor):
+  # every row of the module's tolerance table at its lower end, seed 3
+  _, layers = fish_school.make_layers(frames=400, fish=20, seed=3)
+  r = agreement(layers, chunks, overlap)
+  assert r["recall"] >= floor
+  assert abs(r["precision"] - r["recall"]) <= 0.005
+
+
+def test_every_detection_owned_once():
+  _, layers = fish_school.make_layers(frames=120, fish=10, seed=2)
+  packed = ChunkFxns.pack_layers(layers)
+  spans = ChunkFxns.split_chunks(len(layers), 3, 20)
+  chunk_tracks = [ChunkFxns.track_chunk(start, packed[start:stop]) for start,stop,_ in spans]
+  steps = [tuple(s) for t in ChunkFxns.stitch(spans, chunk_tracks) for s in t.tolist()]
+  assert len(steps) == len(set(steps))
+  assert set(steps) == {(li, di) for li,layer in enumerate(layers) for di in range(len(layer))}
+
+
+def test_set_path_leaves_the_state_of_add_new_step():
+  # the legacy tracker may give a track two boxes of one frame
+  frames = [0, 1, 3, 3, 4, 7]
+  boxes = lambda: [YoloBox(0, [10.0 * f + i, 5.0 * f * f, 20.0, 10.0], f"f{f}") for i,f in enumerate(frames)]
+  stepped, at_once = ObjectTrack(0, 0), ObjectTrack(0, 0)
+  for yb,f in zip(boxes(), frames):
+    stepped.add_new_step(yb, f)
+  at_once.set_path(boxes(), frames)
+  for T in (stepped, at_once):
+    assert all(yb.parent_track == 0 for yb in T.path)
+  assert [yb.bbox for yb in at_once.path] == [yb.bbox for yb in stepped.path]
+  for k in ["last_frame", "r", "theta", "velocity"]:
+    assert getattr(at_once, k) == getattr(stepped, k), k
+  ends = (frames[-2:], frames[-1:])
+  for fs in ends:
+    T = ObjectTrack(0, 0)
+    T.set_path(boxes()[-len(fs):], fs)
+    assert T.last_frame == fs[-1]
@@ -0,0 +1,44 @@
+import numpy as np
+
+from YoloBox import YoloBox
+from filter_functions import FilterFxns
+
+
+def box(x, class_id = 0, confidence = None):
+  return YoloBox(class_id, [x, 100.0, 40.0, 20.0], "0", confidence=confidence)
+
+
+def test_nms_ties_keep_input_order():
+  boxes = np.array([[100.0, 100.0, 40.0, 20.0], [102.0, 100.0, 40.0, 20.0]])
+  assert FilterFxns.nms(boxes, [0.8, 0.8]).tolist() == [0]
+  assert FilterFxns.nms(boxes[::-1], [0.8, 0.8]).tolist() == [0]
+  # a higher score wins wherever it sits
+  assert FilterFxns.nms(boxes, [0.7, 0.8]).tolist() == [1]
+
+
+def test_nms_keeps_overlapping_boxes_of_different_classes():
+  boxes = np.array([[100.0, 100.0, 40.0, 20.0], [102.0, 100.0, 40.0, 20.0], [101.0, 100.0, 40.0, 20.0]])
+  scores = [0.9, 0.8, 0.7]
+  assert FilterFxns.nms(boxes, scores, [0, 1, 0]).tolist() == [0, 1]
+  assert FilterFxns.nms(boxes, scores).tolist() == [0]
+
+
+def test_boxes_without_confidence_pass_and_rank_first():
+  layer = [box(100.0, confidence=0.99), box(102.0), box(500.0, confidence=0.2), box(800.0)]
+  kept, below, suppressed = FilterFxns.filter_layer(layer, min_confidence=0.5, nms_iou=0.5)
+  assert kept == [layer[1], layer[3]]
+  assert (below, suppressed) == (1, 1)
+
+
+def test_filter_layers_counts_every_removal():
+  layers = [
+    [box(100.0, confidence=0.9), box(101.0, confidence=0.8), box(101.0, 1, 0.8), box(400.0, confidence=0.1)],
+    [],
+    [box(100.0), box(300.0, confidence=0.3), box(301.0, confidence=0.6), box(302.0, confidence=0.7)],
+  ]
+  filtered, report = FilterFxns.filter_layers(layers, min_confidence=0.5, nms_iou=0.5)
+  assert [len(layer) for layer in filtered] == [2, 0, 2]
+  assert filtered[0] == [layers[0][0], layers[0][2]]
+  assert filtered[2] == [layers[2][0], layers[2][3]]
+  assert report == {"boxes": 8, "below_confidence": 2, "suppressed": 2, "removed": 4}
+  assert FilterFxns.filter_layers(layers) == (layers, {"boxes": 8, "below_confidence": 0, "suppressed": 0, "removed": 0})
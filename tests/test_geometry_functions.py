@@ -0,0 +1,100 @@
+import numpy as np
+
+from YoloBox import YoloBox
+from ObjectTrackManager import ObjectTrackManager
+from StreamingObjectTrackManager import ObjectTrackManager as StreamingObjectTrackManager
+from geometry_functions import GeometryFxns
+from stitch_functions import stitch_tracks
+
+
+def boxes(seed, n):
+  rng = np.random.default_rng(seed)
+  return np.column_stack([rng.uniform(0, 2000, (n, 2)), rng.uniform(10, 80, (n, 2))])
+
+
+def test_overlap_costs_are_gated():
+  dets, preds = boxes(0, 40), boxes(1, 30)
+  far = GeometryFxns.association_cost(dets, preds, "distance") > 400
+  for mode in ["iou", "giou"]:
+    cost = GeometryFxns.association_cost(dets, preds, mode, gate=400)
+    assert np.array_equal(np.isinf(cost), far)
+    assert np.all(cost[~far] <= GeometryFxns.cost_constants["overlap_weight"])
+
+
+def test_paired_costs_match_the_matrix_diagonal():
+  dets, preds = boxes(2, 25), boxes(3, 25)
+  for mode in ["distance", "iou", "giou", "hybrid"]:
+    full = GeometryFxns.association_cost(dets, preds, mode, gate=400)
+    assert np.array_equal(np.diag(full), GeometryFxns.association_cost(dets, preds, mode, gate=400, paired=True))
+
+
+def jump_layers():
+  # one fish, then a detection far beyond radial_exclusion
+  return [[YoloBox(0, [100.0, 100.0, 40.0, 20.0], "f0")],
+          [YoloBox(0, [104.0, 100.0, 40.0, 20.0], "f1")],
+          [YoloBox(0, [1500.0, 900.0, 40.0, 20.0], "f2")]]
+
+
+def test_iou_cost_never_joins_far_detections():
+  for mode in ["iou", "giou"]:
+    o = StreamingObjectTrackManager()
+    o.association_cost = mode
+    for layer in jump_layers():
+      o.add_new_layer(layer)
+      if len(o.layers) == 1:
+        o.initialize_tracks()
+      else:
+        o.process_latest_layer()
+    assert o.global_track_store[0].path[-1].bbox[0] == 104.0, mode
+
+    o = ObjectTrackManager(layers=jump_layers())
+    o.association_cost = mode
+    o.initialize_tracks()
+    o.process_all_layers()
+    assert o.global_track_store[0].path[-1].bbox[0] == 104.0, mode
+
+
+def test_batch_cost_modes_follow_swimmers():
+  rng = np.random.default_rng(4)
+  start, velocity = rng.uniform(100, 1800, (8, 2)), rng.uniform(-3, 3, (8, 2))
+  for mode in ["distance", "iou", "giou", "hybrid"]:
+    layers = [[YoloBox(0, [float(x), float(y), 40.0, 20.0], f"f{f}") for x,y in start + velocity * f] for f in range(10)]
+    o = ObjectTrackManager(layers=layers)
+    o.association_cost = mode
+    o.initialize_tracks()
+    o.process_all_layers()
+    assert len(o.global_track_store) == 8 and all(len(t.path) == 10 for t in o.global_track_store.values()), mode
+
+
+def test_stitch_uses_the_association_cost():
+  for mode in ["distance", "iou"]:
+    # a second fish keeps a track active, the first is hidden for frames 5-10
+    layers = [[YoloBox(0, [1000.0, 800.0, 40.0, 20.0], f"f{f}")] for f in range(16)]
+    for f in list(range(5)) + list(range(11, 16)):
+      layers[f].append(YoloBox(0, [100.0 + 5 * f, 100.0, 40.0, 20.0], f"f{f}"))
+    o = ObjectTrackManager(layers=layers)
+    o.association_cost = mode
+    o.initialize_tracks()
+    o.process_all_layers()
+    o.close_all_tracks()
+    report = stitch_tracks(o, max_gap=10)
+    assert report["merged"] == 1 and report["tracks"] == 2, mode
+
+
+def test_partitioned_and_tiered_passes_use_the_association_cost():
+  # the detection's center is nearer the small track, its box overlaps the large one
+  def matched(confidence, **options):
+    layers = [[YoloBox(0, [100.0, 100.0, 10.0, 10.0], "f0"), YoloBox(0, [130.0, 100.0, 80.0, 80.0], "f0")],
+              [YoloBox(0, [112.0, 100.0, 80.0, 80.0], "f1", confidence=confidence)]]
+    o = ObjectTrackManager(layers=layers)
+    for k,v in options.items():
+      setattr(o, k, v)
+    o.initialize_tracks()
+    o.process_layer(1)
+    return [yb.parent_track for yb in layers[0]].index(layers[1][0].parent_track)
+
+  for confidence, options in [(0.9, {}), (0.9, {"partition_mode": "category"}),
+                              (0.1, {"partition_mode": "category"}), (0.9, {"high_confidence": 0.5}),
+                              (0.1, {"high_confidence": 0.5})]:
+    assert matched(confidence, **options) == 0, options
+    assert matched(confidence, association_cost="iou", **options) == 1, options
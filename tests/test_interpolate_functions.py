@@ -0,0 +1,57 @@
+import numpy as np
+
+from YoloBox import YoloBox
+from ObjectTrack import ObjectTrack
+from ObjectTrackManager import ObjectTrackManager
+from interpolate_functions import InterpolateFxns, interpolate_tracks
+
+
+def manager(steps, frames = 20):
+  # one linked track seen at steps, moving 10 px a frame
+  o = ObjectTrackManager()
+  o.filenames = [f"vid.{i:06d}.png" for i in range(frames)]
+  o.layers = [[] for _ in range(frames)]
+  T = ObjectTrack(0, 0)
+  for f in steps:
+    yb = YoloBox(0, [10.0 * f, 50.0, 20.0, 10.0], f"vid.{f:06d}.txt")
+    o.layers[f].append(yb)
+    T.add_new_step(yb, f)
+  T.link_path()
+  o.global_track_store[0] = T
+  o.linked_tracks.append(0)
+  return o
+
+
+def test_resample_skips_gaps_longer_than_max_gap():
+  frames = np.array([0, 1, 2, 8, 9, 10])
+  boxes = np.column_stack([frames * 10.0, np.zeros((6, 3))])
+  tracks = np.zeros(6, dtype=np.int64)
+  s_frame = InterpolateFxns.resample(frames, boxes, tracks, 2)[0]
+  assert s_frame.tolist() == [0, 2, 4, 6, 8, 10]
+  s_frame, s_box, _, _, exact = InterpolateFxns.resample(frames, boxes, tracks, 2, max_gap=4)
+  assert s_frame.tolist() == [0, 2, 8, 10]
+  assert exact.all()
+  s_frame = InterpolateFxns.resample(frames, boxes, tracks, 2, max_gap=5)[0]
+  assert s_frame.tolist() == [0, 2, 4, 6, 8, 10]
+
+
+def test_resampling_leaves_unfilled_gaps_and_clears_dropped_boxes():
+  o = manager([0, 1, 2, 3, 10, 11, 12, 13])
+  report = interpolate_tracks(o, stride=2)
+  T = o.get_track(0)
+  fidx = o.get_frame_index()
+  assert [fidx[yb.img_filename] for yb in T.path] == [0, 2, 10, 12]
+  assert report["dropped"] == 4
+  for layer in o.layers:
+    for yb in layer:
+      assert yb.parent_track == T.track_id
+  assert sum(len(layer) for layer in o.layers) == len(T.path)
+
+
+def test_filled_gaps_are_resampled():
+  o = manager([0, 1, 2, 3, 7, 8, 9])
+  report = interpolate_tracks(o, max_gap=3, stride=3)
+  fidx = o.get_frame_index()
+  assert [fidx[yb.img_filename] for yb in o.get_track(0).path] == [0, 3, 6, 9]
+  assert report["filled"] == 3
+  assert sum(len(layer) for layer in o.layers) == 4
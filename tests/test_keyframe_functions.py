@@ -0,0 +1,30 @@
+import numpy as np
+
+from keyframe_functions import KeyframeFxns
+
+
+def loco(n = 30):
+  # one track moving in a straight line, then turning
+  x = np.concatenate([np.arange(n // 2) * 5.0, (n // 2) * 5.0 + np.zeros(n - n // 2)])
+  y = np.concatenate([np.zeros(n // 2), np.arange(n - n // 2) * 5.0])
+  annotations = [{"id": i, "image_id": i, "trackmap_index": 0, "bbox": [x[i], y[i], 20.0, 10.0]} for i in range(n)]
+  return {"linked_tracks": [{"track_id": 0, "steps": list(range(n))}], "annotations": annotations}
+
+
+def test_sizes_are_only_measured_on_request():
+  out, report = KeyframeFxns.simplify_loco(loco(), 0.5)
+  assert report == {"annotations": 30, "keyframes": len(out["annotations"])}
+  assert len(out["annotations"]) < 30
+  _, report = KeyframeFxns.simplify_loco(loco(), 0.5, sizes=True)
+  assert report["simplified_bytes"] < report["bytes"]
+  assert report["reduction"] > 1
+
+
+def test_expanded_keyframes_are_within_tolerance():
+  original = loco()
+  out, _ = KeyframeFxns.simplify_loco(original, 0.5)
+  expanded = KeyframeFxns.expand_loco(out)
+  assert [st["image_id"] for st in expanded["annotations"]] == list(range(30))
+  err = np.abs(np.array([st["bbox"] for st in expanded["annotations"]]) -
+               np.array([st["bbox"] for st in original["annotations"]]))
+  assert err.max() <= 0.5
@@ -0,0 +1,68 @@
+import numpy as np
+
+from YoloBox import YoloBox
+from ObjectTrackManager import ObjectTrackManager
+
+
+def make_layers(fish, frames, seed):
+  '''
+  Straight line swimmers, one YoloBox per fish per frame
+  '''
+  rng = np.random.default_rng(seed)
+  start = rng.uniform(100, 900, (fish, 2))
+  velocity = rng.uniform(-5, 5, (fish, 2))
+  layers = []
+  for f in range(frames):
+    pos = start + velocity * f
+    layers.append([YoloBox(0, [float(x), float(y), 40.0, 20.0], f"seed{seed}.{f:04d}.txt") for x,y in pos])
+  return layers
+
+
+def serial_tracks(layers):
+  o = ObjectTrackManager(layers=layers)
+  o.initialize_tracks()
+  o.process_all_layers()
+  o.close_all_tracks()
+  o.link_all_tracks()
+  return {k: [id(yb) for yb in t.path] for k,t in o.global_track_store.items()}
+
+
+def test_interleaved_managers_do_not_share_state():
+  layers_a, layers_b = make_layers(6, 30, 1), make_layers(9, 30, 2)
+  expected_a = serial_tracks(make_layers(6, 30, 1))
+
+  a, b = ObjectTrackManager(layers=layers_a), ObjectTrackManager(layers=layers_b)
+  a.initialize_tracks()
+  b.initialize_tracks()
+  for i in range(1, 30):
+    a.process_layer(i)
+    b.process_layer(i)
+  for o in (a, b):
+    o.close_all_tracks()
+    o.link_all_tracks()
+
+  # no container is shared between the two managers
+  for attr in ["global_track_store", "layers", "active_tracks", "inactive_tracks", "linked_tracks", "filenames", "fdict"]:
+    assert getattr(a, attr) is not getattr(b, attr), attr
+
+  # no track, and no box, ends up in both managers
+  assert not set(map(id, a.global_track_store.values())) & set(map(id, b.global_track_store.values()))
+  boxes_a = {id(yb) for t in a.global_track_store.values() for yb in t.path}
+  boxes_b = {id(yb) for t in b.global_track_store.values() for yb in t.path}
+  assert not boxes_a & boxes_b
+  assert boxes_a == {id(yb) for layer in layers_a for yb in layer}
+  assert boxes_b == {id(yb) for layer in layers_b for yb in layer}
+
+  # interleaving gives the same tracks as running alone
+  assert {k: len(t.path) for k,t in a.global_track_store.items()} == {k: len(p) for k,p in expected_a.items()}
+  assert len(b.global_track_store) == 9
+  assert a.linked_tracks == list(range(6))
+  assert b.linked_tracks == list(range(9))
+
+
+def test_default_containers_are_per_instance():
+  a, b = ObjectTrackManager(), ObjectTrackManager()
+  a.layers.append([])
+  a.global_track_store[0] = None
+  a.linked_tracks.append(0)
+  assert b.layers == [] and b.global_track_store == {} and b.linked_tracks == []
@@ -0,0 +1,44 @@
+import json
+import numpy as np
+
+from OTFTrackerServer import OTFTrackerServer, BIN_HEADER
+from StreamingObjectTrackManager import ObjectTrackManager
+
+
+def binary_request(stream_id, frame_no, centers):
+  arr = np.zeros((len(centers), 6), dtype="<f4")
+  arr[:,1] = 1.0
+  arr[:,2:4] = centers
+  arr[:,4:] = (20.0, 10.0)
+  return b'B' + BIN_HEADER.pack(stream_id, frame_no, len(arr)) + arr.tobytes()
+
+
+def test_binary_request_carries_frame():
+  kind, stream_id, frame_no, layer = OTFTrackerServer.decode_request(binary_request(3, 41, [(10, 10), (50, 50)]))
+  assert (kind, stream_id, frame_no) == (b'B', 3, 41)
+  assert [yb.img_filename for yb in layer] == ["frame_41", "frame_41"]
+
+
+def test_json_request_carries_frame():
+  annos = [{"image_id": 7, "category_id": 0, "bbox": [10.0, 10.0, 20.0, 10.0]}]
+  body = b'J' + json.dumps({"stream_id": 1, "frame": 7, "annotations": annos}).encode()
+  kind, stream_id, frame_no, layer = OTFTrackerServer.decode_request(body)
+  assert (kind, stream_id, frame_no, len(layer)) == (b'J', 1, 7, 1)
+  body = b'J' + json.dumps({"stream_id": 1, "annotations": annos}).encode()
+  assert OTFTrackerServer.decode_request(body)[2] == None
+
+
+def test_frames_key_the_stream_layers():
+  lifespan = ObjectTrackManager.constants["track_lifespan"]
+  server = OTFTrackerServer()
+  # stream 0 drops frames within the track lifespan, stream 1 beyond it
+  for stream_id, frames in [(0, [0, 1, lifespan]), (1, [0, 1, 1 + lifespan])]:
+    for frame_no in frames:
+      kind, s, f, layer = OTFTrackerServer.decode_request(binary_request(stream_id, frame_no, [(100 + frame_no, 100)]))
+      server.process_batch([(kind, s, f, layer, None)])
+    otm = server.manager.streams[stream_id]
+    assert [otm.layer_position(i) for i in range(len(otm.layers))] == frames
+  # one fish, one track across the dropped frames while it lives
+  assert len(server.manager.streams[0].global_track_store) == 1
+  # and a new track once it expired
+  assert len(server.manager.streams[1].global_track_store) == 2
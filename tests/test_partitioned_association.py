@@ -0,0 +1,60 @@
+import collections
+
+from YoloBox import YoloBox
+from ObjectTrackManager import ObjectTrackManager
+
+
+def box(class_id, x, f, confidence = 0.9):
+  return YoloBox(class_id, [x, 100.0, 40.0, 20.0], f"f{f}", confidence=confidence)
+
+
+def partitioned(layers, **options):
+  o = ObjectTrackManager(layers=layers)
+  o.partition_mode = "category"
+  for k,v in options.items():
+    setattr(o, k, v)
+  # initialize_tracks would date each track by its class id
+  o.active_tracks = collections.deque()
+  for yb in layers[0]:
+    o.create_new_track(yb, 0)
+  o.process_layer(1)
+  return o
+
+
+def test_partitions_never_pair_across_classes():
+  layers = [[box(0, 100.0, 0), box(1, 1000.0, 0)],
+            [box(1, 105.0, 1), box(0, 1005.0, 1)]]
+  o = partitioned(layers)
+  # each detection is beyond the gate of its own class's track
+  assert [yb.parent_track for yb in layers[1]] == [2, 3]
+  assert len(o.global_track_store) == 4
+
+  layers = [[box(0, 100.0, 0), box(1, 1000.0, 0)],
+            [box(1, 105.0, 1), box(0, 1005.0, 1)]]
+  partitioned(layers, partition_mode=None)
+  assert [yb.parent_track for yb in layers[1]] == [0, 1]
+
+
+def test_confusion_map_merges_listed_classes():
+  layers = [[box(0, 100.0, 0), box(2, 1000.0, 0)],
+            [box(1, 105.0, 1), box(2, 102.0, 1)]]
+  o = partitioned(layers, confusion_map={0: "fish", 1: "fish"})
+  # class 1 joins the class 0 track, class 2 keeps its own partition
+  assert [yb.parent_track for yb in layers[1]] == [0, 2]
+  assert len(o.global_track_store) == 3
+
+
+def test_fallback_pass_pairs_low_confidence_with_any_unmatched_track():
+  layers = [[box(0, 100.0, 0), box(0, 1000.0, 0), box(1, 1500.0, 0)],
+            [box(0, 102.0, 1),
+             box(1, 101.0, 1, 0.1),     # its nearest track is taken in the partition pass
+             box(1, 1003.0, 1, 0.1),    # takes the unmatched class 0 track
+             box(1, 1505.0, 1, 0.1)]]   # and its own class's track still counts
+  o = partitioned(layers)
+  assert [yb.parent_track for yb in layers[1]] == [0, 3, 1, 2]
+  assert len(o.global_track_store) == 4
+
+  # at the fallback threshold a detection stays in its partition
+  layers = [[box(0, 100.0, 0)], [box(1, 103.0, 1, 0.3)]]
+  partitioned(layers)
+  assert layers[1][0].parent_track == 1
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from SharedDetectionRing import SharedDetectionRing, DetectionRingConsumer, track_from_ring
+from StreamingObjectTrackManager import ObjectTrackManager
+
+
+@pytest.fixture
+def ring():
+  r = SharedDetectionRing(slots=4, max_dets=8, create=True)
+  yield r
+  r.close()
+
+
+def frame(i):
+  # one fish moving right, its x position tells the frames apart
+  return [[0, 1.0, 100.0 + i, 100.0, 20.0, 10.0]]
+
+
+def polled(consumer):
+  got = consumer.poll()
+  return None if got == None else (got[0], float(got[1][0,2]))
+
+
+def test_consumer_reads_frames_in_order(ring):
+  c = DetectionRingConsumer(ring)
+  for i in range(3):
+    ring.write(i, frame(i))
+  for i in range(3):
+    assert polled(c) == (i, 100.0 + i)
+    assert c.validate()
+  assert c.poll() == None and c.overruns == 0
+
+
+def test_lapped_consumer_resumes_from_the_oldest_frame(ring):
+  c = DetectionRingConsumer(ring)
+  for i in range(10):
+    ring.write(i, frame(i))
+  # frames 0-5 were overwritten, 6-9 are still in the ring
+  assert [polled(c) for _ in range(5)] == [(i, 100.0 + i) for i in range(6, 10)] + [None]
+  assert c.overruns == 6
+
+
+def test_consumer_lapped_onto_a_slot_being_written(ring):
+  c = DetectionRingConsumer(ring)
+  for i in range(4):
+    ring.write(i, frame(i))
+  # the producer has started sequence 5 in the slot of sequence 1
+  ring.meta[0,0] = -5
+  assert polled(c) == (1, 101.0)
+  assert c.overruns == 1
+
+
+def test_frames_overwritten_while_read_are_counted_once(ring):
+  c = DetectionRingConsumer(ring)
+  ring.write(0, frame(0))
+  assert polled(c) == (0, 100.0)
+  for i in range(1, 12):
+    ring.write(i, frame(i))
+  # frame 0 was lost after polling, frames 1-7 before
+  assert not c.validate()
+  assert c.overruns == 1
+  assert polled(c) == (8, 108.0)
+  assert c.overruns == 8
+
+
+def test_tracking_keeps_a_copy_of_each_slot(ring):
+  c = DetectionRingConsumer(ring)
+  otm = ObjectTrackManager()
+  for i in range(3):
+    ring.write(i, frame(i))
+  assert track_from_ring(c, otm, max_frames=3) == 3
+  for i in range(3, 8):
+    ring.write(i, frame(i))
+  assert [float(a[0,2]) for a in otm.layer_arrays.values()] == [100.0, 101.0, 102.0]
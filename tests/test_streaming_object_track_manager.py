@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+from YoloBox import YoloBox
+from StreamingObjectTrackManager import ObjectTrackManager
+from MultiStreamObjectTrackManager import MultiStreamObjectTrackManager
+from TrackerStats import TrackerStats
+
+LIFESPAN = ObjectTrackManager.constants["track_lifespan"]
+
+
+def sighting(f):
+  return [YoloBox(0, [100.0 + f, 100.0, 40.0, 20.0], f"frame_{f}")]
+
+
+def track_frames(o):
+  return sorted([yb.img_filename for yb in T.path] for T in o.global_track_store.values())
+
+
+def manager(budget):
+  o = ObjectTrackManager()
+  o.frame_budget = budget
+  return o
+
+
+def padded(frames, budget):
+  # the reference: every missing frame is an empty layer
+  o = manager(budget)
+  for f in range(frames[-1] + 1):
+    o.add_new_layer(sighting(f) if f in frames else [])
+    o.process_latest_layer()
+  return track_frames(o)
+
+
+def keyed(frames, budget):
+  o = manager(budget)
+  for f in frames:
+    o.add_new_timed_layer(sighting(f), f)
+    o.process_latest_layer()
+  return track_frames(o)
+
+
+def ingested(frames, budget):
+  o = manager(budget)
+  for f in frames:
+    o.ingest_frame(sighting(f), f)
+  o.release_frames(flush=True)
+  return track_frames(o)
+
+
+def multistream(frames, budget):
+  M = MultiStreamObjectTrackManager()
+  M.get_stream("cam").frame_budget = budget
+  for f in frames:
+    M.add_new_layer("cam", sighting(f), f)
+    M.process_tick()
+  return track_frames(M.get_stream("cam"))
+
+
+@pytest.mark.parametrize("budget", [None, 1.0])
+@pytest.mark.parametrize("frames", [[0, 1, LIFESPAN], [0, 1, 1 + LIFESPAN], [0, 1, 2, 9, 10, 11]])
+def test_keyed_ingestion_matches_padded_layers(frames, budget):
+  ref = padded(frames, budget)
+  assert keyed(frames, budget) == ref
+  assert ingested(frames, budget) == ref
+  assert multistream(frames, budget) == ref
+
+
+def test_gaps_beyond_the_lifespan_start_a_new_track():
+  assert len(keyed([0, 1, LIFESPAN], None)) == 1
+  assert len(keyed([0, 1, 1 + LIFESPAN], None)) == 2
+
+
+def school(frames, fish, seed):
+  rng = np.random.default_rng(seed)
+  start = rng.uniform(0, 1900, (fish, 2))
+  velocity = rng.uniform(-4, 4, (fish, 2))
+  return [[YoloBox(0, [float(x), float(y), 40.0, 20.0], f"frame_{f}", confidence=0.9) for x,y in start + velocity * f]
+          for f in range(frames)]
+
+
+def test_multistream_honours_each_streams_configuration():
+  M = MultiStreamObjectTrackManager()
+  configs = {"distance": {}, "iou": {"association_cost": "iou"}, "budget": {"frame_budget": 1.0}}
+  alone = {}
+  for sid,cfg in configs.items():
+    M.get_stream(sid).stats = TrackerStats(enabled=True)
+    o = ObjectTrackManager()
+    for k,v in cfg.items():
+      setattr(M.get_stream(sid), k, v)
+      setattr(o, k, v)
+    for layer in school(6, 20, 1):
+      o.add_new_layer(layer)
+      o.process_latest_layer()
+    alone[sid] = track_frames(o)
+  for f,layers in enumerate(zip(*[school(6, 20, 1) for _ in configs])):
+    for sid,layer in zip(configs, layers):
+      M.add_new_layer(sid, layer, f)
+    M.process_tick()
+  for sid in configs:
+    o = M.get_stream(sid)
+    assert track_frames(o) == alone[sid]
+    snap = o.get_stats()
+    assert snap["frames"]["count"] == 6
+    assert snap["counters"]["pairs_evaluated"] > 0
+  assert M.get_stream("budget").last_frame_report != None
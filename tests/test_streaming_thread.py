@@ -0,0 +1,52 @@
+import concurrent.futures
+import threading
+
+from YoloBox import YoloBox
+from StreamingTrackerThread import StreamingTrackerThread
+
+
+def layer(frame_no, fish = 3):
+  return [YoloBox(0, [100.0 * (i + 1) + frame_no, 100.0, 40.0, 20.0], f"frame_{frame_no}") for i in range(fish)]
+
+
+def test_first_frame_waits_for_earlier_frames():
+  st = StreamingTrackerThread(reorder_window=8, idle_flush=0.05).start()
+  futs = {f: st.submit(f, layer(f)) for f in [2, 1, 0]}
+  st.stop()
+  # all three are tracked, none rejected as late
+  assert [futs[f].result(timeout=5) for f in [0, 1, 2]] == [[0, 1, 2]] * 3
+  assert [st.manager.layer_position(i) for i in range(3)] == [0, 1, 2]
+
+
+def test_cancelled_late_frame_is_skipped():
+  st = StreamingTrackerThread(reorder_window=0, idle_flush=0.05)
+  blocker = threading.Event()
+  # hold the tracker thread so the late frame can be cancelled before it is seen
+  st.call(lambda m: blocker.wait())
+  st.start()
+  first = st.submit(5, layer(5))
+  late = st.submit(4, layer(4))
+  rejected = st.submit(3, layer(3))
+  assert late.cancel()
+  blocker.set()
+  st.stop()
+  assert first.result(timeout=5) == [0, 1, 2]
+  assert late.cancelled()
+  try:
+    rejected.result(timeout=5)
+    assert False, "frame 3 should be rejected"
+  except ValueError:
+    pass
+  assert st.thread.is_alive() == False
+
+
+def test_frames_go_through_the_manager_reorder_buffer():
+  st = StreamingTrackerThread(reorder_window=2, idle_flush=5).start()
+  futs = {f: st.submit(f, layer(f)) for f in [0, 2, 1, 3]}
+  assert futs[3].result(timeout=5) == [0, 1, 2]
+  late = st.submit(1, layer(1))
+  st.stop()
+  assert [futs[f].result(timeout=5) for f in [0, 1, 2]] == [[0, 1, 2]] * 3
+  assert isinstance(late.exception(timeout=5), ValueError)
+  assert st.manager.ingest_stats == {"late": 1, "dropped": 0, "reordered": 1}
+  assert st.waiting == {}
@@ -0,0 +1,46 @@
+from YoloBox import YoloBox
+from ObjectTrackManager import ObjectTrackManager
+
+
+def box(x, y, f, confidence = None):
+  return YoloBox(0, [x, y, 40.0, 20.0], f"f{f}", confidence=confidence)
+
+
+def tiered(layers, high_confidence = 0.5):
+  o = ObjectTrackManager(layers=layers)
+  o.high_confidence = high_confidence
+  o.initialize_tracks()
+  for i in range(1, len(layers)):
+    o.process_layer(i)
+  return o
+
+
+def test_low_confidence_only_reaches_unmatched_tracks():
+  layers = [[box(100.0, 100.0, 0), box(1000.0, 100.0, 0)],
+            [box(110.0, 100.0, 1, 0.9),     # high, takes track 0
+             box(101.0, 100.0, 1, 0.2),     # low, nearer track 0 but it is taken
+             box(1005.0, 100.0, 1, 0.2)]]   # low, takes the still unmatched track 1
+  o = tiered(layers)
+  assert [yb.parent_track for yb in layers[1]] == [0, None, 1]
+  assert len(o.global_track_store) == 2
+
+  # a single pass pairs the low confidence box with its nearest track
+  layers = [[box(100.0, 100.0, 0), box(1000.0, 100.0, 0)],
+            [box(110.0, 100.0, 1, 0.9), box(101.0, 100.0, 1, 0.2), box(1005.0, 100.0, 1, 0.2)]]
+  tiered(layers, None)
+  assert [yb.parent_track for yb in layers[1]] == [2, 0, 1]
+
+
+def test_only_high_confidence_starts_tracks():
+  layers = [[box(100.0, 100.0, 0)],
+            [box(105.0, 100.0, 1, 0.9),
+             box(1500.0, 900.0, 1, 0.2),    # low and beyond every track's gate
+             box(1500.0, 100.0, 1, 0.9),    # high and beyond every track's gate
+             box(900.0, 900.0, 1)],         # no confidence counts as high
+            [box(110.0, 100.0, 2, 0.9),
+             box(1510.0, 100.0, 2, 0.2),    # low may extend a track a high box started
+             box(1500.0, 910.0, 2, 0.2)]]   # but never its own
+  o = tiered(layers)
+  assert [yb.parent_track for yb in layers[1]] == [0, None, 1, 2]
+  assert [yb.parent_track for yb in layers[2]] == [0, 1, None]
+  assert len(o.global_track_store) == 3
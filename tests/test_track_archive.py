@@ -0,0 +1,56 @@
+import sys
+from os import path
+
+import numpy as np
+import pytest
+
+from ObjectTrackManager import ObjectTrackManager
+from TrackArchive import TrackArchive
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "benchmarks"))
+import fish_school
+
+
+def frozen_tracks():
+  files, layers = fish_school.make_layers(frames=40, fish=8, seed=4)
+  o = ObjectTrackManager(filenames=files, layers=layers)
+  o.initialize_tracks()
+  o.process_all_layers()
+  o.close_all_tracks()
+  o.link_all_tracks()
+  # an interpolated step, as interpolate_tracks would leave it
+  o.get_track(o.linked_tracks[0]).path[1].synthetic = True
+  return o
+
+
+def steps(o):
+  fidx = o.get_frame_index()
+  return {k: [(fidx[yb.img_filename], yb.bbox, yb.synthetic) for yb in o.get_track(k).path] for k in o.linked_tracks}
+
+
+@pytest.mark.parametrize("codec,byte", [("lzma", b"x"), ("zlib", b"z")])
+def test_build_save_load_round_trip(tmp_path, codec, byte):
+  o = frozen_tracks()
+  quantum = 0.05
+  archive = TrackArchive.build(o, quantum)
+  archive.save(tmp_path / "tracks.otma", codec)
+  raw = open(tmp_path / "tracks.otma", "rb").read()
+  assert raw[:4] == b"OTMA" and raw[5:6] == byte
+
+  loaded = TrackArchive.load(tmp_path / "tracks.otma")
+  for a,b in zip(archive.decode(), loaded.decode()):
+    assert np.array_equal(a, b)
+  r = loaded.to_manager()
+  assert r.filenames == o.filenames
+  assert r.linked_tracks == o.linked_tracks
+  before, after = steps(o), steps(r)
+  for k in o.linked_tracks:
+    T, R = o.get_track(k), r.get_track(k)
+    assert R.class_id == T.class_id and R.color == tuple(T.color)
+    assert [s[0] for s in after[k]] == [s[0] for s in before[k]]
+    assert [s[2] for s in after[k]] == [s[2] for s in before[k]]
+    error = np.abs(np.array([s[1] for s in after[k]]) - np.array([s[1] for s in before[k]]))
+    assert np.all(error <= quantum / 2 + 1e-9)
+    # the rebuilt track is linked and every box sits in its frame's layer
+    assert all(a.next is b and b.prev is a for a,b in zip(R.path, R.path[1:]))
+    assert all(any(yb is x for x in r.layers[f]) for yb,(f, _, _) in zip(R.path, after[k]))
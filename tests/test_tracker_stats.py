@@ -0,0 +1,82 @@
+import json
+
+import numpy as np
+
+from TrackerStats import TrackerStats
+from YoloBox import YoloBox
+from ObjectTrackManager import ObjectTrackManager
+
+
+def test_frame_times_and_trace_are_bounded(tmp_path):
+  st = TrackerStats(tracing=True, frame_window=10, trace_limit=50)
+  for i in range(200):
+    t = st.start()
+    t = st.lap("pair", t)
+    st.end_frame(t, 3, i)
+  snap = st.snapshot()
+  assert snap["frames"]["count"] == 200
+  assert snap["frames"]["window"] == 10
+  assert len(st.frame_times) == 10
+  assert len(st.trace) == 50
+  st.save_trace(tmp_path / "trace.json")
+  f = open(tmp_path / "trace.json", "r")
+  events = json.load(f)["traceEvents"]
+  f.close()
+  # lane names outlive the events they name
+  assert [e["name"] for e in events[:2]] == ["process_name", "thread_name"]
+  assert len(events) == 52
+
+
+def test_excluded_and_gated_pairs_are_counted_apart():
+  rng = np.random.default_rng(0)
+  layer = lambda i,xy: [YoloBox(c, [x, y, 20.0, 10.0], f"vid.{i:06d}.txt", confidence=0.9)
+                        for c,(x,y) in zip([0, 0, 1, 1], xy)]
+  xy = rng.uniform(0, 1000, (4, 2))
+  # every fish jumps far off its track, the newcomers at a distance are gated
+  o = ObjectTrackManager(layers=[layer(0, xy), layer(1, xy + 500)])
+  o.partition_mode = "category"
+  o.stats = TrackerStats(enabled=True)
+  o.initialize_tracks()
+  o.process_layer(1)
+  c = o.stats.counters
+  # partitioning pairs only same class tracks and detections, 2 x 2 of each
+  assert c["pairs_evaluated"] == 8
+  assert c["pairs_excluded"] == 8
+  assert c["pairs_gated"] > 0
+
+
+def test_worker_stats_merge_into_the_parent():
+  worker, parent = TrackerStats(enabled=True), TrackerStats(enabled=True)
+  for st in (worker, parent):
+    for i in range(3):
+      t = st.start()
+      st.count("pairs_evaluated", 10)
+      st.end_frame(st.lap("pair", t), 2)
+  parent.add_stats(worker.take_stats())
+  assert worker.snapshot()["frames"]["count"] == 0
+  snap = parent.snapshot()
+  assert snap["frames"]["count"] == 6 and len(parent.frame_times) == 6
+  assert snap["counters"]["pairs_evaluated"] == 60
+  assert snap["stages"]["pair"]["count"] == 6
+  assert TrackerStats().take_stats() == None
+
+
+def test_chunk_workers_report_their_frames():
+  import sys
+  from os import path
+  sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "benchmarks"))
+  import fish_school
+  from TrackerStats import STATS
+  from chunk_functions import build_tracks_chunked
+  files, layers = fish_school.make_layers(frames=60, fish=5, seed=1)
+  STATS.enabled = True
+  try:
+    STATS.reset()
+    # recorded before the pool forks, the workers must not count it again
+    STATS.count("frames", 5)
+    build_tracks_chunked(files, layers, chunks=2, overlap=10, workers=2)
+    # the overlap is tracked by both chunks, the first layer of a chunk only starts tracks
+    assert STATS.counters["frames"] == 5 + 60 + 10 - 2
+  finally:
+    STATS.enabled = False
+    STATS.reset()